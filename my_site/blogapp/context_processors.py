@@ -1,12 +1,14 @@
 from django.http import HttpRequest
-from django.urls import reverse
-from django.utils.translation import gettext as _
+from django.utils.translation import gettext_noop as _
 
+from my_site.navigation import NavItem, navigation
 
-def urls_and_name(request: HttpRequest) -> dict[str, tuple[str, str, str]]:
-    return {
-        "urls_blog_path": [
-            ("shop_app:index", _("Home page"), reverse("shop_app:index")),
-            ("blogapp:article_list", _("Articles"), reverse("blogapp:article_list")),
-        ]
-    }
+NAV_ITEMS: tuple[NavItem, ...] = (
+    ("shop_app:index", _("Home page")),
+    ("blogapp:article_list", _("Articles")),
+)
+
+
+def urls_and_name(request: HttpRequest) -> dict[str, object]:
+    """Navigation links of the blog pages, built lazily once per language, see my_site.navigation."""
+    return {"urls_blog_path": navigation(NAV_ITEMS)}
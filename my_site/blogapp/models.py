@@ -82,6 +82,7 @@ class Article(models.Model):
     title = models.CharField(max_length=200, verbose_name=_("title"), db_index=True)
     content = models.TextField(verbose_name=_("content"))
     pub_date = models.DateTimeField(null=True, blank=True, verbose_name=_("date of publication"))
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_("updated at"))
     author = models.ForeignKey(
         Author,
         on_delete=models.CASCADE,
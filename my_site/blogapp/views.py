@@ -3,11 +3,17 @@ This module contains views for displaying articles in a Django application.
 It includes a list view for multiple articles and a detail view for a single article.
 """
 
+from typing import Any
+
 from django.contrib.syndication.views import Feed
+from django.http import HttpRequest, HttpResponse
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import DetailView, ListView
 
+from my_site.conditional import State, conditional_view, table_state
+
 from .models import Article
 
 
@@ -43,6 +49,11 @@ class ArticleDetailView(DetailView):
     )
 
 
+def articles_state(request: HttpRequest, *args: Any, **kwargs: Any) -> State:
+    """Returns the validators of the pages listing articles."""
+    return table_state(Article.objects.all())
+
+
 class LatestArticlesFeed(Feed):
     """
     Class for displaying news feed RSS.
@@ -52,6 +63,11 @@ class LatestArticlesFeed(Feed):
     description: str = _("Updates on changes and addition blog articles")
     link: str = reverse_lazy("blogapp:article_list")
 
+    @method_decorator(conditional_view(articles_state))
+    def __call__(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        """Returns the feed, or 304 while the articles are unchanged."""
+        return super().__call__(request, *args, **kwargs)
+
     def items(self):
         return (
             Article.objects.filter(pub_date__isnull=False)
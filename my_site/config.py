@@ -24,6 +24,8 @@ class Settings(BaseSettings):
     loglevel: Annotated[str, Field(default="debug")]
     django_debug: Annotated[bool, Field(default=False)]
     django_allowed_hosts: Annotated[str, Field(default="localhost")]
+    export_accel_redirect: Annotated[bool, Field(default=False)]
+    throttling_trusted_proxies: int = 0
     env_path: Path = Path(__file__).resolve().parent.parent.joinpath(".env")
 
     model_config: SettingsConfigDict = SettingsConfigDict(
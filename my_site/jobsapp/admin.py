@@ -0,0 +1,27 @@
+from django.contrib import admin
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display: list[str] = ["id", "task", "status", "progress", "total", "created_by", "created_at"]
+    list_filter: list[str] = ["status", "task"]
+    ordering: list[str] = ["-id"]
+    readonly_fields: list[str] = [
+        "task",
+        "payload",
+        "status",
+        "progress",
+        "total",
+        "result",
+        "error",
+        "created_by",
+        "created_at",
+        "started_at",
+        "finished_at",
+    ]
+
+    def has_add_permission(self, request) -> bool:
+        """Jobs are created by the application only."""
+        return False
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+from django.utils.translation import gettext_lazy as _
+
+
+class JobsappConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'jobsapp'
+    verbose_name = _("background jobs")
+
+    def ready(self) -> None:
+        """Register the tasks declared in the tasks.py modules of the installed apps."""
+        autodiscover_modules("tasks")
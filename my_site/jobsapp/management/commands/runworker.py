@@ -0,0 +1,110 @@
+"""
+This module contains a Django management command that executes background jobs.
+
+The command polls the Job table, claims pending jobs with an atomic UPDATE and runs
+them in a process pool, so only the database is needed to exchange work with the
+web processes. The command saves the heartbeat of the running jobs, and replaces the
+pool when one of its processes crashed, failing the jobs it was running.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.core.management.base import CommandParser
+from django.utils import timezone
+
+from ...models import Job
+from ...queue import claim_next
+from ...worker import execute, init_worker
+
+
+class Command(BaseCommand):
+    """Django management command to run background jobs in a process pool."""
+
+    help: str = "Run background jobs"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add command line arguments for the command."""
+        parser.add_argument(
+            "--processes", type=int, default=os.cpu_count() or 1, help="Number of worker processes"
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=1.0, help="Seconds between checks for new jobs"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Run the pending jobs and exit"
+        )
+
+    @classmethod
+    def create_pool(cls, processes: int) -> ProcessPoolExecutor:
+        """Returns a pool of spawned worker processes with Django set up."""
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+
+    def fail(self, pk: int, exc: BaseException) -> None:
+        """Saves the failure of a job whose worker process died before it could save the job state."""
+        Job.objects.filter(pk=pk).update(status=Job.Status.FAILED, error=repr(exc), finished_at=timezone.now())
+        self.stdout.write(self.style.ERROR(f"Job {pk} crashed: {exc!r}"))
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Claim pending jobs while there are free worker processes and wait for them."""
+        processes: int = max(options["processes"], 1)
+        poll_interval: float = options["poll_interval"]
+        running: dict[Future[str], int] = {}
+        heartbeat: float = time.monotonic()
+
+        self.stdout.write(f"Start worker with {processes} processes")
+
+        pool: ProcessPoolExecutor = self.create_pool(processes)
+        try:
+            while True:
+                while len(running) < processes and (pk := claim_next()) is not None:
+                    self.stdout.write(f"Run job {pk}")
+                    try:
+                        future: Future[str] = pool.submit(execute, pk)
+                    except BrokenProcessPool as exc:
+                        # a worker process crashed, e.g. killed when out of memory, the pool is unusable
+                        # and the jobs it was running are lost
+                        for running_pk in running.values():
+                            self.fail(running_pk, exc)
+                        running.clear()
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = self.create_pool(processes)
+                        future = pool.submit(execute, pk)
+                    running[future] = pk
+
+                if options["once"] and not running:
+                    break
+
+                if not running:
+                    time.sleep(poll_interval)
+                    continue
+
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    pk = running.pop(future)
+                    try:
+                        self.stdout.write(f"Job {pk} {future.result()}")
+                    except Exception as exc:
+                        # the worker process died before it could save the job state
+                        self.fail(pk, exc)
+
+                if time.monotonic() - heartbeat >= settings.JOB_HEARTBEAT_INTERVAL:
+                    Job.heartbeat(running.values())
+                    heartbeat = time.monotonic()
+        except KeyboardInterrupt:
+            self.stdout.write("Waiting for the running jobs")
+        finally:
+            pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,121 @@
+"""
+Models for the background jobs application.
+
+A job is a row of the Job table: the web process inserts it with the status 'pending'
+and the `runworker` command claims and executes it in a process pool.
+"""
+
+from typing import Any, Iterable
+
+from django.contrib.auth.models import User
+from django.db import models
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class Job(models.Model):
+    """
+    The job model represents a task executed outside of the request.
+
+    Attributes:
+        task (str): The registered name of the task function.
+        payload (dict): Keyword arguments of the task.
+        status (str): The current state of the job.
+        progress (int): Number of processed items.
+        total (int): Number of items to process, if it is known in advance.
+        result (dict): The value returned by the task.
+        error (str): The traceback of the failed task.
+        heartbeat_at (datetime): The last time the running job was known to be alive.
+    """
+
+    class Status(models.TextChoices):
+        """States of the job."""
+
+        PENDING = "pending", _("pending")
+        RUNNING = "running", _("running")
+        SUCCEEDED = "succeeded", _("succeeded")
+        FAILED = "failed", _("failed")
+
+    task = models.CharField(max_length=200, verbose_name=_("task"))
+    payload = models.JSONField(default=dict, blank=True, verbose_name=_("payload"))
+    status = models.CharField(
+        max_length=10, choices=Status, default=Status.PENDING, verbose_name=_("status")
+    )
+    progress = models.PositiveIntegerField(default=0, verbose_name=_("progress"))
+    total = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("total"))
+    result = models.JSONField(null=True, blank=True, verbose_name=_("result"))
+    error = models.TextField(blank=True, verbose_name=_("error"))
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name="jobs",
+        null=True,
+        blank=True,
+        verbose_name=_("created by"),
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("created at"))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_("started at"))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_("finished at"))
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name=_("heartbeat at"))
+
+    class Meta:
+        """
+        Meta options for the Job model.
+
+        Attributes:
+            ordering (list): Default ordering for the Job model.
+            indexes (list): The index used by workers to find pending jobs.
+        """
+
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+        verbose_name = _("job")
+        verbose_name_plural = _("jobs")
+
+    def __str__(self) -> str:
+        """Return a string representation of the job."""
+        return _("Job № %(pk)s %(task)s") % {"pk": self.pk, "task": self.task}
+
+    def get_absolute_url(self) -> str:
+        """Returns the URL for polling the job status."""
+        return reverse("jobsapp:job_status", kwargs={"pk": self.pk})
+
+    def set_progress(self, progress: int, total: int | None = None) -> None:
+        """Saves the progress of the running job and its heartbeat with a single UPDATE query."""
+        self.progress = progress
+        fields: dict[str, Any] = {"progress": progress, "heartbeat_at": timezone.now()}
+
+        if total is not None:
+            self.total = fields["total"] = total
+
+        Job.objects.filter(pk=self.pk).update(**fields)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns the job state as a JSON-serializable dictionary."""
+        return {
+            "pk": self.pk,
+            "task": self.task,
+            "status": self.status,
+            "progress": self.progress,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error.strip().splitlines()[-1] if self.error else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def claim(cls, pk: int) -> bool:
+        """Atomically moves a pending job to the running state, returns False if another worker took it."""
+        return bool(
+            cls.objects.filter(pk=pk, status=cls.Status.PENDING).update(
+                status=cls.Status.RUNNING, started_at=timezone.now(), heartbeat_at=timezone.now()
+            )
+        )
+
+    @classmethod
+    def heartbeat(cls, pks: Iterable[int]) -> None:
+        """Marks the running jobs as alive, so they are not requeued, see jobsapp.queue.requeue_expired()."""
+        cls.objects.filter(pk__in=list(pks), status=cls.Status.RUNNING).update(heartbeat_at=timezone.now())
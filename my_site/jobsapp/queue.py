@@ -0,0 +1,132 @@
+"""
+Enqueue API of the background jobs.
+
+Tasks are plain functions decorated with `task` in the tasks.py module of an app.
+They receive the Job instance as the first argument and the payload as keyword
+arguments, the returned value is saved as the job result.
+"""
+
+import logging
+import traceback
+from datetime import timedelta
+from typing import Any, Callable
+
+from django.conf import settings
+from django.contrib.auth.models import AbstractBaseUser, AnonymousUser
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TaskFunction = Callable[..., Any]
+
+registry: dict[str, TaskFunction] = {}
+
+
+def task(func: TaskFunction) -> TaskFunction:
+    """Decorator that registers a function as a job task under its dotted path."""
+    registry[f"{func.__module__}.{func.__name__}"] = func
+    return func
+
+
+def enqueue(func: TaskFunction, user: AbstractBaseUser | AnonymousUser | None = None, **payload: Any) -> Job:
+    """
+    Creates a pending job for the registered task.
+
+    Args:
+        func (Callable): The task function.
+        user (User): The user who started the job, anonymous users are not saved.
+        **payload: JSON-serializable keyword arguments of the task.
+
+    Returns:
+        Job: The created job.
+    """
+    name: str = f"{func.__module__}.{func.__name__}"
+
+    if registry.get(name) is not func:
+        raise ValueError(f"Function {name} is not registered as a task")
+
+    created_by = user if user is not None and user.is_authenticated else None
+    job: Job = Job.objects.create(task=name, payload=payload, created_by=created_by)
+    logger.info("Enqueued job %s %s", job.pk, name)
+    return job
+
+
+def enqueue_once(func: TaskFunction, **payload: Any) -> Job:
+    """
+    Returns the pending job of the task with the same payload, or enqueues a new one.
+
+    Bursts of triggers, e.g. of saved rows, are coalesced into a single job.
+    """
+    job: Job | None = Job.objects.filter(
+        task=f"{func.__module__}.{func.__name__}", status=Job.Status.PENDING, payload=payload
+    ).first()
+    return job or enqueue(func, **payload)
+
+
+def upload_storage() -> FileSystemStorage:
+    """Returns the storage of the uploaded files, settings.JOB_UPLOAD_ROOT outside MEDIA_ROOT so it is never served."""
+    return FileSystemStorage(location=settings.JOB_UPLOAD_ROOT)
+
+
+def store_upload(uploaded_file: File) -> str:
+    """Saves the uploaded file to the upload storage, so a worker can read it, and returns its name."""
+    return upload_storage().save(uploaded_file.name or "upload", uploaded_file)
+
+
+def requeue_expired() -> int:
+    """
+    Moves back to pending the running jobs without a heartbeat for settings.JOB_LEASE_TIMEOUT seconds.
+
+    The heartbeat of a running job is saved by its progress and by the runworker
+    command every settings.JOB_HEARTBEAT_INTERVAL seconds, so a job stays running
+    without it only if its worker was killed, e.g. by a deployment, before it saved
+    the job state. Returns the number of requeued jobs.
+    """
+    expired = timezone.now() - timedelta(seconds=settings.JOB_LEASE_TIMEOUT)
+    requeued: int = Job.objects.filter(status=Job.Status.RUNNING, heartbeat_at__lt=expired).update(
+        status=Job.Status.PENDING, started_at=None, heartbeat_at=None
+    )
+    if requeued:
+        logger.warning("Requeued %d jobs without heartbeat for %s seconds", requeued, settings.JOB_LEASE_TIMEOUT)
+    return requeued
+
+
+def claim_next(limit: int = 10) -> int | None:
+    """Claims the oldest pending job and returns its id, or None if there are no pending jobs."""
+    requeue_expired()
+    pending = Job.objects.filter(status=Job.Status.PENDING).order_by("created_at", "pk")
+
+    for pk in pending.values_list("pk", flat=True)[:limit]:
+        if Job.claim(pk):
+            return pk
+
+    return None
+
+
+def run_job(pk: int) -> str:
+    """
+    Executes a claimed job and saves its result or error.
+
+    Returns:
+        str: The final status of the job.
+    """
+    job: Job = Job.objects.get(pk=pk)
+
+    try:
+        result: Any = registry[job.task](job, **job.payload)
+    except Exception:
+        logger.exception("Job %s %s failed", job.pk, job.task)
+        job.status = Job.Status.FAILED
+        job.error = traceback.format_exc()
+        job.result = None
+    else:
+        job.status = Job.Status.SUCCEEDED
+        job.result = result
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "result", "error", "finished_at"])
+    return job.status
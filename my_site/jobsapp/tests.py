@@ -0,0 +1,151 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .management.commands.runworker import Command
+from .models import Job
+from .queue import claim_next, enqueue, run_job, task
+
+
+@task
+def add_numbers(job: Job, num1: int, num2: int) -> dict[str, int]:
+    job.set_progress(1, total=1)
+    return {"sum": num1 + num2}
+
+
+@task
+def fail(job: Job) -> None:
+    raise ValueError("Something went wrong")
+
+
+def not_registered(job: Job) -> None:
+    pass
+
+
+class JobQueueTestCase(TestCase):
+    def test_run_job(self):
+        job = enqueue(add_numbers, num1=2, num2=3)
+        self.assertEqual(job.status, Job.Status.PENDING)
+
+        self.assertEqual(claim_next(), job.pk)
+        self.assertIsNone(claim_next())
+        self.assertEqual(run_job(job.pk), Job.Status.SUCCEEDED)
+
+        job.refresh_from_db()
+        self.assertEqual(job.result, {"sum": 5})
+        self.assertEqual((job.progress, job.total), (1, 1))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_run_failed_job(self):
+        job = enqueue(fail)
+        claim_next()
+
+        with self.assertLogs("jobsapp.queue", "ERROR"):
+            self.assertEqual(run_job(job.pk), Job.Status.FAILED)
+        job.refresh_from_db()
+        self.assertIn("ValueError: Something went wrong", job.error)
+
+    def test_enqueue_not_registered_function(self):
+        with self.assertRaises(ValueError):
+            enqueue(not_registered)
+
+    @override_settings(JOB_LEASE_TIMEOUT=60)
+    def test_expired_running_job_is_requeued(self):
+        job = enqueue(add_numbers, num1=1, num2=1)
+        self.assertEqual(claim_next(), job.pk)
+        self.assertIsNone(claim_next())
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        with self.assertLogs("jobsapp.queue", "WARNING"):
+            self.assertEqual(claim_next(), job.pk)
+
+    @override_settings(JOB_LEASE_TIMEOUT=60)
+    def test_long_running_job_with_heartbeat_is_not_requeued(self):
+        job = enqueue(add_numbers, num1=1, num2=1)
+        self.assertEqual(claim_next(), job.pk)
+        Job.objects.filter(pk=job.pk).update(
+            started_at=timezone.now() - timedelta(hours=1), heartbeat_at=timezone.now() - timedelta(seconds=61)
+        )
+
+        Job.objects.get(pk=job.pk).set_progress(10)
+        self.assertIsNone(claim_next())
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        Job.heartbeat([job.pk])
+        self.assertIsNone(claim_next())
+
+
+class InlinePool:
+    """Process pool running the jobs in the test process, broken after `jobs` jobs like after a crash."""
+
+    def __init__(self, jobs: int | None = None) -> None:
+        self.jobs = jobs
+
+    def submit(self, func, pk):
+        if self.jobs == 0:
+            raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+        future = Future()
+        if self.jobs is None:
+            future.set_result(run_job(pk))
+        else:
+            self.jobs -= 1
+            future.set_exception(BrokenProcessPool("A process in the process pool was terminated abruptly"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class RunWorkerTestCase(TestCase):
+    def test_crashed_pool_is_replaced(self):
+        crashed = enqueue(add_numbers, num1=1, num2=1)
+        job = enqueue(add_numbers, num1=2, num2=2)
+
+        pools = [InlinePool(jobs=1), InlinePool()]
+        with mock.patch.object(Command, "create_pool", side_effect=pools):
+            call_command("runworker", processes=1, once=True, stdout=StringIO())
+
+        crashed.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual(crashed.status, Job.Status.FAILED)
+        self.assertIn("BrokenProcessPool", crashed.error)
+        self.assertEqual(job.status, Job.Status.SUCCEEDED)
+
+
+class JobStatusViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username="job-owner", password="qwerty123")
+        cls.other = User.objects.create_user(username="job-other", password="qwerty123")
+
+    def test_get_job_status(self):
+        job = enqueue(add_numbers, user=self.owner, num1=1, num2=1)
+        self.client.force_login(self.owner)
+
+        response = self.client.get(reverse("jobsapp:job_status", kwargs={"pk": job.pk}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "pending")
+
+    def test_get_job_status_of_other_user(self):
+        job = enqueue(add_numbers, user=self.owner, num1=1, num2=1)
+        self.client.force_login(self.other)
+
+        response = self.client.get(reverse("jobsapp:job_status", kwargs={"pk": job.pk}))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_job_status_of_anonymous_user(self):
+        job = enqueue(add_numbers, num1=1, num2=1)
+        url = reverse("jobsapp:job_status", kwargs={"pk": job.pk})
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url).status_code, 404)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from .views import JobStatusView
+
+app_name: str = "jobsapp"
+
+urlpatterns = [
+    path("<int:pk>/", JobStatusView.as_view(), name="job_status"),
+]
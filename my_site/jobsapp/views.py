@@ -0,0 +1,29 @@
+"""
+This module contains the view for polling the status of a background job.
+"""
+
+from django.http import Http404, HttpRequest, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.translation import gettext_lazy as _
+from django.views import View
+
+from .models import Job
+
+
+class JobStatusView(View):
+    """
+    Returns the status and progress of a job in JSON format.
+
+    A job is visible to the user who started it and to staff only, the jobs of
+    anonymous users to staff only.
+    """
+
+    def get(self, request: HttpRequest, pk: int) -> JsonResponse:
+        """Handle GET requests for the job status."""
+        job: Job = get_object_or_404(Job, pk=pk)
+
+        is_owner: bool = job.created_by_id is not None and job.created_by_id == request.user.pk
+        if not is_owner and not request.user.is_staff:
+            raise Http404(_("Job not found."))
+
+        return JsonResponse(job.as_dict())
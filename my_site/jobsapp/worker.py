@@ -0,0 +1,20 @@
+"""
+Entry points of the worker processes.
+
+The module must not import models at the top level: worker processes are spawned
+and import it before Django is set up.
+"""
+
+import django
+
+
+def init_worker() -> None:
+    """Prepare Django in a freshly spawned worker process."""
+    django.setup()
+
+
+def execute(pk: int) -> str:
+    """Runs the job in the worker process and returns its final status."""
+    from .queue import run_job
+
+    return run_job(pk)
@@ -6,7 +6,9 @@ import sys
 
 def main() -> None:
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'my_site.settings')
+    # the tests never touch the cache, throttling and metrics storage of the server, see my_site.test_settings
+    settings_module = 'my_site.test_settings' if sys.argv[1:2] == ['test'] else 'my_site.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -0,0 +1,455 @@
+"""
+Two-level cache backend of the project.
+
+L1 is a bounded in-process LRU with a per-key TTL, it serves repeated reads of a
+worker without any I/O. L2 is a SQLite file in WAL mode shared by all worker
+processes of a host, so a value computed by one gunicorn worker is reused by the
+others. Reads go L1 -> L2, writes go to both levels. A value deleted or changed by
+another process is served from L1 for L1_TIMEOUT seconds at most.
+
+Integers are never kept in L1: they are the counters, versions and locks changed by
+other processes, e.g. the versions of shop_app.invalidation, which must be read
+fresh, while the values keyed by a version never change.
+
+Values are pickled once when they are set and kept as bytes in both levels, so
+every get returns an independent copy. Integers are stored as SQLite integers,
+which makes incr() an atomic UPDATE usable for counters.
+
+Hits, misses and evictions are counted per key prefix, the leading letters,
+underscores and dashes of the key, e.g. "user_orders_data_export" for
+"user_orders_data_export5". The counters of a process are added to a table of
+the L2 file every STATS_FLUSH_INTERVAL seconds, see TieredCache.stats().
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Iterable
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.regex_helper import _lazy_re_compile
+
+logger = logging.getLogger(__name__)
+
+re_key_prefix = _lazy_re_compile(r"[A-Za-z_\-]+")
+
+# expiration time of the values without a timeout
+NEVER: float = 253402300799.0
+# maximal number of SQLite variables of one statement
+BATCH_SIZE: int = 500
+
+
+def key_prefix(key: str) -> str:
+    """Returns the prefix of a cache key used to group the statistics."""
+    match = re_key_prefix.match(key)
+    return match.group() if match else key[:20]
+
+
+def encode(value: Any) -> int | bytes:
+    """Returns the stored representation of a value, integers are stored as is."""
+    if type(value) is int and -(2**63) <= value < 2**63:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(stored: int | bytes) -> Any:
+    """Returns the value of a stored representation."""
+    return stored if isinstance(stored, int) else pickle.loads(stored)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache backend storing the values in a SQLite file shared by the processes of a host.
+
+    LOCATION is the path of the file. The number of entries is checked every
+    OPTIONS["CULL_EVERY"] writes of a process, expired entries are deleted first,
+    then the entries expiring first while MAX_ENTRIES is exceeded.
+    """
+
+    def __init__(self, location: str, params: dict[str, Any]) -> None:
+        super().__init__(params)
+        options: dict[str, Any] = params.get("OPTIONS", {})
+        self.path: str = str(location)
+        self.cull_every: int = options.get("CULL_EVERY", 100)
+        self.writes: int = 0
+        self.local: threading.local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread, a forked process opens its own connection."""
+        if getattr(self.local, "pid", None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection: sqlite3.Connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_stats "
+                "(prefix TEXT NOT NULL, counter TEXT NOT NULL, value INTEGER NOT NULL, PRIMARY KEY (prefix, counter))"
+            )
+            self.local.connection, self.local.pid = connection, os.getpid()
+        connection = self.local.connection
+        return connection
+
+    def expires(self, timeout: float | None) -> float:
+        """Returns the expiration time of a timeout."""
+        expires: float | None = self.get_backend_timeout(timeout)
+        return NEVER if expires is None else expires
+
+    # operations on made keys and stored values, shared with TieredCache
+
+    def get_stored(self, keys: Iterable[str]) -> dict[str, int | bytes]:
+        """Returns the stored values of the keys which are not expired."""
+        return {key: stored for key, (expires, stored) in self.get_entries(keys).items()}
+
+    def get_entries(self, keys: Iterable[str]) -> dict[str, tuple[float, int | bytes]]:
+        """Returns the expiration times and stored values of the keys which are not expired."""
+        found: dict[str, tuple[float, int | bytes]] = {}
+        keys = list(keys)
+        now: float = time.time()
+
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch: list[str] = keys[start : start + BATCH_SIZE]
+            for key, value, expires in self.connection.execute(
+                f"SELECT key, value, expires FROM cache WHERE key IN ({', '.join('?' * len(batch))}) AND expires > ?",
+                (*batch, now),
+            ):
+                found[key] = (expires, value)
+
+        return found
+
+    def set_stored(self, rows: dict[str, int | bytes], expires: float) -> list[str]:
+        """Stores the values and returns the keys evicted alive to respect MAX_ENTRIES."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+                ((key, value, expires) for key, value in rows.items()),
+            )
+
+        self.writes += len(rows)
+        if self.writes >= self.cull_every:
+            self.writes = 0
+            return self.cull()
+        return []
+
+    def add_stored(self, key: str, value: int | bytes, expires: float) -> bool:
+        """Stores the value unless the key holds a value which is not expired, atomically."""
+        cursor: sqlite3.Cursor = self.connection.execute(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+            "WHERE cache.expires <= ?",
+            (key, value, expires, time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete_stored(self, keys: Iterable[str]) -> int:
+        """Deletes the keys and returns the number of deleted entries."""
+        keys = list(keys)
+        deleted: int = 0
+
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch: list[str] = keys[start : start + BATCH_SIZE]
+            deleted += self.connection.execute(
+                f"DELETE FROM cache WHERE key IN ({', '.join('?' * len(batch))})", batch
+            ).rowcount
+
+        return deleted
+
+    def incr_stored(self, key: str, delta: int) -> int:
+        """
+        Adds delta to an integer value in one UPDATE statement.
+
+        Raises:
+            ValueError: If the key does not exist or its value is not an integer.
+        """
+        row: tuple[int] | None = self.connection.execute(
+            "UPDATE cache SET value = value + ? WHERE key = ? AND expires > ? AND typeof(value) = 'integer' "
+            "RETURNING value",
+            (delta, key, time.time()),
+        ).fetchone()
+
+        if row is None:
+            raise ValueError("Key '%s' not found or not an integer" % key)
+        return row[0]
+
+    def cull(self) -> list[str]:
+        """Deletes the expired entries and the entries over MAX_ENTRIES, returns the keys evicted alive."""
+        with self.connection:
+            self.connection.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+            (count,) = self.connection.execute("SELECT COUNT(*) FROM cache").fetchone()
+
+            if count <= self._max_entries:
+                return []
+
+            rows = self.connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?) RETURNING key",
+                (max(count - self._max_entries, count // self._cull_frequency),),
+            ).fetchall()
+
+        return [key for (key,) in rows]
+
+    def add_stats(self, counters: dict[tuple[str, str], int]) -> None:
+        """Adds the counters of a process to the shared statistics."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO cache_stats (prefix, counter, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (prefix, counter) DO UPDATE SET value = value + excluded.value",
+                ((prefix, counter, value) for (prefix, counter), value in counters.items()),
+            )
+
+    def get_stats(self) -> dict[str, dict[str, int]]:
+        """Returns the shared statistics by key prefix."""
+        stats: dict[str, dict[str, int]] = {}
+
+        for prefix, counter, value in self.connection.execute("SELECT prefix, counter, value FROM cache_stats"):
+            stats.setdefault(prefix, {})[counter] = value
+
+        return stats
+
+    # Django cache API
+
+    def add(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:
+        return self.add_stored(self.make_and_validate_key(key, version), encode(value), self.expires(timeout))
+
+    def get(self, key: str, default: Any = None, version: int | None = None) -> Any:
+        made_key: str = self.make_and_validate_key(key, version)
+        stored: int | bytes | None = self.get_stored([made_key]).get(made_key)
+        return default if stored is None else decode(stored)
+
+    def get_many(self, keys: Iterable[str], version: int | None = None) -> dict[str, Any]:
+        made_keys: dict[str, str] = {self.make_and_validate_key(key, version): key for key in keys}
+        return {made_keys[key]: decode(stored) for key, stored in self.get_stored(made_keys).items()}
+
+    def set(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> None:
+        self.set_stored({self.make_and_validate_key(key, version): encode(value)}, self.expires(timeout))
+
+    def set_many(
+        self, data: dict[str, Any], timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None
+    ) -> list[str]:
+        rows: dict[str, int | bytes] = {
+            self.make_and_validate_key(key, version): encode(value) for key, value in data.items()
+        }
+        self.set_stored(rows, self.expires(timeout))
+        return []
+
+    def touch(self, key: str, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:
+        cursor: sqlite3.Cursor = self.connection.execute(
+            "UPDATE cache SET expires = ? WHERE key = ? AND expires > ?",
+            (self.expires(timeout), self.make_and_validate_key(key, version), time.time()),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key: str, version: int | None = None) -> bool:
+        return self.delete_stored([self.make_and_validate_key(key, version)]) == 1
+
+    def delete_many(self, keys: Iterable[str], version: int | None = None) -> None:
+        self.delete_stored(self.make_and_validate_key(key, version) for key in keys)
+
+    def has_key(self, key: str, version: int | None = None) -> bool:
+        made_key: str = self.make_and_validate_key(key, version)
+        return made_key in self.get_stored([made_key])
+
+    def incr(self, key: str, delta: int = 1, version: int | None = None) -> int:
+        return self.incr_stored(self.make_and_validate_key(key, version), delta)
+
+    def clear(self) -> None:
+        self.connection.execute("DELETE FROM cache")
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend with an in-process LRU (L1) in front of a shared SQLiteCache (L2).
+
+    OPTIONS:
+        L1_MAX_ENTRIES (int): Size of the LRU of a process, 1000 by default.
+        L1_TIMEOUT (float): Maximal seconds a value is served from the LRU, 5 by default.
+            A value deleted or changed by another process is seen after this delay.
+        STATS_FLUSH_INTERVAL (float): Seconds between the flushes of the statistics, 10 by default.
+        The other options, e.g. MAX_ENTRIES, apply to L2.
+    """
+
+    def __init__(self, location: str, params: dict[str, Any]) -> None:
+        super().__init__(params)
+        options: dict[str, Any] = dict(params.get("OPTIONS", {}))
+        self.l1_max_entries: int = options.pop("L1_MAX_ENTRIES", 1000)
+        self.l1_timeout: float = options.pop("L1_TIMEOUT", 5)
+        self.stats_flush_interval: float = options.pop("STATS_FLUSH_INTERVAL", 10)
+        self.l2: SQLiteCache = SQLiteCache(location, {**params, "OPTIONS": options})
+        self.l1: OrderedDict[str, tuple[float, int | bytes]] = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.counters: Counter[tuple[str, str]] = Counter()
+        self.flushed_at: float = time.monotonic()
+
+    def count(self, key: str, counter: str, value: int = 1) -> None:
+        """Counts an event of a key and flushes the counters to L2 when the interval has passed."""
+        with self.lock:
+            self.counters[key_prefix(key), counter] += value
+            due: bool = time.monotonic() - self.flushed_at >= self.stats_flush_interval
+
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self) -> None:
+        """Adds the counters of the process to the shared statistics."""
+        with self.lock:
+            counters, self.counters = self.counters, Counter()
+            self.flushed_at = time.monotonic()
+
+        if counters:
+            try:
+                self.l2.add_stats(counters)
+            except sqlite3.Error:
+                logger.exception("Cache statistics are not saved")
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Returns the statistics of all processes by key prefix.
+
+        The counters are l1_hits, l2_hits, misses and evictions of live values,
+        the hit ratio of a prefix is (l1_hits + l2_hits) / (l1_hits + l2_hits + misses).
+        """
+        self.flush_stats()
+        return self.l2.get_stats()
+
+    def l1_get(self, made_key: str) -> int | bytes | None:
+        """Returns the value of the LRU and marks it as recently used, expired values are dropped."""
+        with self.lock:
+            entry: tuple[float, int | bytes] | None = self.l1.get(made_key)
+
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.l1[made_key]
+                return None
+
+            self.l1.move_to_end(made_key)
+            return entry[1]
+
+    def l1_set(self, rows: dict[str, int | bytes], expires: float) -> None:
+        """Puts the pickled values to the LRU and evicts the least recently used ones over L1_MAX_ENTRIES."""
+        expires = min(expires, time.time() + self.l1_timeout)
+        evicted: list[str] = []
+
+        with self.lock:
+            for made_key, stored in rows.items():
+                if isinstance(stored, int):
+                    # integers are read from L2, see the module docstring
+                    self.l1.pop(made_key, None)
+                    continue
+                self.l1[made_key] = (expires, stored)
+                self.l1.move_to_end(made_key)
+
+            while len(self.l1) > self.l1_max_entries:
+                evicted.append(self.l1.popitem(last=False)[0])
+
+        for made_key in evicted:
+            self.count(self.raw_key(made_key), "evictions")
+
+    def l1_delete(self, made_keys: Iterable[str]) -> None:
+        with self.lock:
+            for made_key in made_keys:
+                self.l1.pop(made_key, None)
+
+    def raw_key(self, made_key: str) -> str:
+        """Returns the key without the key prefix and the version added by the default key function."""
+        return made_key.split(":", 2)[-1]
+
+    def add(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:
+        made_key: str = self.make_and_validate_key(key, version)
+        stored: int | bytes = encode(value)
+        expires: float = self.l2.expires(timeout)
+
+        if not self.l2.add_stored(made_key, stored, expires):
+            return False
+
+        self.l1_set({made_key: stored}, expires)
+        return True
+
+    def get(self, key: str, default: Any = None, version: int | None = None) -> Any:
+        made_key: str = self.make_and_validate_key(key, version)
+        found: dict[str, Any] = self.get_made([made_key], {made_key: key})
+        return found.get(key, default)
+
+    def get_many(self, keys: Iterable[str], version: int | None = None) -> dict[str, Any]:
+        made_keys: dict[str, str] = {self.make_and_validate_key(key, version): key for key in keys}
+        return self.get_made(list(made_keys), made_keys)
+
+    def get_made(self, made_keys: list[str], raw_keys: dict[str, str]) -> dict[str, Any]:
+        """Reads the keys from L1, the missing ones with one query from L2, and counts the hits and misses."""
+        found: dict[str, Any] = {}
+        missing: list[str] = []
+
+        for made_key in made_keys:
+            stored: int | bytes | None = self.l1_get(made_key)
+            if stored is None:
+                missing.append(made_key)
+            else:
+                found[raw_keys[made_key]] = decode(stored)
+                self.count(raw_keys[made_key], "l1_hits")
+
+        if missing:
+            entries: dict[str, tuple[float, int | bytes]] = self.l2.get_entries(missing)
+
+            for made_key in missing:
+                if made_key in entries:
+                    # L1 keeps the value for L1_TIMEOUT at most, never after it expires in L2
+                    expires, stored = entries[made_key]
+                    self.l1_set({made_key: stored}, expires)
+                    found[raw_keys[made_key]] = decode(stored)
+                    self.count(raw_keys[made_key], "l2_hits")
+                else:
+                    self.count(raw_keys[made_key], "misses")
+
+        return found
+
+    def set(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> None:
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(
+        self, data: dict[str, Any], timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None
+    ) -> list[str]:
+        rows: dict[str, int | bytes] = {
+            self.make_and_validate_key(key, version): encode(value) for key, value in data.items()
+        }
+        expires: float = self.l2.expires(timeout)
+        for made_key in self.l2.set_stored(rows, expires):
+            self.count(self.raw_key(made_key), "evictions")
+
+        self.l1_set(rows, expires)
+        return []
+
+    def touch(self, key: str, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:
+        self.l1_delete([self.make_and_validate_key(key, version)])
+        return self.l2.touch(key, timeout, version)
+
+    def delete(self, key: str, version: int | None = None) -> bool:
+        made_key: str = self.make_and_validate_key(key, version)
+        self.l1_delete([made_key])
+        return self.l2.delete_stored([made_key]) == 1
+
+    def delete_many(self, keys: Iterable[str], version: int | None = None) -> None:
+        made_keys: list[str] = [self.make_and_validate_key(key, version) for key in keys]
+        self.l1_delete(made_keys)
+        self.l2.delete_stored(made_keys)
+
+    def has_key(self, key: str, version: int | None = None) -> bool:
+        made_key: str = self.make_and_validate_key(key, version)
+        return self.l1_get(made_key) is not None or made_key in self.l2.get_stored([made_key])
+
+    def incr(self, key: str, delta: int = 1, version: int | None = None) -> int:
+        made_key: str = self.make_and_validate_key(key, version)
+        self.l1_delete([made_key])
+        return self.l2.incr_stored(made_key, delta)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.l1.clear()
+        self.l2.clear()
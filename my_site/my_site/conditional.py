@@ -0,0 +1,89 @@
+"""
+Conditional GET support of the views whose content depends on a few tables.
+
+The validators of a response, its last modification time and a version, are computed
+by a state function with one indexed aggregate query before the view runs. When
+the ETag or the Last-Modified date sent by the client still match, the view is not
+called: there is no queryset evaluation, no rendering and a 304 is sent without a body.
+"""
+
+import hashlib
+from datetime import datetime
+from functools import wraps
+from typing import Any, Callable, Hashable
+
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpRequest, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+
+State = tuple[datetime | None, Hashable]
+StateFunction = Callable[..., State | None]
+
+
+def table_state(queryset: QuerySet, field: str = "updated_at") -> State:
+    """
+    Returns the latest value of `field` and the number of rows of the queryset, read with one aggregate query.
+
+    The row count changes on deletions, which do not change the latest modification time.
+    """
+    state: dict[str, Any] = queryset.aggregate(last_modified=Max(field), count=Count("pk"))
+    return state["last_modified"], (state["last_modified"], state["count"])
+
+
+def combine_states(*states: State) -> State:
+    """Returns the state of a response depending on several tables."""
+    dates: list[datetime] = [last_modified for last_modified, version in states if last_modified is not None]
+    return max(dates, default=None), tuple(version for last_modified, version in states)
+
+
+def conditional_view(state_func: StateFunction, per_user: bool = False) -> Callable:
+    """
+    Decorator answering conditional GET and HEAD requests like django.views.decorators.http.condition.
+
+    `state_func` is called with the arguments of the view and returns the last
+    modification time and a version of the content, or None to run the view
+    unconditionally, e.g. for a missing object.
+
+    With `per_user` the content depends on the user, e.g. a page showing the username:
+    the ETag includes the user and the current date, no Last-Modified is sent, and
+    the response is marked private, so shared caches do not store it.
+    """
+
+    def decorator(view_func: Callable[..., HttpResponse]) -> Callable[..., HttpResponse]:
+        @wraps(view_func)
+        def inner(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+            if request.method not in ("GET", "HEAD"):
+                return view_func(request, *args, **kwargs)
+
+            state: State | None = state_func(request, *args, **kwargs)
+            if state is None:
+                return view_func(request, *args, **kwargs)
+
+            last_modified, version = state
+            parts: list[Any] = [version, get_language()]
+            if per_user:
+                parts += [request.user.pk, request.user.get_username(), timezone.localdate()]
+
+            etag: str = quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+            timestamp: int | None = None if per_user or last_modified is None else int(last_modified.timestamp())
+            response: HttpResponse | None = get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            if not response.has_header("ETag"):
+                response.headers["ETag"] = etag
+            if timestamp is not None and not response.has_header("Last-Modified"):
+                response.headers["Last-Modified"] = http_date(timestamp)
+            if per_user:
+                patch_cache_control(response, private=True)
+            return response
+
+        return inner
+
+    return decorator
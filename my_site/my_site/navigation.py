@@ -0,0 +1,41 @@
+"""
+Navigation links of the templates, built once per language and URLconf.
+
+The context processors of the applications run on every render of a template with
+a RequestContext, admin pages included, and most of the pages use at most one of
+their lists. The processors return lazy objects: the links are built only when a
+template iterates them, and then read from a per-process memo keyed by the links,
+the language, the URLconf and the script prefix, so reverse() and gettext() run
+once per process for every combination instead of once per request.
+"""
+
+from functools import lru_cache
+from typing import Sequence
+
+from django.conf import settings
+from django.urls import get_script_prefix, get_urlconf, reverse
+from django.utils import translation
+from django.utils.functional import SimpleLazyObject
+
+# URL name, translated title and path of a link
+NavLink = tuple[str, str, str]
+# URL name and untranslated title, marked with gettext_noop
+NavItem = tuple[str, str]
+
+
+@lru_cache(maxsize=64)
+def build_links(items: tuple[NavItem, ...], language: str | None, urlconf: str, prefix: str) -> tuple[NavLink, ...]:
+    """Returns the links of the items for the language, the URLconf and the script prefix."""
+    with translation.override(language):
+        return tuple((name, translation.gettext(title), reverse(name, urlconf=urlconf)) for name, title in items)
+
+
+def navigation(items: Sequence[NavItem]) -> SimpleLazyObject:
+    """
+    Returns the links of the items, built on first use for the language and the URLconf of the request.
+
+    The language and the URLconf are read when the processor runs, so the links do
+    not change if the template is rendered later, e.g. by a TemplateResponse.
+    """
+    key: tuple = (tuple(items), translation.get_language(), get_urlconf(settings.ROOT_URLCONF), get_script_prefix())
+    return SimpleLazyObject(lambda: build_links(*key))
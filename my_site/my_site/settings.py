@@ -18,17 +18,40 @@ from config import settings
 from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 
+from my_site import tracing
+
+# Sentry tracing (my_site.tracing): transactions sampled by the first route matching their path at its rate,
+# at 1.0 for TRACING_HOT_SECONDS after a request of the route slower than TRACING_SLOW_SECONDS or failed,
+# at most TRACING_BUDGET_PER_MINUTE transactions per minute and worker, the hot routes at most
+# TRACING_HOT_BUDGET_PER_MINUTE more
+TRACING_ROUTES = {
+    "metrics": (r"^/metrics$", 0.0),
+    "static": (r"^/(static|media)/", 0.0),
+    "export": (r"/export/", 0.2),
+    "api": (r"/api/", 0.05),
+    "default": (r"", 0.02),
+}
+TRACING_BUDGET_PER_MINUTE = 60
+TRACING_SLOW_SECONDS = 1.0
+TRACING_HOT_SECONDS = 60
+TRACING_HOT_BUDGET_PER_MINUTE = 600
+# the profiler of a worker runs while the mean latency of its requests is above this number of seconds
+PROFILING_LATENCY_THRESHOLD = 0.5
+
+tracing.configure(
+    routes=TRACING_ROUTES,
+    budget_per_minute=TRACING_BUDGET_PER_MINUTE,
+    slow_seconds=TRACING_SLOW_SECONDS,
+    hot_seconds=TRACING_HOT_SECONDS,
+    hot_budget_per_minute=TRACING_HOT_BUDGET_PER_MINUTE,
+    profiling_threshold=PROFILING_LATENCY_THRESHOLD,
+)
 sentry_sdk.init(
     dsn=settings.data_source_name,
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for tracing.
-    traces_sample_rate=1.0,
-    _experiments={
-        # Set continuous_profiling_auto_start to True
-        # to automatically start the profiler on when
-        # possible.
-        "continuous_profiling_auto_start": True,
-    },
+    traces_sampler=tracing.traces_sampler,
+    # the profiler is started and stopped by my_site.tracing
+    profile_session_sample_rate=1.0,
+    profile_lifecycle="manual",
 )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -79,9 +102,16 @@ INSTALLED_APPS = [
     "myauth.apps.MyauthConfig",
     "myapiapp.apps.MyapiappConfig",
     "blogapp.apps.BlogappConfig",
+    "jobsapp.apps.JobsappConfig",
 ]
 
 MIDDLEWARE = [
+    # first, so the metrics include the throttled requests and the time of all the middleware
+    "requestdataapp.middlewares.CountRequestsMiddleware",
+    # rejects throttled requests before the session and authentication middleware
+    "requestdataapp.middlewares.ThrottlingMiddleware",
+    # Server-Timing header and query budgets of the requests which are not throttled
+    "requestdataapp.middlewares.ServerTimingMiddleware",
     # "django.middleware.cache.UpdateCacheMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -96,9 +126,9 @@ MIDDLEWARE = [
     # "debug_toolbar.middleware.DebugToolbarMiddleware",
     # project middleware
     "requestdataapp.middlewares.set_useragent_on_request_middleware",
-    "requestdataapp.middlewares.CountRequestsMiddleware",
-    "requestdataapp.middlewares.ThrottlingMiddleware",
     # "django.middleware.cache.FetchFromCacheMiddleware",
+    # last, runs the middleware above in one thread hop under ASGI
+    "requestdataapp.middlewares.SyncBoundaryMiddleware",
 ]
 
 ROOT_URLCONF = "my_site.urls"
@@ -136,15 +166,25 @@ DATABASES = {
 }
 
 # https://docs.djangoproject.com/en/5.1/topics/cache/
+# in-process LRU (L1) in front of a SQLite file shared by the workers of a host (L2), see my_site/cache.py,
+# replaced in my_site.test_settings
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
-        # "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
-        # "LOCATION": "/var/tmp/django_cache",
-        # "TIMEOUT": 60,
-        # "OPTIONS": {"MAX_ENTRIES": 1000},
+        "BACKEND": "my_site.cache.TieredCache",
+        "LOCATION": DATABASE_DIR / "cache.sqlite3",
+        "TIMEOUT": 300,
+        "OPTIONS": {
+            "MAX_ENTRIES": 20000,
+            "L1_MAX_ENTRIES": 1000,
+            "L1_TIMEOUT": 5,
+        },
     }
 }
+# stampede protection of expensive cached values (my_site.singleflight): seconds a recomputation holds
+# the lock of a key, a request waits for a missing value, and an expired value is served while recomputed
+CACHE_LOCK_TIMEOUT = 120
+CACHE_WAIT_TIMEOUT = 10
+CACHE_STALE_TIMEOUT = 10 * 60
 CACHE_MIDDLEWARE_SECONDS = 200
 
 # Password validation
@@ -191,6 +231,8 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "uploads"
+# files uploaded for the background imports (jobsapp.queue), outside MEDIA_ROOT so they are never served
+JOB_UPLOAD_ROOT = BASE_DIR / "private" / "job_uploads"
 
 # устарела
 # DEFAULT_FILE_STORAGE = ""
@@ -212,8 +254,77 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
 
-# Allow 1 request every 1500 milliseconds (0.001 seconds)
-THROTTLING_RATE_MS = 1
+# Streaming import of .csv and .json files (shop_app.common):
+# rows are validated and saved by chunks, each chunk in its own transaction
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_ERRORS = 100
+IMPORT_LOOKUP_BATCH_SIZE = 500
+IMPORT_JSON_READ_SIZE = 64 * 1024
+IMPORT_JSON_MAX_ENTRY_SIZE = 1024 * 1024
+# size of a shard of the parallel import (shop_app.parallel_import)
+IMPORT_SHARD_SIZE = 8 * 1024 * 1024
+# unique field matching the rows of the upsert import of products with the existing ones
+PRODUCT_IMPORT_NATURAL_KEY = "sku"
+
+# seconds between the heartbeats of the running background jobs (jobsapp) saved by the runworker command,
+# a running job without heartbeat for JOB_LEASE_TIMEOUT seconds, its worker died, is moved back to pending
+JOB_HEARTBEAT_INTERVAL = 60
+JOB_LEASE_TIMEOUT = 10 * 60
+
+# Streaming exports (shop_app.exports): rows read from the database and encoded per chunk
+EXPORT_CHUNK_SIZE = 2000
+# larger exports are streamed without being cached
+EXPORT_CACHE_MAX_SIZE = 16 * 1024 * 1024
+# cached exports are deleted when their data changes (shop_app.invalidation), the timeout is a safety net
+EXPORT_CACHE_TIMEOUT = 6 * 60 * 60
+# incremental exports: rows per page and seconds of the newest changes left for the next sync
+EXPORT_DELTA_PAGE_SIZE = 1000
+EXPORT_DELTA_LAG = 2
+# export snapshots (shop_app.snapshots): files under MEDIA_ROOT sent by nginx with X-Accel-Redirect,
+# enable it only behind the nginx of nginx.conf
+EXPORT_SNAPSHOT_DIR = "exports"
+EXPORT_ACCEL_REDIRECT = settings.export_accel_redirect
+EXPORT_ACCEL_LOCATION = "/protected-exports/"
+
+# Token buckets of ThrottlingMiddleware (requestdataapp.throttling), shared by the workers of a host
+THROTTLING_DATABASE = DATABASE_DIR / "throttling.sqlite3"
+# least recently used buckets above this number are evicted
+THROTTLING_MAX_ENTRIES = 100_000
+# budget name: (regular expression of the paths, requests per second, burst), the first match applies,
+# paths matching none are not throttled
+THROTTLING_BUDGETS = {
+    "upload": (r"^/req/upload/", 1, 5),
+    "export": (r"/export/", 2, 10),
+    "api": (r"/api/", 20, 40),
+    "default": (r"", 50, 100),
+}
+# number of proxies in front of the server appending the client address to X-Forwarded-For, 1 behind the nginx
+# of nginx.conf, 0 without proxy: the buckets are keyed by the address the outermost proxy saw, so the server
+# must not be reachable without the proxies
+THROTTLING_TRUSTED_PROXIES = settings.throttling_trusted_proxies
+
+# Queries per request of ServerTimingMiddleware (requestdataapp.timing) above which a warning is logged,
+# by view name, "default" for the other views
+QUERY_BUDGETS = {
+    "default": 30,
+    "shop_app:product_export": 5,
+    "shop_app:order_export": 5,
+    "shop_app:user_orders_export": 5,
+    "shop_app:product_list": 10,
+    "shop_app:order_list": 10,
+}
+
+# Sampled N+1 detection of ServerTimingMiddleware (requestdataapp.nplusone): fraction of the requests checked,
+# and number of queries of one shape from one call site reported
+NPLUSONE_SAMPLE_RATE = 0.01
+NPLUSONE_THRESHOLD = 5
+
+# Request metrics of CountRequestsMiddleware (requestdataapp.metrics), a memory-mapped file per worker process,
+# served in the Prometheus text format by /metrics to these addresses and to the staff users, the address is the
+# one seen by the THROTTLING_TRUSTED_PROXIES proxies, Prometheus scrapes the app port, nginx does not serve /metrics
+METRICS_DIR = DATABASE_DIR / "metrics"
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
 
 # перенаправлять после входа пользователя
 LOGIN_REDIRECT_URL = reverse_lazy("myauth:about_me")
@@ -239,6 +350,11 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# rendered rows of the product and order lists (shop_app.fragments), old versions are never read again
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+# responses of the product and order API cached by generation (shop_app.api_mixins), reused until the tables change
+API_CACHE_TIMEOUT = 24 * 60 * 60
+
 # https://drf-spectacular.readthedocs.io/en/latest/readme.html
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Your Project API',
@@ -0,0 +1,116 @@
+"""
+Stampede protection of expensive cached values.
+
+Values are stored as entries holding their expiration time and the duration of their
+computation. A request reading an entry close to its expiration recomputes it early
+with a probability growing as the expiration nears and with the computation time
+(XFetch, "Optimal Probabilistic Cache Stampede Prevention", Vattani et al.), so the
+keys of a busy view are refreshed one by one instead of expiring under load.
+
+Only the request holding the lock of a key, taken with the atomic cache.add(),
+recomputes it. The other requests get the stale entry, kept for
+settings.CACHE_STALE_TIMEOUT seconds after its expiration, or wait up to
+settings.CACHE_WAIT_TIMEOUT seconds for the new one when there is none.
+"""
+
+import math
+import os
+import random
+import time
+from typing import Any, Callable, NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+MISSING: Any = object()
+
+
+class Entry(NamedTuple):
+    """Cached value with its expiration time and the seconds its computation took."""
+
+    value: Any
+    expires: float
+    delta: float
+
+
+def lock_key(key: str) -> str:
+    """Returns the cache key of the lock of a key."""
+    return f"{key}.lock"
+
+
+def read(key: str, beta: float = 1.0) -> tuple[Any, bool]:
+    """
+    Reads the entry of a key.
+
+    Args:
+        beta (float): Weight of the early recomputation, larger values refresh earlier.
+
+    Returns:
+        tuple: The value, MISSING if there is none, and whether the value should be recomputed.
+    """
+    entry: Entry | None = cache.get(key)
+    if entry is None:
+        return MISSING, True
+
+    # -log(u) for u in (0, 1] is an exponential variable, rarely much greater than 1
+    early: float = -entry.delta * beta * math.log(1.0 - random.random())
+    return entry.value, time.time() + early >= entry.expires
+
+
+def acquire(key: str) -> bool:
+    """Takes the lock of a key, it expires after settings.CACHE_LOCK_TIMEOUT seconds if it is not released."""
+    return cache.add(lock_key(key), os.getpid(), settings.CACHE_LOCK_TIMEOUT)
+
+
+def release(key: str) -> None:
+    """Releases the lock of a key."""
+    cache.delete(lock_key(key))
+
+
+def store(key: str, value: Any, timeout: float, delta: float) -> None:
+    """Stores the value for `timeout` seconds, the entry is kept settings.CACHE_STALE_TIMEOUT seconds longer."""
+    cache.set(key, Entry(value, time.time() + timeout, delta), timeout + settings.CACHE_STALE_TIMEOUT)
+
+
+def wait(key: str) -> Any:
+    """Returns the value of a key computed by another request, MISSING after settings.CACHE_WAIT_TIMEOUT seconds."""
+    deadline: float = time.monotonic() + settings.CACHE_WAIT_TIMEOUT
+    pause: float = 0.05
+
+    while time.monotonic() < deadline:
+        time.sleep(pause)
+        entry: Entry | None = cache.get(key)
+        if entry is not None:
+            return entry.value
+        pause = min(pause * 2, 0.5)
+
+    return MISSING
+
+
+def get_or_compute(key: str, compute: Callable[[], Any], timeout: float) -> Any:
+    """
+    Returns the cached value of a key, computed by one request at a time when it is missing or expiring.
+
+    If the request waiting for a missing value times out, it computes the value itself.
+    """
+    value, refresh = read(key)
+    if not refresh:
+        return value
+
+    locked: bool = acquire(key)
+    if not locked:
+        if value is not MISSING:
+            # stale or early value, the request holding the lock refreshes it
+            return value
+        value = wait(key)
+        if value is not MISSING:
+            return value
+
+    try:
+        start: float = time.monotonic()
+        value = compute()
+        store(key, value, timeout, time.monotonic() - start)
+    finally:
+        if locked:
+            release(key)
+    return value
@@ -1,9 +1,31 @@
+from typing import Any
+
+from blogapp.models import Article
 from blogapp.sitemap import BlogSitemap
+from django.http import HttpRequest
+from myauth.models import Profile
 from myauth.sitemap import ProfileSitemap
+from shop_app.models import Product
 from shop_app.sitemap import ShopSitemap
 
+from .conditional import State, combine_states, table_state
+
 sitemaps: dict[str, BlogSitemap | ShopSitemap | ProfileSitemap] = {
     "blog": BlogSitemap,
     "shop": ShopSitemap,
     "profile": ProfileSitemap,
 }
+
+
+def sitemaps_state(request: HttpRequest, *args: Any, **kwargs: Any) -> State:
+    """
+    Returns the validators of the sitemap, with one aggregate query per table.
+
+    Profiles are listed with the immutable date_joined of their user, so only their
+    number and their last primary key matter.
+    """
+    return combine_states(
+        table_state(Article.objects.all()),
+        table_state(Product.objects.all()),
+        (None, table_state(Profile.objects.all(), "pk")[1]),
+    )
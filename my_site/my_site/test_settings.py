@@ -0,0 +1,20 @@
+"""
+Django settings of the test runs.
+
+`python manage.py test` runs the tests with this module, selected by manage.py unless
+DJANGO_SETTINGS_MODULE or --settings is given, so they never read or write the cache
+and the other local storage of the server.
+"""
+
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+
+# test cases start without cached values, the ones testing the cache override CACHES
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+# every test client starts with its own empty buckets
+THROTTLING_DATABASE = ":memory:"
+
+# the files of the test runs are not mixed with the metrics of the server
+METRICS_DIR = tempfile.mkdtemp(prefix="my_site_metrics_")
@@ -0,0 +1,292 @@
+import math
+import os
+import time
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from blogapp.models import Article, Author, Category
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone, translation
+from shop_app.context_processors import urls_and_name
+
+from . import singleflight, tracing
+from .cache import SQLiteCache, TieredCache, key_prefix
+from .navigation import build_links
+
+
+class SQLiteCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = SQLiteCache(os.path.join(self.directory.name, "cache.sqlite3"), {"TIMEOUT": 60})
+
+    def test_set_get_many(self):
+        self.cache.set_many({"a": {"name": "Laptop"}, "b": 2})
+        self.cache.set("c", None, timeout=0)
+
+        self.assertEqual(self.cache.get_many(["a", "b", "c", "d"]), {"a": {"name": "Laptop"}, "b": 2})
+        self.assertEqual(self.cache.get("d", "default"), "default")
+
+    def test_add_replaces_expired_value_only(self):
+        self.assertTrue(self.cache.add("key", 1))
+        self.assertFalse(self.cache.add("key", 2))
+        self.cache.set("key", 1, timeout=0)
+        self.assertTrue(self.cache.add("key", 3))
+        self.assertEqual(self.cache.get("key"), 3)
+
+    def test_incr_is_done_in_database(self):
+        self.cache.set("counter", 1)
+
+        self.assertEqual(self.cache.incr("counter", 5), 6)
+        self.assertEqual(self.cache.get("counter"), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr("missing")
+
+    def test_cull_evicts_entries_expiring_first(self):
+        cache = SQLiteCache(
+            os.path.join(self.directory.name, "small.sqlite3"),
+            {"OPTIONS": {"MAX_ENTRIES": 4, "CULL_FREQUENCY": 2, "CULL_EVERY": 1}},
+        )
+        for number in range(5):
+            cache.set(f"key{number}", number, timeout=100 + number)
+
+        self.assertEqual(cache.get_many([f"key{number}" for number in range(5)]), {"key2": 2, "key3": 3, "key4": 4})
+
+
+class TieredCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.location = os.path.join(self.directory.name, "cache.sqlite3")
+        self.params = {"OPTIONS": {"L1_MAX_ENTRIES": 2, "L1_TIMEOUT": 60, "STATS_FLUSH_INTERVAL": 3600}}
+        self.cache = TieredCache(self.location, self.params)
+
+    def test_key_prefix(self):
+        self.assertEqual(key_prefix("user_orders_data_export15"), "user_orders_data_export")
+        self.assertEqual(key_prefix("products_data_export.products.json"), "products_data_export")
+
+    def test_values_are_shared_through_l2(self):
+        other = TieredCache(self.location, self.params)
+        self.cache.set("products_data_export.json", [1, 2])
+
+        self.assertEqual(other.get("products_data_export.json"), [1, 2])
+        self.assertEqual(other.get("products_data_export.json"), [1, 2])
+        self.assertEqual(other.stats(), {"products_data_export": {"l2_hits": 1, "l1_hits": 1}})
+
+    def test_get_returns_copy(self):
+        self.cache.set("orders", {"orders": []})
+        self.cache.get("orders")["orders"].append(1)
+
+        self.assertEqual(self.cache.get("orders"), {"orders": []})
+
+    def test_get_many_counts_by_prefix(self):
+        self.cache.set_many({"user1": "a", "order1": "b"})
+
+        self.assertEqual(self.cache.get_many(["user1", "user2", "order1"]), {"user1": "a", "order1": "b"})
+        self.assertEqual(self.cache.stats(), {"user": {"l1_hits": 1, "misses": 1}, "order": {"l1_hits": 1}})
+
+    def test_l1_evicts_least_recently_used(self):
+        self.cache.set_many({"a": "1", "b": "2"})
+        self.cache.get("a")
+        self.cache.set("c", "3")
+
+        self.assertEqual(list(self.cache.l1), [":1:a", ":1:c"])
+        self.assertEqual(self.cache.get("b"), "2")
+        self.assertEqual(self.cache.stats()["b"], {"evictions": 1, "l2_hits": 1})
+
+    def test_l1_expires_after_l1_timeout(self):
+        cache = TieredCache(self.location, {"OPTIONS": {"L1_TIMEOUT": 0.01}})
+        other = TieredCache(self.location, {})
+        cache.set("key", "value")
+        other.delete("key")
+
+        self.assertEqual(cache.get("key"), "value")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("key"))
+
+    def test_l1_expires_with_l2(self):
+        other = TieredCache(self.location, self.params)
+        other.set("key", "value", timeout=1)
+
+        self.assertEqual(self.cache.get("key"), "value")
+        self.assertLessEqual(self.cache.l1[":1:key"][0], time.time() + 1)
+
+    def test_integers_are_read_from_l2(self):
+        other = TieredCache(self.location, self.params)
+        self.cache.set_many({"version": 1, "version.v1": "value"})
+        self.assertEqual(other.get_many(["version", "version.v1"]), {"version": 1, "version.v1": "value"})
+
+        self.cache.delete_many(["version", "version.v1"])
+        self.assertIsNone(other.get("version"))
+        # the values of other keys are served from the LRU of a process until L1_TIMEOUT
+        self.assertEqual(other.get("version.v1"), "value")
+        self.assertEqual(list(other.l1), [":1:version.v1"])
+
+    def test_delete_and_incr_drop_l1(self):
+        self.cache.set_many({"generation": 1, "key": "value"})
+
+        self.assertEqual(self.cache.incr("generation"), 2)
+        self.assertEqual(self.cache.get("generation"), 2)
+        self.assertTrue(self.cache.delete("key"))
+        self.assertFalse(self.cache.has_key("key"))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}, CACHE_WAIT_TIMEOUT=0.1
+)
+class SingleFlightTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return f"value {self.calls}"
+
+    def test_value_is_computed_once(self):
+        self.assertEqual(singleflight.get_or_compute("key", self.compute, 60), "value 1")
+        self.assertEqual(singleflight.get_or_compute("key", self.compute, 60), "value 1")
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(cache.has_key(singleflight.lock_key("key")))
+
+    def test_stale_value_is_served_while_locked(self):
+        singleflight.store("key", "stale", -1, 0)
+        self.assertTrue(singleflight.acquire("key"))
+
+        self.assertEqual(singleflight.get_or_compute("key", self.compute, 60), "stale")
+        self.assertEqual(self.calls, 0)
+
+        singleflight.release("key")
+        self.assertEqual(singleflight.get_or_compute("key", self.compute, 60), "value 1")
+
+    def test_missing_value_is_computed_after_wait(self):
+        singleflight.acquire("key")
+
+        self.assertEqual(singleflight.get_or_compute("key", self.compute, 60), "value 1")
+        self.assertTrue(cache.has_key(singleflight.lock_key("key")))
+
+    def test_slow_value_is_refreshed_early(self):
+        singleflight.store("key", "cached", 60, 0)
+        self.assertEqual(singleflight.read("key"), ("cached", False))
+
+        # the value computed in 60 / ln(2) seconds is refreshed by half of the reads 60 seconds before it expires
+        singleflight.store("key", "cached", 60, 60 / math.log(2))
+        refreshes = [singleflight.read("key")[1] for _ in range(100)]
+        self.assertTrue(any(refreshes))
+        self.assertFalse(all(refreshes))
+
+
+class NavigationTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        build_links.cache_clear()
+        self.request = RequestFactory().get("/")
+
+    def test_links_are_built_on_first_use(self):
+        with translation.override("en"):
+            links = urls_and_name(self.request)["urls_page_path"]
+        self.assertEqual(build_links.cache_info().currsize, 0)
+
+        self.assertEqual(links[2], ("shop_app:product_list", "Products", "/en/shop/products/"))
+        self.assertEqual(build_links.cache_info().currsize, 1)
+
+    def test_links_are_memoized_per_language(self):
+        with translation.override("en"):
+            english = list(urls_and_name(self.request)["urls_page_path"])
+            self.assertEqual(list(urls_and_name(self.request)["urls_page_path"]), english)
+        with translation.override("ru"):
+            russian = list(urls_and_name(self.request)["urls_page_path"])
+
+        self.assertEqual(build_links.cache_info().misses, 2)
+        self.assertEqual(build_links.cache_info().hits, 1)
+        self.assertEqual(russian[2][2], "/ru/shop/products/")
+
+
+class TracingTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.sampler = tracing.AdaptiveSampler(
+            {"metrics": (r"^/metrics$", 0.0), "default": (r"", 0.5)},
+            budget_per_minute=3,
+            slow_seconds=1.0,
+            hot_seconds=60,
+            hot_budget_per_minute=2,
+        )
+
+    def sample(self, path: str, **context) -> float:
+        return self.sampler({"wsgi_environ": {"PATH_INFO": path}, **context})
+
+    def test_rate_by_route(self):
+        with mock.patch("my_site.tracing.random.random", return_value=0.4):
+            self.assertEqual(self.sample("/metrics"), 0.0)
+            self.assertEqual(self.sample("/en/shop/"), 1.0)
+        with mock.patch("my_site.tracing.random.random", return_value=0.6):
+            self.assertEqual(self.sample("/en/shop/"), 0.0)
+
+    def test_slow_or_failed_requests_make_their_route_hot(self):
+        with mock.patch("my_site.tracing.random.random", return_value=0.99):
+            self.sampler.observe("/metrics", 0.1, error=True)
+            self.sampler.observe("/en/shop/products/", 0.5, error=False)
+            self.assertEqual(self.sample("/en/shop/"), 0.0)
+
+            self.sampler.observe("/en/shop/products/", 1.5, error=False)
+            self.assertEqual(self.sample("/en/shop/"), 1.0)
+            self.assertEqual(self.sample("/metrics"), 1.0)
+
+    def test_budget_per_minute(self):
+        with mock.patch("my_site.tracing.random.random", return_value=0.0):
+            decisions = [self.sample("/en/shop/") for _ in range(4)]
+            self.assertEqual(decisions, [1.0, 1.0, 1.0, 0.0])
+            self.assertEqual(self.sample("/en/shop/", parent_sampled=True), 0.0)
+
+            with mock.patch("my_site.tracing.time.monotonic", return_value=time.monotonic() + 60):
+                self.assertEqual(self.sample("/en/shop/", parent_sampled=True), 1.0)
+                self.assertEqual(self.sample("/metrics", parent_sampled=False), 0.0)
+
+    def test_hot_routes_have_their_own_budget(self):
+        with mock.patch("my_site.tracing.random.random", return_value=0.0):
+            self.assertEqual([self.sample("/en/shop/") for _ in range(4)], [1.0, 1.0, 1.0, 0.0])
+
+            self.sampler.observe("/en/shop/", 0.1, error=True)
+            self.assertEqual([self.sample("/en/shop/") for _ in range(3)], [1.0, 1.0, 0.0])
+
+    def test_profiler_runs_while_latency_is_high(self):
+        profiler = tracing.AdaptiveProfiler(threshold=0.5, smoothing=0.5)
+
+        with mock.patch("my_site.tracing.sentry_profiler") as sentry_profiler:
+            profiler.observe(0.8)
+            self.assertFalse(profiler.running)
+            profiler.observe(1.0)
+            self.assertTrue(profiler.running)
+            profiler.observe(0.2)
+            self.assertTrue(profiler.running)
+            profiler.observe(0.2)
+
+        self.assertFalse(profiler.running)
+        sentry_profiler.start_profiler.assert_called_once_with()
+        sentry_profiler.stop_profiler.assert_called_once_with()
+
+
+class SitemapConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.article = Article.objects.create(
+            title="Sitemap article",
+            content="Content",
+            pub_date=timezone.now(),
+            author=Author.objects.create(name="Sitemap author"),
+            category=Category.objects.create(name="Sitemap"),
+        )
+
+    def test_sitemap_is_not_modified_until_article_changes(self):
+        url = reverse("django.contrib.sitemaps.views.sitemap")
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(3):
+            response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.article.title = "Sitemap article (edited)"
+        self.article.save()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,173 @@
+"""
+Adaptive sampling of the Sentry transactions and profiles.
+
+Sentry decides whether a transaction is traced when it starts, see traces_sampler().
+The rate of a request is the one of the first route of settings.TRACING_ROUTES whose
+regular expression matches its path. A route is hot for TRACING_HOT_SECONDS after
+one of its requests was slow or failed, and all its requests are traced. The
+latency and the outcome of a request are known only after the decision, so the
+first slow or failed request of a route is not traced: an incident is traced from
+its second request. The errors themselves are always sent to Sentry as events,
+whatever the sampling. A worker traces at most TRACING_BUDGET_PER_MINUTE
+transactions of the other routes per minute, which bounds the instrumentation
+overhead under load, the hot routes have their own budget of
+TRACING_HOT_BUDGET_PER_MINUTE transactions, so an incident is traced even when
+the regular budget is spent.
+
+The continuous profiler is started manually, only while the mean latency of the
+requests of a worker, an exponential moving average, is above
+PROFILING_LATENCY_THRESHOLD, and stopped once it is back below.
+
+The latencies are reported by CountRequestsMiddleware with observe(). This module
+is configured by the settings before Django is set up, so it does not read
+django.conf.settings.
+"""
+
+import random
+import re
+import threading
+import time
+from typing import Any
+
+from sentry_sdk import profiler as sentry_profiler
+
+
+class AdaptiveSampler:
+    """Transactions sampler by route with hot routes and a per-minute budget."""
+
+    def __init__(
+        self,
+        routes: dict[str, tuple[str, float]],
+        budget_per_minute: int,
+        slow_seconds: float,
+        hot_seconds: float,
+        hot_budget_per_minute: int = 600,
+    ) -> None:
+        self.routes: list[tuple[str, re.Pattern[str], float]] = [
+            (name, re.compile(path), rate) for name, (path, rate) in routes.items()
+        ]
+        self.budget_per_minute: int = budget_per_minute
+        self.hot_budget_per_minute: int = hot_budget_per_minute
+        self.slow_seconds: float = slow_seconds
+        self.hot_seconds: float = hot_seconds
+        # monotonic time until which a route is hot, by route name
+        self.hot_until: dict[str, float] = {}
+        self.minute: int = 0
+        self.sampled: int = 0
+        self.hot_sampled: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def match(self, path: str) -> tuple[str, float] | None:
+        """Returns the name and the rate of the first route matching the path."""
+        for name, pattern, rate in self.routes:
+            if pattern.search(path):
+                return name, rate
+        return None
+
+    def take_budget(self, hot: bool = False) -> bool:
+        """Counts a sampled transaction, False if the budget of the current minute, hot or regular, is spent."""
+        with self.lock:
+            minute: int = int(time.monotonic() // 60)
+            if minute != self.minute:
+                self.minute, self.sampled, self.hot_sampled = minute, 0, 0
+            if hot:
+                if self.hot_sampled >= self.hot_budget_per_minute:
+                    return False
+                self.hot_sampled += 1
+                return True
+            if self.sampled >= self.budget_per_minute:
+                return False
+            self.sampled += 1
+            return True
+
+    def __call__(self, sampling_context: dict[str, Any]) -> float:
+        """The traces_sampler of sentry_sdk.init(), returns 1.0 to trace the transaction, 0.0 otherwise."""
+        parent_sampled: bool | None = sampling_context.get("parent_sampled")
+        if parent_sampled is not None:
+            # the decision of the calling service is kept, so distributed traces are complete
+            return 1.0 if parent_sampled and self.take_budget() else 0.0
+
+        route: tuple[str, float] | None = self.match(request_path(sampling_context))
+        if route is None:
+            return 0.0
+
+        name, rate = route
+        if self.hot_until.get(name, 0.0) > time.monotonic():
+            return 1.0 if self.take_budget(hot=True) else 0.0
+        return 1.0 if random.random() < rate and self.take_budget() else 0.0
+
+    def observe(self, path: str, duration: float, error: bool) -> None:
+        """Makes the route of the path hot if the request was slow or failed."""
+        if error or duration >= self.slow_seconds:
+            route: tuple[str, float] | None = self.match(path)
+            if route is not None:
+                self.hot_until[route[0]] = time.monotonic() + self.hot_seconds
+
+
+class AdaptiveProfiler:
+    """Runs the continuous profiler while the mean latency is above a threshold."""
+
+    def __init__(self, threshold: float, smoothing: float = 0.05) -> None:
+        self.threshold: float = threshold
+        self.smoothing: float = smoothing
+        self.mean: float = 0.0
+        self.running: bool = False
+        self.lock: threading.Lock = threading.Lock()
+
+    def observe(self, duration: float) -> None:
+        """Adds the latency of a request to the mean, starts or stops the profiler when it crosses the threshold."""
+        self.mean += self.smoothing * (duration - self.mean)
+        if self.should_run() == self.running:
+            return
+
+        with self.lock:
+            if self.should_run() != self.running:
+                if self.running:
+                    sentry_profiler.stop_profiler()
+                else:
+                    sentry_profiler.start_profiler()
+                self.running = not self.running
+
+    def should_run(self) -> bool:
+        """Whether the profiler should run, it is stopped below 80% of the threshold so it does not flap around it."""
+        return self.mean > self.threshold * (0.8 if self.running else 1.0)
+
+
+def request_path(sampling_context: dict[str, Any]) -> str:
+    """Returns the path of the request of a transaction, its name for the other transactions."""
+    if "wsgi_environ" in sampling_context:
+        return sampling_context["wsgi_environ"].get("PATH_INFO", "")
+    if "asgi_scope" in sampling_context:
+        return sampling_context["asgi_scope"].get("path", "")
+    return sampling_context.get("transaction_context", {}).get("name", "")
+
+
+sampler: AdaptiveSampler | None = None
+profiler: AdaptiveProfiler | None = None
+
+
+def configure(
+    routes: dict[str, tuple[str, float]],
+    budget_per_minute: int,
+    slow_seconds: float,
+    hot_seconds: float,
+    hot_budget_per_minute: int,
+    profiling_threshold: float,
+) -> None:
+    """Creates the sampler and the profiler of the process, called by the settings."""
+    global sampler, profiler
+    sampler = AdaptiveSampler(routes, budget_per_minute, slow_seconds, hot_seconds, hot_budget_per_minute)
+    profiler = AdaptiveProfiler(profiling_threshold)
+
+
+def traces_sampler(sampling_context: dict[str, Any]) -> float:
+    """The traces_sampler of sentry_sdk.init(), nothing is traced before configure()."""
+    return sampler(sampling_context) if sampler is not None else 0.0
+
+
+def observe(path: str, duration: float, error: bool) -> None:
+    """Reports the latency of a request and whether it failed."""
+    if sampler is not None:
+        sampler.observe(path, duration, error)
+    if profiler is not None:
+        profiler.observe(duration)
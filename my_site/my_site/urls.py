@@ -26,8 +26,10 @@ from drf_spectacular.views import (
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
+from requestdataapp.views import metrics_view
 
-from .sitemaps import sitemaps
+from .conditional import conditional_view
+from .sitemaps import sitemaps, sitemaps_state
 
 urlpatterns = [
     path('admin/doc/', include('django.contrib.admindocs.urls')),
@@ -42,9 +44,11 @@ urlpatterns = [
     ),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     path("api/", include("myapiapp.urls")),
+    path("jobs/", include("jobsapp.urls")),
+    path("metrics", metrics_view, name="metrics"),
     path(
         "sitemap.xml",
-        sitemap,
+        conditional_view(sitemaps_state)(sitemap),
         {"sitemaps": sitemaps},
         name="django.contrib.sitemaps.views.sitemap",
     ),
@@ -1,13 +1,15 @@
 from django.http import HttpRequest
-from django.urls import reverse
-from django.utils.translation import gettext as _
-
-
-def urls_and_name(request: HttpRequest) -> dict[str, tuple[str, str, str]]:
-    return {
-        "urls_auth_path": [
-            ("shop_app:index", _("Home page"), reverse("shop_app:index")),
-            ("myauth:profiles_list", _("Profiles"), reverse("myauth:profiles_list")),
-            ("blogapp:article_list", _("Articles"), reverse("blogapp:article_list")),
-        ]
-    }
+from django.utils.translation import gettext_noop as _
+
+from my_site.navigation import NavItem, navigation
+
+NAV_ITEMS: tuple[NavItem, ...] = (
+    ("shop_app:index", _("Home page")),
+    ("myauth:profiles_list", _("Profiles")),
+    ("blogapp:article_list", _("Articles")),
+)
+
+
+def urls_and_name(request: HttpRequest) -> dict[str, object]:
+    """Navigation links of the account pages, built lazily once per language, see my_site.navigation."""
+    return {"urls_auth_path": navigation(NAV_ITEMS)}
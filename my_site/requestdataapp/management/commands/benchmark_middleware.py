@@ -0,0 +1,95 @@
+"""
+This module contains a Django management command comparing the request latency under WSGI and ASGI.
+
+The requests go through the full MIDDLEWARE stack of the project with the handlers
+of the Django test client: the WSGI one calls the middleware synchronously, the
+ASGI one from the event loop, the stack running synchronously in one thread hop.
+ASGI is also measured without the sync-only middleware at the bottom of the stack,
+SyncBoundaryMiddleware and set_useragent_on_request_middleware, so the built-in
+middleware run in async mode with a hop to a thread per hook. The throttling
+buckets and the metrics are kept in temporary storage, the server ones are not changed.
+"""
+
+import asyncio
+import statistics
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.core.management.base import CommandParser
+from django.test import AsyncClient, Client, override_settings
+
+
+def client_address(idx: int) -> str:
+    """Returns a distinct client address per request, so the throttling budgets are not exhausted."""
+    return f"10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}"
+
+
+class Command(BaseCommand):
+    """Django management command to benchmark the middleware stack under WSGI and ASGI."""
+
+    help: str = "Benchmark the request latency under WSGI and ASGI with the full middleware stack"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add command line arguments for the command."""
+        parser.add_argument("--requests", type=int, default=2000, help="Number of requests per path and handler")
+        parser.add_argument(
+            "--path", action="append", help="Requested path, may be repeated, /req/get/?a=foo&b=bar by default"
+        )
+
+    def measure_wsgi(self, path: str, requests: int) -> list[float]:
+        """Returns the latencies of the requests to the path with the WSGI handler."""
+        client = Client()
+        latencies: list[float] = []
+        for idx in range(requests):
+            start: float = perf_counter()
+            client.get(path, headers={"X-Forwarded-For": client_address(idx)})
+            latencies.append(perf_counter() - start)
+        return latencies
+
+    async def measure_asgi(self, path: str, requests: int) -> list[float]:
+        """Returns the latencies of the requests to the path with the ASGI handler."""
+        client = AsyncClient()
+        latencies: list[float] = []
+        for idx in range(requests):
+            start: float = perf_counter()
+            await client.get(path, headers={"X-Forwarded-For": client_address(idx)})
+            latencies.append(perf_counter() - start)
+        return latencies
+
+    def report(self, name: str, latencies: list[float]) -> None:
+        """Print the mean, median and 99th percentile of the latencies in milliseconds."""
+        latencies = [latency * 1000 for latency in latencies]
+        p99: float = statistics.quantiles(latencies, n=100)[98]
+        self.stdout.write(
+            f"  {name:<21} mean {statistics.fmean(latencies):7.3f} ms "
+            f"p50 {statistics.median(latencies):7.3f} ms p99 {p99:7.3f} ms"
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Print the latencies of every path under WSGI and ASGI."""
+        boundary: tuple[str, ...] = (
+            "requestdataapp.middlewares.SyncBoundaryMiddleware",
+            "requestdataapp.middlewares.set_useragent_on_request_middleware",
+        )
+        without_boundary: list[str] = [name for name in settings.MIDDLEWARE if name not in boundary]
+
+        with TemporaryDirectory() as directory, override_settings(
+            THROTTLING_DATABASE=":memory:",
+            THROTTLING_TRUSTED_PROXIES=1,
+            METRICS_DIR=directory,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+        ):
+            for path in options["path"] or ["/req/get/?a=foo&b=bar"]:
+                self.stdout.write(path)
+                # the first requests load the templates and the URL resolvers
+                self.measure_wsgi(path, 10)
+                asyncio.run(self.measure_asgi(path, 10))
+                self.report("WSGI", self.measure_wsgi(path, options["requests"]))
+                self.report("ASGI", asyncio.run(self.measure_asgi(path, options["requests"])))
+                with override_settings(MIDDLEWARE=without_boundary):
+                    self.report("ASGI without boundary", asyncio.run(self.measure_asgi(path, options["requests"])))
+
+        self.stdout.write(self.style.SUCCESS("Done"))
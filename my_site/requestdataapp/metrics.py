@@ -0,0 +1,238 @@
+"""
+Request metrics shared by the worker processes of a host.
+
+Every process adds its values to its own memory-mapped file in settings.METRICS_DIR,
+so the workers never wait for each other, and the files outlive the restarts of
+the workers. The /metrics view sums the values of all the files and serves them
+in the Prometheus text format.
+
+A file starts with the number of used bytes, followed by entries made of the length
+of a key, the key padded to 8 bytes and a double. The key is the sample name with
+its labels, e.g. 'http_requests_total{view="shop_app:index",method="GET"}'.
+A new entry is written before the used size is updated, so a reader sees only
+complete entries.
+
+When a process opens its file, the files of the processes which are not running
+anymore are added to the totals file and deleted, under an exclusive lock of the
+directory, so the number of files stays bounded across restarts and deployments.
+The processes are looked up by PID, so METRICS_DIR must not be shared by hosts or
+containers.
+"""
+
+import fcntl
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import defaultdict
+from typing import Iterator
+
+from django.conf import settings
+
+# upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Prometheus types of the metrics, by name
+METRICS: dict[str, str] = {
+    "http_requests_total": "counter",
+    "http_responses_total": "counter",
+    "http_exceptions_total": "counter",
+    "http_request_duration_seconds": "histogram",
+}
+HELP: dict[str, str] = {
+    "http_requests_total": "Requests by view and method.",
+    "http_responses_total": "Responses by view and status code.",
+    "http_exceptions_total": "Exceptions raised by the views, by view and exception type.",
+    "http_request_duration_seconds": "Time spent in the middleware and the view, by view.",
+}
+
+re_metric_name = re.compile(r"^(\w+?)(_bucket|_sum|_count)?(\{|$)")
+re_process_file = re.compile(r"^metrics_(\d+)\.db$")
+
+# values of the method label, the other methods are counted as "other"
+METHODS: frozenset[str] = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+# file of the values of the processes which are not running anymore
+TOTALS_FILENAME: str = "metrics_totals.db"
+
+INITIAL_SIZE: int = 64 * 1024
+HEADER: struct.Struct = struct.Struct("q")
+VALUE: struct.Struct = struct.Struct("d")
+
+
+def escape(value: str | float) -> str:
+    """Returns a label value escaped for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def sample_key(name: str, **labels: str | float) -> str:
+    """Returns the key of a sample, its name with the labels in the Prometheus text format."""
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{escape(value)}"' for label, value in labels.items()) + "}"
+
+
+def read_entries(data: bytes) -> Iterator[tuple[str, float, int]]:
+    """Yields the keys, values and value positions of the entries of a file."""
+    used: int = HEADER.unpack_from(data, 0)[0] if len(data) >= HEADER.size else 0
+    position: int = HEADER.size
+
+    while position < used:
+        length: int = struct.unpack_from("i", data, position)[0]
+        key: str = data[position + 4 : position + 4 + length].decode()
+        position += padded(4 + length)
+        yield key, VALUE.unpack_from(data, position)[0], position
+        position += VALUE.size
+
+
+def padded(size: int) -> int:
+    """Returns the size rounded up to a multiple of 8 bytes."""
+    return size + (-size % 8)
+
+
+class MmapValues:
+    """Values of one process in a memory-mapped file, only this process writes to it."""
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.lock: threading.Lock = threading.Lock()
+        self.file = open(path, "a+b")
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.file.truncate(INITIAL_SIZE)
+        self.mmap: mmap.mmap = mmap.mmap(self.file.fileno(), 0)
+        self.used: int = HEADER.unpack_from(self.mmap, 0)[0] or HEADER.size
+        self.positions: dict[str, int] = {key: position for key, value, position in read_entries(self.mmap)}
+
+    def add_entry(self, key: str) -> int:
+        """Writes a zero entry of the key and returns the position of its value."""
+        encoded: bytes = key.encode()
+        size: int = padded(4 + len(encoded)) + VALUE.size
+
+        if self.used + size > len(self.mmap):
+            length: int = len(self.mmap)
+            while self.used + size > length:
+                length *= 2
+            self.mmap.close()
+            self.file.truncate(length)
+            self.mmap = mmap.mmap(self.file.fileno(), 0)
+
+        struct.pack_into(f"i{len(encoded)}s", self.mmap, self.used, len(encoded), encoded)
+        position: int = self.used + size - VALUE.size
+        VALUE.pack_into(self.mmap, position, 0.0)
+        self.used += size
+        HEADER.pack_into(self.mmap, 0, self.used)
+        self.positions[key] = position
+        return position
+
+    def inc(self, key: str, amount: float = 1.0) -> None:
+        """Adds the amount to the value of the key."""
+        with self.lock:
+            position: int | None = self.positions.get(key)
+            if position is None:
+                position = self.add_entry(key)
+            VALUE.pack_into(self.mmap, position, VALUE.unpack_from(self.mmap, position)[0] + amount)
+
+    def close(self) -> None:
+        """Closes the mapping and the file."""
+        self.mmap.close()
+        self.file.close()
+
+
+_values: MmapValues | None = None
+_values_lock: threading.Lock = threading.Lock()
+
+
+def values() -> MmapValues:
+    """Returns the values of the current process, a forked process opens its own file."""
+    global _values
+    if _values is None or _values.path != process_path():
+        with _values_lock:
+            if _values is None or _values.path != process_path():
+                os.makedirs(settings.METRICS_DIR, exist_ok=True)
+                merge_stopped_processes()
+                _values = MmapValues(process_path())
+    return _values
+
+
+def is_running(pid: int) -> bool:
+    """Whether a process with the PID is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_stopped_processes() -> int:
+    """Adds the values of the processes which are not running to the totals file, deletes their files."""
+    merged: int = 0
+    with open(os.path.join(settings.METRICS_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        totals: MmapValues | None = None
+
+        for filename in os.listdir(settings.METRICS_DIR):
+            match = re_process_file.match(filename)
+            if match is None or int(match.group(1)) == os.getpid() or is_running(int(match.group(1))):
+                continue
+
+            path: str = os.path.join(settings.METRICS_DIR, filename)
+            if totals is None:
+                totals = MmapValues(os.path.join(settings.METRICS_DIR, TOTALS_FILENAME))
+            with open(path, "rb") as file:
+                for key, value, position in read_entries(file.read()):
+                    totals.inc(key, value)
+            os.remove(path)
+            merged += 1
+
+        if totals is not None:
+            totals.close()
+    return merged
+
+
+def process_path() -> str:
+    """Returns the path of the file of the current process."""
+    return os.path.join(settings.METRICS_DIR, f"metrics_{os.getpid()}.db")
+
+
+def inc(name: str, amount: float = 1.0, **labels: str | float) -> None:
+    """Adds the amount to a counter."""
+    values().inc(sample_key(name, **labels), amount)
+
+
+def observe(name: str, amount: float, **labels: str | float) -> None:
+    """Adds an observation to a histogram, its buckets are cumulative and written in their order."""
+    current: MmapValues = values()
+    for bound in LATENCY_BUCKETS:
+        current.inc(sample_key(f"{name}_bucket", **labels, le=bound), amount <= bound)
+    current.inc(sample_key(f"{name}_bucket", **labels, le="+Inf"))
+    current.inc(sample_key(f"{name}_sum", **labels), amount)
+    current.inc(sample_key(f"{name}_count", **labels))
+
+
+def collect() -> dict[str, float]:
+    """Returns the values of all the processes summed by key, in the order of their first write."""
+    totals: defaultdict[str, float] = defaultdict(float)
+    if not os.path.isdir(settings.METRICS_DIR):
+        return totals
+
+    for filename in os.listdir(settings.METRICS_DIR):
+        if filename.startswith("metrics_") and filename.endswith(".db"):
+            with open(os.path.join(settings.METRICS_DIR, filename), "rb") as file:
+                for key, value, position in read_entries(file.read()):
+                    totals[key] += value
+    return totals
+
+
+def render() -> str:
+    """Returns the summed values in the Prometheus text format, grouped by metric."""
+    samples: defaultdict[str, list[str]] = defaultdict(list)
+    for key, value in collect().items():
+        match = re_metric_name.match(key)
+        name: str = match.group(1) if match and match.group(1) in METRICS else key.split("{")[0]
+        samples[name].append(f"{key} {value:.17g}")
+
+    lines: list[str] = []
+    for name, rows in samples.items():
+        lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} {METRICS.get(name, 'untyped')}", *rows]
+    return "\n".join(lines) + "\n"
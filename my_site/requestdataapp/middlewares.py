@@ -1,17 +1,39 @@
-from datetime import datetime, timedelta
+import logging
+import sqlite3
 from http import HTTPStatus
+from time import perf_counter
+from typing import AsyncIterator, Callable, Iterator
 
 from django.conf import settings
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.template.response import TemplateResponse
 
+from my_site import tracing
 
-def set_useragent_on_request_middleware(get_response):
+from . import metrics, nplusone
+from .throttling import Budget, Decision, TokenBuckets, load_budgets, match_budget
+from .timing import RequestTiming
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectRequest(HttpRequest):
+    """Request with the attributes set by the project middleware."""
+
+    user_agent: str
+    timing: RequestTiming
+
+
+def set_useragent_on_request_middleware(
+    get_response: Callable[[HttpRequest], HttpResponse],
+) -> Callable[[ProjectRequest], HttpResponse]:
     # print("initial call")
 
-    def middleware(request: HttpRequest) -> HttpResponse:
+    def middleware(request: ProjectRequest) -> HttpResponse:
         # print("before get response")
         request.user_agent = request.META.get("HTTP_USER_AGENT", settings.TEST_USER_AGENT)
-        response = get_response(request)
+        response: HttpResponse = get_response(request)
         # print("after get response")
         return response
 
@@ -19,24 +41,138 @@ def set_useragent_on_request_middleware(get_response):
 
 
 class CountRequestsMiddleware:
+    """
+    Counts the requests, responses and exceptions, and times the requests, by view.
 
-    def __init__(self, get_response) -> None:
-        self.get_response = get_response
-        self.requests_count: int = 0
-        self.responses_count: int = 0
-        self.exceptions_count: int = 0
+    The values are added to the memory-mapped file of the process, see
+    requestdataapp.metrics, and served by the /metrics view for all the workers.
+    The latencies also drive the Sentry sampling and profiling, see my_site.tracing.
+    The view is the URL name of the resolved view, unresolved requests, e.g. 404 or
+    rejected by the throttling middleware, are counted as "<unresolved>".
+
+    The values are written to memory without any I/O.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response: Callable[[HttpRequest], HttpResponse] = get_response
+
+    @classmethod
+    def get_view_name(cls, request: HttpRequest) -> str:
+        """Return the name of the view of the request, a bounded label unlike the path."""
+        match = getattr(request, "resolver_match", None)
+        return match.view_name if match else "<unresolved>"
+
+    def record(self, request: HttpRequest, response: HttpResponse, start: float) -> None:
+        """Count the request and its response, and add its duration to the histogram of the view."""
+        view: str = self.get_view_name(request)
+        # any token is a valid method, the label has a bounded set of values
+        method: str = request.method if request.method in metrics.METHODS else "other"
+        metrics.inc("http_requests_total", view=view, method=method)
+        metrics.inc("http_responses_total", view=view, status=response.status_code)
+        duration: float = perf_counter() - start
+        metrics.observe("http_request_duration_seconds", duration, view=view)
+        tracing.observe(request.path_info, duration, response.status_code >= 500)
 
     def __call__(self, request: HttpRequest) -> HttpResponse:
-        self.requests_count += 1
-        # print("request count", self.requests_count)
-        response = self.get_response(request)
-        self.responses_count += 1
-        # print("response count", self.responses_count)
+        start: float = perf_counter()
+        response: HttpResponse = self.get_response(request)
+        self.record(request, response, start)
         return response
 
     def process_exception(self, request: HttpRequest, exception: Exception) -> None:
-        self.exceptions_count += 1
-        # print("exception count", self.exceptions_count)
+        metrics.inc("http_exceptions_total", view=self.get_view_name(request), type=type(exception).__name__)
+
+
+class ServerTimingMiddleware:
+    """
+    Sends the Server-Timing header and logs the query count and durations of every request.
+
+    See requestdataapp.timing. A view running more queries than its budget of
+    settings.QUERY_BUDGETS, e.g. after a N+1 regression, is logged with a warning.
+    The N+1 queries of a sample of the requests are logged, see requestdataapp.nplusone.
+
+    It is sync-only: the execute wrappers are installed on the connections of the
+    thread running the view, which are not the ones of the event loop under ASGI.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response: Callable[[HttpRequest], HttpResponse] = get_response
+
+    def process_template_response(self, request: HttpRequest, response: TemplateResponse) -> TemplateResponse:
+        """Time the rendering of the response, which follows the template response middleware."""
+        timing: RequestTiming | None = getattr(request, "timing", None)
+        if timing is not None:
+            start: float = perf_counter()
+
+            def add_render_time(rendered: TemplateResponse) -> None:
+                timing.template += perf_counter() - start
+
+            response.add_post_render_callback(add_render_time)
+        return response
+
+    def finish(self, request: HttpRequest, response: HttpResponseBase, timing: RequestTiming) -> None:
+        """Send the header, the log line of a streaming response is written when it is closed."""
+        response.headers["Server-Timing"] = timing.header()
+
+        def report() -> None:
+            timing.deactivate()
+            timing.log(CountRequestsMiddleware.get_view_name(request), request.method or "", response.status_code)
+
+        if not isinstance(response, StreamingHttpResponse):
+            report()
+            return
+        content: Iterator[bytes] | AsyncIterator[bytes] = response.streaming_content
+        if isinstance(content, AsyncIterator):
+            response.streaming_content = self.astream(content, report)
+        else:
+            response.streaming_content = self.stream(content, report)
+
+    @classmethod
+    def stream(cls, content: Iterator[bytes], report: Callable[[], None]) -> Iterator[bytes]:
+        try:
+            yield from content
+        finally:
+            report()
+
+    @classmethod
+    async def astream(cls, content: AsyncIterator[bytes], report: Callable[[], None]) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            report()
+
+    def __call__(self, request: ProjectRequest) -> HttpResponse:
+        request.timing = RequestTiming(nplusone.sample()).activate()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            request.timing.deactivate()
+            raise
+        self.finish(request, response, request.timing)
+        return response
+
+
+class SyncBoundaryMiddleware:
+    """
+    Keeps the middleware stack synchronous under ASGI, the last one of MIDDLEWARE.
+
+    Django runs a middleware capable of both modes in the mode of the handler below it,
+    and the sync mode of a sync-only middleware spreads to all the middleware above it.
+    Without it the built-in middleware would run in async mode under ASGI and call each
+    of their process_request and process_response hooks with sync_to_async, a hop to a
+    thread per hook. With it the whole stack runs synchronously in a single hop, like
+    the project middleware, which are sync-only. Under WSGI it only passes the request on.
+    """
+
+    sync_capable: bool = True
+    async_capable: bool = False
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response: Callable[[HttpRequest], HttpResponse] = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        return self.get_response(request)
 
 
 # class TimeRequestMiddleware:
@@ -82,39 +218,66 @@ class CountRequestsMiddleware:
 
 
 class ThrottlingMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
-        self.bucket: dict[str, datetime] = {}
-        self.rate_ms: int = settings.THROTTLING_RATE_MS
+    """
+    Rate limiting of the clients with token buckets shared by the worker processes.
 
-    @classmethod
-    def get_client_ip(cls, request: HttpRequest) -> str:
-        """Extract the client's IP address from the request."""
-        x_forwarded_for: str = request.META.get("HTTP_X_FORWARDED_FOR")
-
-        if x_forwarded_for:
-            return x_forwarded_for.split(",")[0]
+    The budget of a request is the first of settings.THROTTLING_BUDGETS whose
+    regular expression matches the path, every client has a bucket per budget.
+    The middleware is the first one of MIDDLEWARE, so a rejected request is
+    answered before any session, authentication or database work.
 
-        return request.META.get("REMOTE_ADDR", "")
+    The UPSERT in the local SQLite file takes microseconds, it waits 0.1 second at
+    most for the lock of the file.
+    """
 
-    def request_is_allowed(self, client_ip: str) -> bool:
-        """Check if the request from the client IP is allowed based on the rate limit."""
-        now: datetime = datetime.now()
-        last_access: datetime = self.bucket.get(client_ip)
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response: Callable[[HttpRequest], HttpResponse] = get_response
+        self.budgets: list[Budget] = load_budgets(settings.THROTTLING_BUDGETS)
+        self.buckets: TokenBuckets = TokenBuckets(settings.THROTTLING_DATABASE, settings.THROTTLING_MAX_ENTRIES)
 
-        if not last_access:
-            return True
-
-        if (now - last_access) > timedelta(milliseconds=self.rate_ms):
-            return True
+    @classmethod
+    def get_client_ip(cls, request: HttpRequest) -> str:
+        """
+        Extract the client's IP address from the request.
+
+        The first entries of X-Forwarded-For are sent by the client, only the ones
+        appended by the settings.THROTTLING_TRUSTED_PROXIES proxies in front of the
+        server are kept: the last of them is the address the outermost proxy saw.
+        """
+        remote_addr: str = request.META.get("REMOTE_ADDR", "")
+        proxies: int = settings.THROTTLING_TRUSTED_PROXIES
+        if not proxies:
+            return remote_addr
+
+        forwarded: list[str] = [ip.strip() for ip in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")]
+        return forwarded[-proxies] if len(forwarded) >= proxies and forwarded[-proxies] else remote_addr
+
+    def request_is_allowed(self, request: HttpRequest) -> Decision:
+        """
+        Take a token from the bucket of the client for the budget of the path.
+
+        The request is allowed if the buckets can not be updated, e.g. while the file
+        is locked, so the throttling never fails the requests.
+        """
+        budget: Budget | None = match_budget(self.budgets, request.path_info)
+        if budget is None:
+            return Decision(True, 0)
+
+        try:
+            return self.buckets.take(f"{budget.name}:{self.get_client_ip(request)}", budget.rate, budget.burst)
+        except sqlite3.OperationalError:
+            logger.warning("Throttling buckets are not available, the request is allowed", exc_info=True)
+            return Decision(True, 0)
 
-        return False
+    @classmethod
+    def rejected_response(cls, decision: Decision) -> HttpResponse:
+        """Return the response to a throttled request."""
+        response = HttpResponse("Rate limit exceeded", status=HTTPStatus.TOO_MANY_REQUESTS)
+        response.headers["Retry-After"] = str(decision.retry_after)
+        return response
 
     def __call__(self, request: HttpRequest) -> HttpResponse:
-        client_ip = self.get_client_ip(request)
-        if self.request_is_allowed(client_ip):
-            response = self.get_response(request)
-            self.bucket[client_ip] = datetime.now()
-        else:
-            response = HttpResponse("Rate limit exceeded", status=HTTPStatus.TOO_MANY_REQUESTS)
-        return response
+        decision: Decision = self.request_is_allowed(request)
+        if decision.allowed:
+            return self.get_response(request)
+        return self.rejected_response(decision)
@@ -0,0 +1,112 @@
+"""
+Sampled detection of N+1 queries in production.
+
+A fraction settings.NPLUSONE_SAMPLE_RATE of the requests is sampled by
+ServerTimingMiddleware. The queries of a sampled request are grouped by their shape,
+the SQL with its literals and placeholder lists normalized, and by their call site:
+the innermost frame of the project code and the template line being rendered. A
+shape run settings.NPLUSONE_THRESHOLD times or more from one call site, e.g. a
+foreign key read in Model.__str__ for every row of a list, is logged as a warning
+with the view of the request.
+
+The queries of the other requests are only counted, sampling costs a random number
+per request.
+"""
+
+import logging
+import os
+import random
+import re
+import sys
+from collections import Counter
+from types import FrameType
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# replacements normalizing the SQL of the queries of a shape, in order
+NORMALIZE: list[tuple[re.Pattern[str], str]] = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+PROJECT_DIR: str = str(settings.BASE_DIR) + os.sep
+# modules of the instrumentation, never the call site of a query
+INSTRUMENTATION: frozenset[str] = frozenset(
+    os.path.join(os.path.dirname(__file__), name) for name in ("middlewares.py", "nplusone.py", "timing.py")
+)
+
+Shape = tuple[str, str | None, str | None]
+
+
+def normalize(sql: str) -> str:
+    """Returns the shape of the SQL of a query, without its literals and with lists of any length collapsed."""
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def call_site(frame: FrameType | None) -> tuple[str | None, str | None]:
+    """
+    Returns the innermost project code line and template line of a stack.
+
+    The template line is read from the node being rendered by
+    django.template.base.Node.render_annotated.
+    """
+    code_line: str | None = None
+    template_line: str | None = None
+
+    while frame is not None and (code_line is None or template_line is None):
+        code = frame.f_code
+        if template_line is None and code.co_name == "render_annotated":
+            node = frame.f_locals.get("self")
+            token, origin = getattr(node, "token", None), getattr(node, "origin", None)
+            if token is not None and origin is not None:
+                template_line = f"{origin.template_name or origin.name}:{token.lineno}"
+        elif (
+            code_line is None
+            and code.co_filename.startswith(PROJECT_DIR)
+            and code.co_filename not in INSTRUMENTATION
+            and "site-packages" not in code.co_filename
+        ):
+            code_line = f"{os.path.relpath(code.co_filename, PROJECT_DIR)}:{frame.f_lineno}"
+        frame = frame.f_back
+
+    return code_line, template_line
+
+
+class QueryShapes:
+    """Counts of the query shapes of a sampled request by call site."""
+
+    def __init__(self) -> None:
+        self.counts: Counter[Shape] = Counter()
+
+    def record(self, sql: str) -> None:
+        """Count a query, called by the execute wrapper."""
+        self.counts[(normalize(sql), *call_site(sys._getframe(2)))] += 1
+
+    def repeated(self) -> list[tuple[Shape, int]]:
+        """Returns the shapes run settings.NPLUSONE_THRESHOLD times or more from one call site."""
+        return [(shape, count) for shape, count in self.counts.most_common() if count >= settings.NPLUSONE_THRESHOLD]
+
+    def report(self, view: str) -> None:
+        """Log a warning for every repeated shape."""
+        for (sql, code_line, template_line), count in self.repeated():
+            logger.warning(
+                "N+1 queries: view=%s count=%d code=%s template=%s sql=%s",
+                view,
+                count,
+                code_line,
+                template_line,
+                sql,
+                extra={"nplusone": {"view": view, "count": count, "code": code_line, "template": template_line}},
+            )
+
+
+def sample() -> QueryShapes | None:
+    """Returns the query shapes of a sampled request, None for the other requests."""
+    return QueryShapes() if random.random() < settings.NPLUSONE_SAMPLE_RATE else None
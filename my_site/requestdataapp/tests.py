@@ -1,3 +1,308 @@
-from django.test import TestCase
+import os
+import sqlite3
+from contextlib import ExitStack
+from http import HTTPStatus
+from tempfile import TemporaryDirectory
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from blogapp.models import Article, Author, Category
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse
+from django.template import engines
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import metrics, nplusone
+from .middlewares import CountRequestsMiddleware, ServerTimingMiddleware, SyncBoundaryMiddleware, ThrottlingMiddleware
+from .throttling import TokenBuckets
+from .timing import RequestTiming
+
+
+class TokenBucketsTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "throttling.sqlite3")
+        self.buckets = TokenBuckets(self.path, max_entries=3)
+        self.now = 1000.0
+        patcher = mock.patch("requestdataapp.throttling.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_refill(self):
+        decisions = [self.buckets.take("client", rate=2, burst=3) for _ in range(4)]
+        self.assertEqual([decision.allowed for decision in decisions], [True, True, True, False])
+        self.assertEqual(decisions[-1].retry_after, 1)
+
+        self.now += 0.5
+        self.assertTrue(self.buckets.take("client", rate=2, burst=3).allowed)
+        self.assertFalse(self.buckets.take("client", rate=2, burst=3).allowed)
+
+    def test_buckets_are_shared_by_processes(self):
+        other = TokenBuckets(self.path, max_entries=3)
+        self.assertTrue(self.buckets.take("client", rate=1, burst=1).allowed)
+        self.assertFalse(other.take("client", rate=1, burst=1).allowed)
+        self.assertTrue(other.take("another", rate=1, burst=1).allowed)
+
+    def test_least_recently_used_buckets_are_evicted(self):
+        for key in ("a", "b", "c", "d"):
+            self.now += 1
+            self.buckets.take(key, rate=1, burst=1)
+        self.now += 1
+        self.buckets.take("a", rate=1, burst=1)
+
+        self.assertEqual(self.buckets.cull(), 1)
+        self.assertEqual(self.buckets.count(), 3)
+        self.assertEqual(self.buckets.connection.execute("SELECT key FROM bucket WHERE key = 'b'").fetchall(), [])
+
+
+@override_settings(
+    THROTTLING_DATABASE=":memory:",
+    THROTTLING_BUDGETS={"api": (r"/api/", 1, 2), "default": (r"", 100, 100)},
+)
+class ThrottlingMiddlewareTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.calls = 0
+        self.middleware = ThrottlingMiddleware(self.get_response)
+        self.factory = RequestFactory()
+
+    def get_response(self, request):
+        self.calls += 1
+        return HttpResponse("OK")
+
+    def test_rejected_requests_do_not_reach_the_view(self):
+        responses = [self.middleware(self.factory.get("/api/products/", REMOTE_ADDR="10.1.0.1")) for _ in range(3)]
+
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        self.assertEqual(responses[-1].status_code, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(responses[-1]["Retry-After"], "1")
+        self.assertEqual(self.calls, 2)
+
+    def test_budgets_are_per_route_and_client(self):
+        for _ in range(2):
+            self.middleware(self.factory.get("/api/products/", REMOTE_ADDR="10.1.0.1"))
+
+        self.assertEqual(self.middleware(self.factory.get("/shop/", REMOTE_ADDR="10.1.0.1")).status_code, 200)
+        self.assertEqual(self.middleware(self.factory.get("/api/products/", REMOTE_ADDR="10.1.0.2")).status_code, 200)
+
+    @override_settings(THROTTLING_TRUSTED_PROXIES=1)
+    def test_client_cannot_choose_its_address(self):
+        for forwarded in ("1.1.1.1, 10.1.0.3", "2.2.2.2, 10.1.0.3", "10.1.0.3"):
+            request = self.factory.get("/api/products/", REMOTE_ADDR="172.18.0.2", HTTP_X_FORWARDED_FOR=forwarded)
+            self.assertEqual(ThrottlingMiddleware.get_client_ip(request), "10.1.0.3")
+            self.middleware(request)
+
+        self.assertEqual(self.calls, 2)
+        request = self.factory.get("/", REMOTE_ADDR="10.1.0.4", HTTP_X_FORWARDED_FOR="1.1.1.1")
+        with self.settings(THROTTLING_TRUSTED_PROXIES=0):
+            self.assertEqual(ThrottlingMiddleware.get_client_ip(request), "10.1.0.4")
+
+    def test_locked_buckets_allow_the_requests(self):
+        with mock.patch.object(self.middleware.buckets, "take", side_effect=sqlite3.OperationalError("locked")):
+            with self.assertLogs("requestdataapp.middlewares", "WARNING"):
+                response = self.middleware(self.factory.get("/api/products/", REMOTE_ADDR="10.1.0.5"))
+
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(THROTTLING_BUDGETS={"default": (r"", 1, 1)})
+class AsgiMiddlewareTestCase(SimpleTestCase):
+    def test_stack_runs_synchronously(self):
+        modes = {}
+
+        def record_mode(middleware):
+            init = middleware.__init__
+
+            def __init__(self, get_response):
+                modes[middleware.__name__] = iscoroutinefunction(get_response)
+                init(self, get_response)
+
+            return __init__
+
+        middlewares = (CountRequestsMiddleware, ThrottlingMiddleware, ServerTimingMiddleware, SyncBoundaryMiddleware)
+        with ExitStack() as stack:
+            for middleware in middlewares:
+                stack.enter_context(mock.patch.object(middleware, "__init__", record_mode(middleware)))
+            ASGIHandler()
+
+        self.assertEqual(modes, dict.fromkeys((middleware.__name__ for middleware in middlewares), False))
+
+    async def test_asgi_request(self):
+        with TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            response = await self.async_client.get("/req/get/", headers={"user-agent": "agent"})
+            self.assertContains(response, "HTTP User-agent agent")
+            response = await self.async_client.get("/req/get/")
+            self.assertEqual(response.status_code, HTTPStatus.TOO_MANY_REQUESTS)
+            self.assertIn('http_responses_total{view="<unresolved>",status="429"} 1\n', metrics.render())
+
+
+class MetricsTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = override_settings(METRICS_DIR=self.directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_values_of_the_processes_are_summed(self):
+        metrics.inc("http_requests_total", view="shop_app:index", method="GET")
+        other = metrics.MmapValues(os.path.join(self.directory.name, "metrics_1.db"))
+        other.inc('http_requests_total{view="shop_app:index",method="GET"}', 2)
+        other.inc('http_requests_total{view="shop_app:order_list",method="GET"}')
+
+        self.assertEqual(
+            dict(metrics.collect()),
+            {
+                'http_requests_total{view="shop_app:index",method="GET"}': 3,
+                'http_requests_total{view="shop_app:order_list",method="GET"}': 1,
+            },
+        )
+
+    def test_values_survive_a_restart(self):
+        path = os.path.join(self.directory.name, "metrics_1.db")
+        metrics.MmapValues(path).inc("restarts", 1)
+        restarted = metrics.MmapValues(path)
+        restarted.inc("restarts", 1)
+        for idx in range(2000):
+            restarted.inc(f"key{idx}")
+
+        self.assertEqual(metrics.collect()["restarts"], 2)
+        self.assertEqual(metrics.collect()["key1999"], 1)
+
+    def test_files_of_stopped_processes_are_merged(self):
+        stopped = metrics.MmapValues(os.path.join(self.directory.name, "metrics_99999999.db"))
+        stopped.inc("restarts", 2)
+        stopped.close()
+        metrics.MmapValues(os.path.join(self.directory.name, metrics.TOTALS_FILENAME)).inc("restarts", 1)
+
+        metrics.inc("restarts")
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "metrics_99999999.db")))
+        self.assertEqual(metrics.collect()["restarts"], 4)
+
+    def test_histogram_buckets_are_cumulative(self):
+        for duration in (0.003, 0.2, 20):
+            metrics.observe("http_request_duration_seconds", duration, view="v")
+        text = metrics.render()
+
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+        self.assertIn('http_request_duration_seconds_bucket{view="v",le="0.005"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="v",le="0.25"} 2\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="v",le="+Inf"} 3\n', text)
+        self.assertIn('http_request_duration_seconds_count{view="v"} 3\n', text)
+        self.assertEqual(text.count("# TYPE"), 1)
+
+    def test_metrics_view(self):
+        self.client.get("/req/get/")
+        self.client.generic("PURGE", "/req/get/")
+        self.client.get("/req/missing/")
+
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.1.1.3").status_code, 403)
+        response = self.client.get("/metrics", REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('http_requests_total{view="requestdataapp:get-view",method="GET"} 1\n', text)
+        self.assertIn('http_responses_total{view="<unresolved>",status="404"} 1\n', text)
+        self.assertIn('http_requests_total{view="requestdataapp:get-view",method="other"} 1\n', text)
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+
+    @override_settings(THROTTLING_TRUSTED_PROXIES=1)
+    def test_metrics_view_behind_proxy(self):
+        forwarded = {"x-forwarded-for": "203.0.113.5"}
+        self.assertEqual(self.client.get("/metrics", headers=forwarded, REMOTE_ADDR="127.0.0.1").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="127.0.0.1").status_code, 200)
+
+
+@override_settings(QUERY_BUDGETS={"default": 1})
+class ServerTimingMiddlewareTestCase(TestCase):
+    @override_settings(QUERY_BUDGETS={"default": 1, "shop_app:product_list": 10})
+    def test_header_and_log_line(self):
+        with self.assertLogs("requestdataapp.timing", "INFO") as logs:
+            response = self.client.get("/en/shop/products/")
+
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", template;dur=[\d.]+, app;dur=')
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].timing["view"], "shop_app:product_list")
+        self.assertGreater(logs.records[0].timing["queries"], 0)
+        self.assertGreater(logs.records[0].timing["template_ms"], 0)
+
+    @override_settings(QUERY_BUDGETS={"default": 1, "shop_app:product_list": 10})
+    async def test_queries_are_counted_under_asgi(self):
+        with self.assertLogs("requestdataapp.timing", "INFO") as logs:
+            response = await self.async_client.get("/en/shop/products/")
+
+        self.assertEqual(logs.records[0].timing["view"], "shop_app:product_list")
+        self.assertGreater(logs.records[0].timing["queries"], 0)
+        self.assertIn(f'desc="{logs.records[0].timing["queries"]} queries"', response["Server-Timing"])
+
+    def test_query_budget(self):
+        User.objects.create_user(username="timing-user", password="qwerty123")
+        self.client.login(username="timing-user", password="qwerty123")
+
+        with self.assertLogs("requestdataapp.timing", "INFO") as logs:
+            response = self.client.get("/en/shop/")
+
+        queries = logs.records[0].timing["queries"]
+        self.assertGreater(queries, 1)
+        self.assertIn(f'desc="{queries} queries"', response["Server-Timing"])
+        self.assertEqual(logs.records[1].levelname, "WARNING")
+        self.assertIn(f"view=shop_app:index queries={queries} budget=1", logs.records[1].getMessage())
+
+    def test_streaming_response_is_logged_when_closed(self):
+        user = User.objects.create_user(username="timing-staff", password="qwerty123", is_staff=True)
+        self.client.force_login(user)
+
+        with self.assertLogs("requestdataapp.timing", "INFO") as logs:
+            response = self.client.get("/en/shop/orders/export/")
+            self.assertTrue(response.streaming)
+            b"".join(response.streaming_content)
+            response.close()
+
+        self.assertIn("Server-Timing", response)
+        self.assertEqual(logs.records[0].timing["view"], "shop_app:order_export")
+
+
+class NPlusOneTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(name="Author")
+        category = Category.objects.create(name="Category")
+        for idx in range(6):
+            Article.objects.create(title=f"Article {idx}", content="text", author=author, category=category)
+
+    def test_normalize(self):
+        self.assertEqual(
+            nplusone.normalize('SELECT "a" FROM "t" WHERE "id" IN (%s, %s, %s) AND "name" = \'x\' LIMIT 21'),
+            'SELECT "a" FROM "t" WHERE "id" IN (...) AND "name" = ? LIMIT ?',
+        )
+        self.assertEqual(
+            nplusone.normalize("SELECT 1 WHERE id IN (%s)"), nplusone.normalize("SELECT 2 WHERE id IN (%s, %s)")
+        )
+
+    def test_repeated_queries_are_reported_with_their_call_site(self):
+        template = engines["django"].from_string("{% for article in articles %}\n{{ article }}{% endfor %}")
+        timing = RequestTiming(nplusone.QueryShapes()).activate()
+        try:
+            template.render({"articles": Article.objects.all()})
+        finally:
+            timing.deactivate()
+
+        [(sql, code_line, template_line), count] = timing.shapes.repeated()[0]
+        self.assertEqual(count, 6)
+        self.assertIn('FROM "blogapp_author"', sql)
+        self.assertRegex(code_line, r"^blogapp/models.py:\d+$")
+        self.assertEqual(template_line, "<unknown source>:2")
+        self.assertEqual(len(timing.shapes.repeated()), 1)
+
+        with self.assertLogs("requestdataapp.nplusone", "WARNING") as logs:
+            timing.shapes.report("blogapp:article_list")
+        self.assertIn("N+1 queries: view=blogapp:article_list count=6 code=blogapp/models.py:", logs.output[0])
+
+    @override_settings(NPLUSONE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_checked(self):
+        with self.assertNoLogs("requestdataapp.nplusone", "WARNING"):
+            response = self.client.get("/en/blog/articles/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.wsgi_request.timing.shapes)
@@ -0,0 +1,125 @@
+"""
+Token buckets of ThrottlingMiddleware shared by the worker processes of a host.
+
+A bucket holds up to `burst` tokens and is refilled with `rate` tokens per second,
+every request takes one token and is rejected when less than one is left. The
+buckets are rows of a SQLite file in WAL mode, so the limit applies to all the
+gunicorn workers together, and a bucket is refilled and taken from with a single
+atomic UPSERT. Times are read from the monotonic clock, which is shared by the
+processes of a host and does not jump with the wall clock.
+
+The number of buckets is bounded: every `cull_every` requests of a process the
+least recently used buckets above `max_entries` are evicted. An evicted client
+starts again with a full bucket, like a new one.
+
+A request waits at most `timeout` seconds for the lock of the file, the caller
+decides what to do with the sqlite3.OperationalError raised after it.
+"""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Mapping, NamedTuple
+
+
+class Budget(NamedTuple):
+    """Budget of the requests to the paths matching a regular expression."""
+
+    name: str
+    path: re.Pattern[str]
+    rate: float
+    burst: float
+
+
+class Decision(NamedTuple):
+    """Result of taking a token, `retry_after` is the number of seconds until a token is available."""
+
+    allowed: bool
+    retry_after: int
+
+
+def load_budgets(budgets: Mapping[str, tuple[str, float, float]]) -> list[Budget]:
+    """Returns the budgets of the THROTTLING_BUDGETS setting, in their order."""
+    return [Budget(name, re.compile(path), float(rate), float(burst)) for name, (path, rate, burst) in budgets.items()]
+
+
+def match_budget(budgets: list[Budget], path: str) -> Budget | None:
+    """Returns the first budget matching the path, None if the path is not throttled."""
+    for budget in budgets:
+        if budget.path.search(path):
+            return budget
+    return None
+
+
+class TokenBuckets:
+    """Token buckets stored in a SQLite file, ':memory:' keeps them in the current thread only."""
+
+    def __init__(
+        self, path: str | os.PathLike[str], max_entries: int, cull_every: int = 1000, timeout: float = 0.1
+    ) -> None:
+        self.path: str = os.fspath(path)
+        self.max_entries: int = max_entries
+        self.cull_every: int = cull_every
+        self.timeout: float = timeout
+        self.requests: int = 0
+        self.local: threading.local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread, a forked process opens its own connection."""
+        if getattr(self.local, "pid", None) != os.getpid():
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection: sqlite3.Connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bucket "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS bucket_updated ON bucket (updated)")
+            self.local.connection, self.local.pid = connection, os.getpid()
+        current: sqlite3.Connection = self.local.connection
+        return current
+
+    def take(self, key: str, rate: float, burst: float) -> Decision:
+        """Refills the bucket of the key and takes a token from it if one is left."""
+        now: float = time.monotonic()
+        # the refill of a clock reset, e.g. after a reboot, is zero instead of negative
+        refilled: str = "min(:burst, bucket.tokens + max(:now - bucket.updated, 0) * :rate)"
+        tokens, allowed = self.connection.execute(
+            "INSERT INTO bucket (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, :burst >= 1) "
+            f"ON CONFLICT (key) DO UPDATE SET tokens = {refilled} - ({refilled} >= 1), "
+            f"updated = :now, allowed = {refilled} >= 1 "
+            "RETURNING tokens, allowed",
+            {"key": key, "burst": burst, "rate": rate, "now": now},
+        ).fetchone()
+
+        self.requests += 1
+        if self.requests >= self.cull_every:
+            self.requests = 0
+            self.cull()
+
+        if allowed:
+            return Decision(True, 0)
+        return Decision(False, math.ceil((1 - tokens) / rate) if rate > 0 else 0)
+
+    def cull(self) -> int:
+        """Evicts the least recently used buckets above max_entries and returns their number."""
+        return self.connection.execute(
+            "DELETE FROM bucket WHERE key IN "
+            "(SELECT key FROM bucket ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+
+    def count(self) -> int:
+        """Returns the number of stored buckets."""
+        count: int = self.connection.execute("SELECT count(*) FROM bucket").fetchone()[0]
+        return count
+
+    def clear(self) -> None:
+        """Deletes all the buckets."""
+        self.connection.execute("DELETE FROM bucket")
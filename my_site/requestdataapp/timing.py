@@ -0,0 +1,102 @@
+"""
+Where the time of a request goes: database queries, template rendering and the rest.
+
+A RequestTiming counts the queries of all the database connections with
+connection.execute_wrapper() while it is active, and the time spent rendering
+TemplateResponse objects, see ServerTimingMiddleware. The numbers are sent in the
+Server-Timing header, shown by the network panel of the browsers, and logged as
+one line of key=value pairs per request, also passed as the `timing` attribute of
+the log record for structured handlers.
+
+The queries of a sampled request are also grouped by shape to find N+1 queries,
+see requestdataapp.nplusone.
+
+The queries of a streaming response are run while it is sent, after the headers:
+its log line, written when the stream is closed, includes them, its header does not.
+"""
+
+import logging
+from contextlib import ExitStack
+from time import perf_counter
+from typing import Any, Callable
+
+from django.conf import settings
+from django.db import connections
+
+from .nplusone import QueryShapes
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    """Durations in seconds and query count of a request, and its query shapes if it is sampled."""
+
+    def __init__(self, shapes: QueryShapes | None = None) -> None:
+        self.shapes: QueryShapes | None = shapes
+        self.start: float = perf_counter()
+        self.queries: int = 0
+        self.db: float = 0.0
+        self.template: float = 0.0
+        self.stack: ExitStack = ExitStack()
+
+    def __call__(self, execute: Callable[..., Any], sql: str, params: Any, many: bool, context: dict[str, Any]) -> Any:
+        """Execute wrapper timing the queries."""
+        if self.shapes is not None:
+            self.shapes.record(sql)
+        start: float = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += perf_counter() - start
+            self.queries += 1
+
+    def activate(self) -> "RequestTiming":
+        """Start timing the queries of all the database connections."""
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def deactivate(self) -> None:
+        """Stop timing the queries."""
+        self.stack.close()
+
+    @property
+    def total(self) -> float:
+        return perf_counter() - self.start
+
+    def header(self) -> str:
+        """Returns the value of the Server-Timing header, durations in milliseconds."""
+        total: float = self.total
+        return ", ".join(
+            [
+                f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+                f"template;dur={self.template * 1000:.1f}",
+                f"app;dur={max(total - self.db - self.template, 0) * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+
+    def log(self, view: str, method: str, status: int) -> None:
+        """Log the numbers of the request, a warning if the view exceeded its query budget and the N+1 queries."""
+        fields: dict[str, Any] = {
+            "view": view,
+            "method": method,
+            "status": status,
+            "queries": self.queries,
+            "db_ms": round(self.db * 1000, 1),
+            "template_ms": round(self.template * 1000, 1),
+            "total_ms": round(self.total * 1000, 1),
+        }
+        logger.info(" ".join(f"{key}={value}" for key, value in fields.items()), extra={"timing": fields})
+
+        budget: int = settings.QUERY_BUDGETS.get(view, settings.QUERY_BUDGETS["default"])
+        if self.queries > budget:
+            logger.warning(
+                "Query budget exceeded: view=%s queries=%d budget=%d",
+                view,
+                self.queries,
+                budget,
+                extra={"timing": fields},
+            )
+        if self.shapes is not None:
+            self.shapes.report(view)
@@ -5,8 +5,11 @@ from django.core.exceptions import ValidationError
 from django.core.files.storage import FileSystemStorage
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
+from django.views.decorators.http import require_GET
 
+from . import metrics
 from .forms import UploadFileForm, UserBioForm
+from .middlewares import ThrottlingMiddleware
 
 
 def process_get_view(request: HttpRequest) -> HttpResponse:
@@ -55,3 +58,19 @@ def handle_file_upload(request: HttpRequest) -> HttpResponse:
         context=context,
         status=http_status_code,
     )
+
+
+@require_GET
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    Serve the request metrics of all the worker processes in the Prometheus text format.
+
+    Only the addresses of settings.METRICS_ALLOWED_IPS, e.g. the Prometheus server,
+    and the staff users may read them. The address is the one the proxies saw, a
+    proxy of the same host connects from the loopback address.
+    """
+    client_ip: str = ThrottlingMiddleware.get_client_ip(request)
+    if client_ip not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403)
+
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -6,11 +6,13 @@ from django.http import HttpRequest, HttpResponse
 from django.shortcuts import redirect, render
 from django.urls import URLPattern, path
 from django.utils.translation import gettext_lazy as _
+from jobsapp.models import Job
+from jobsapp.queue import enqueue, store_upload
 
 from .admin_mixins import ExportAsCSVMixin
-from .common import save_csv_file, save_json_file
 from .forms import FileImportForm
 from .models import Order, Product, ProductImage
+from .tasks import import_orders_file, import_products_file, set_products_archived
 
 
 class OrderInline(admin.TabularInline):
@@ -24,16 +26,25 @@ class ProductImageInline(admin.StackedInline):
     model = ProductImage
 
 
+def job_message(job: Job) -> str:
+    """Returns the admin message about a scheduled job."""
+    return _("Job #%(pk)d is scheduled, its status: %(url)s") % {"pk": job.pk, "url": job.get_absolute_url()}
+
+
 @admin.action(description="Archive product")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     """Function for group action archiving"""
-    queryset.update(archived=True)
+    pks: list[int] = list(queryset.values_list("pk", flat=True))
+    job: Job = enqueue(set_products_archived, user=request.user, pks=pks, archived=True)
+    modeladmin.message_user(request, job_message(job))
 
 
 @admin.action(description="Unarchive product")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     """Function for group action unzip"""
-    queryset.update(archived=False)
+    pks: list[int] = list(queryset.values_list("pk", flat=True))
+    job: Job = enqueue(set_products_archived, user=request.user, pks=pks, archived=False)
+    modeladmin.message_user(request, job_message(job))
 
 
 @admin.register(Product)
@@ -53,9 +64,10 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         "name",
         "description",
     ]  # устанавливаем поля, по которым идет поиск
+    export_csv_related: list[str] = ["created_by__username"]  # колонки связей в CSV
     inlines: list[OrderInline] = [OrderInline, ProductImageInline]  # связь Many to Many
     fieldsets: list[Tuple[None | str | Dict]] = [
-        (None, {"fields": ("name", "description")}),
+        (None, {"fields": ("name", "sku", "description")}),
         (_("Price options"), {"fields": ("price", "discount"), "classes": ("collapse", "wide")}),
         (_("Images"), {"fields": ("preview",)}),
         (
@@ -102,13 +114,19 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
                 status=400,
             )
         uploaded_file = form.files["uploaded_file"]
-        base_message: str = _("Data from %s was imported")
         level_message: int = messages.SUCCESS
         redirect_url: str = ".."
 
         if uploaded_file.name.endswith(".csv"):
-            save_csv_file(obj=Product, file=uploaded_file.file, encoding=request.encoding)
-            loading_message = base_message % "CSV"
+            job: Job = enqueue(
+                import_products_file,
+                user=request.user,
+                path=store_upload(uploaded_file),
+                encoding=request.encoding,
+                workers=form.cleaned_data["workers"] or 1,
+                upsert=form.cleaned_data["upsert"],
+            )
+            loading_message = job_message(job)
         else:
             file_extension: str = request.path[request.path.rfind("-") + 1 : -1]
             loading_message = _("The file must have the %s extension") % file_extension
@@ -190,25 +208,16 @@ class OrderAdmin(admin.ModelAdmin):
             )
         uploaded_file = form.files["uploaded_file"]
         redirect_url: str = ".."
-        base_message: str = _("Data from %s was imported")
         level_message: int = messages.SUCCESS
 
-        if uploaded_file.name.endswith(".csv"):
-            save_csv_file(
-                obj=Order,
-                file=uploaded_file.file,
-                encoding=request.encoding,
-                exclude_key="products",
-            )
-            loading_message: str = base_message % "CSV"
-        elif uploaded_file.name.endswith(".json"):
-            save_json_file(
-                obj=Order,
-                file=uploaded_file.file,
+        if uploaded_file.name.endswith((".csv", ".json", ".ndjson", ".jsonl")):
+            job: Job = enqueue(
+                import_orders_file,
+                user=request.user,
+                path=store_upload(uploaded_file),
                 encoding=request.encoding,
-                exclude_key="products",
             )
-            loading_message = base_message % "JSON"
+            loading_message: str = job_message(job)
         else:
             file_extension: str = request.path[request.path.rfind("-") + 1 : -1]
             loading_message = _("The file must have the %s extension") % file_extension
@@ -0,0 +1,98 @@
+import hashlib
+from typing import Any, Callable, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Model
+from django.http import HttpResponse
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .invalidation import generations
+
+
+class GenerationCacheMixin:
+    """
+    Viewset mixin caching the JSON responses of the `list` and `retrieve` actions.
+
+    The cache key combines the host, the path, the sorted query parameters (search,
+    filters, ordering, page), the active language, the renderer and the generations
+    of the `cache_models`. Saving an instance of these models starts a new generation,
+    see shop_app.invalidation, so a response is reused until its tables change and
+    a cache hit costs no database query. Responses of the browsable API are not
+    cached, they contain the user and a CSRF token.
+
+    The generations are also the ETag of the responses, so a conditional request
+    for unchanged tables is answered with 304 before any query or rendering.
+    """
+
+    cache_models: List[type[Model]] = []
+    cache_timeout: int | None = None
+
+    def get_etag(self, request: Request, versions: list[int]) -> str:
+        """Returns the ETag of the response for the generations, the browsable API pages depend on the user."""
+        renderer: str = request.accepted_renderer.format
+        parts: list[Any] = [versions, translation.get_language(), renderer]
+        if renderer != "json":
+            parts.append(request.user.pk)
+        return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+    def get_cache_key(self, request: Request, versions: list[int]) -> str:
+        """Returns the cache key of the response to the request for the generations."""
+        params: list[tuple[str, str]] = sorted(
+            (name, value) for name in request.query_params for value in request.query_params.getlist(name)
+        )
+        parts: list[Any] = [
+            request.get_host(),
+            request.path,
+            params,
+            translation.get_language(),
+            request.accepted_renderer.format,
+            versions,
+        ]
+        return f"api_response.{self.basename}.{hashlib.md5(repr(parts).encode()).hexdigest()}"
+
+    def cached_response(self, handler: Callable[..., Response], request: Request, *args: Any, **kwargs: Any):
+        """Returns 304, the cached response or the response of the handler, which is cached once rendered."""
+        versions: list[int] = generations(*self.cache_models)
+        etag: str = self.get_etag(request, versions)
+        response: HttpResponse | None = get_conditional_response(request, etag=etag)
+
+        if response is None:
+            response = self.render_or_get(handler, request, versions, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response.headers["ETag"] = etag
+        return response
+
+    def render_or_get(
+        self, handler: Callable[..., Response], request: Request, versions: list[int], *args: Any, **kwargs: Any
+    ) -> HttpResponse:
+        """Returns the cached JSON response or the response of the handler, which is cached once rendered."""
+        if request.accepted_renderer.format != "json":
+            return handler(request, *args, **kwargs)
+
+        cache_key: str = self.get_cache_key(request, versions)
+        cached: tuple[bytes, str] | None = cache.get(cache_key)
+
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response: Response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            timeout: int = self.cache_timeout or settings.API_CACHE_TIMEOUT
+            response.add_post_render_callback(
+                lambda rendered: cache.set(cache_key, (rendered.content, rendered["Content-Type"]), timeout)
+            )
+        return response
+
+    def list(self, request: Request, *args: Any, **kwargs: Any):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request: Request, *args: Any, **kwargs: Any):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -6,3 +6,7 @@ class ShopAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop_app'
     verbose_name = _("shop")
+
+    def ready(self) -> None:
+        """Connects the signal handlers of the application."""
+        from . import signals  # noqa: F401
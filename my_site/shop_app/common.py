@@ -1,64 +1,526 @@
+import hashlib
 import json
+import logging
+from collections import defaultdict
 from csv import DictReader
+from dataclasses import dataclass, field
+from decimal import Decimal
 from io import TextIOWrapper
-from typing import Iterator
+from itertools import islice
+from timeit import default_timer
+from typing import Any, Callable, Iterable, Iterator, TextIO
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.db import transaction
+from django.db.models import Field, Model, QuerySet
+from django.utils.translation import gettext as _
 
+from .invalidation import generation_key, invalidate, user_orders_export_key
 from .models import Order, Product
 
+logger = logging.getLogger(__name__)
 
-def filter_dict(row_dict: dict[str, str], key_name: str | None) -> dict[str, User | str]:
-    """Returns a filtered dictionary by key, if there is no key then the original one."""
-    if key_name is None:
-        return row_dict
 
-    filtered_row_dict: dict[str, User | str] = {}
-    key_user: str = "user"
+@dataclass
+class ImportReport:
+    """
+    Result of a streaming import.
 
-    for key, val in row_dict.items():
-        if key == key_user:
-            filtered_row_dict[key] = User.objects.get(username=val)
-        elif key != key_name:
-            filtered_row_dict[key] = val
+    Attributes:
+        created (int): Number of rows saved to the database.
+        updated (int): Number of existing rows changed by an upsert import.
+        unchanged (int): Number of rows of an upsert import skipped without a write.
+        rejected (int): Number of rows skipped because they failed validation.
+        errors (list): Details of the first rejected rows, limited by settings.IMPORT_MAX_ERRORS.
+        elapsed (float): Import duration in seconds.
+    """
 
-    return filtered_row_dict
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: int = 0
+    errors: list[dict[str, Any]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        """Returns the number of processed rows."""
+        return self.created + self.updated + self.unchanged + self.rejected
+
+    @property
+    def rows_per_sec(self) -> float:
+        """Returns the import throughput."""
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def reject(self, line: int, error: Exception | str, **context: Any) -> None:
+        """Counts a rejected row and keeps its error while the limit is not reached."""
+        self.rejected += 1
+
+        if len(self.errors) < settings.IMPORT_MAX_ERRORS:
+            if isinstance(error, ValidationError) and hasattr(error, "error_dict"):
+                self.errors.append({"line": line, **context, "error": error.message_dict})
+            else:
+                self.errors.append({"line": line, **context, "error": str(error)})
+
+    def merge(self, other: "ImportReport") -> None:
+        """Adds the counters and errors of a partial report, e.g. of a shard."""
+        self.created += other.created
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        self.rejected += other.rejected
+        self.errors.extend(other.errors[: settings.IMPORT_MAX_ERRORS - len(self.errors)])
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns the report as a JSON-serializable dictionary."""
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1),
+        }
+
+
+def iter_chunks(iterable: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    """Yields lists of at most `size` items without materializing the iterable."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def split_names(value: str | list[str] | None) -> list[str]:
+    """Returns the product names from a comma-separated string or a list."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [name.strip() for name in value if name.strip()]
+
+
+def lookup_map(queryset: QuerySet, key_field: str, values: Iterable[str]) -> dict[str, list[int]]:
+    """
+    Resolves values of a field to primary keys.
+
+    Values are looked up in batches of settings.IMPORT_LOOKUP_BATCH_SIZE, so a chunk
+    of rows costs one query per batch instead of one query per row.
+    """
+    mapping: dict[str, list[int]] = defaultdict(list)
+
+    for batch in iter_chunks(set(values), settings.IMPORT_LOOKUP_BATCH_SIZE):
+        for key, pk in queryset.filter(**{f"{key_field}__in": batch}).values_list(key_field, "pk"):
+            mapping[key].append(pk)
+
+    return mapping
+
+
+def build_instance(obj: type[Model], row: dict[str, Any], exclude_key: str | None = None) -> Model:
+    """
+    Converts and validates one row into an unsaved model instance.
+
+    Relation fields are excluded from validation, because checking them would cost
+    a query per row, their keys are only converted, e.g. the string "3" of a CSV
+    column to 3, so the content hashes of the upserts match the stored rows.
+
+    Raises:
+        ValidationError: If a field value cannot be converted or is not valid.
+    """
+    instance: Model = obj(**{key: val for key, val in row.items() if key != exclude_key})
+    relations: list[Field[Any, Any]] = [f for f in obj._meta.concrete_fields if f.is_relation]
+    instance.clean_fields(exclude=[f.name for f in relations])
+
+    for relation in relations:
+        value: Any = getattr(instance, relation.attname)
+        if value not in relation.empty_values:
+            setattr(instance, relation.attname, relation.to_python(value))
+    return instance
+
+
+def validate_chunk(
+    obj: type[Model],
+    chunk: Iterable[tuple[int, dict[str, Any]]],
+    report: ImportReport,
+    exclude_key: str | None = None,
+    natural_key: str | None = None,
+    **context: Any,
+) -> list[Model]:
+    """
+    Returns the valid instances of a chunk of numbered rows, invalid rows are rejected in the report.
+
+    With `natural_key` the rows without a value of the key are rejected too.
+    """
+    valid: list[Model] = []
+
+    for line, row in chunk:
+        try:
+            instance: Model = build_instance(obj, row, exclude_key)
+        except (ValidationError, TypeError, ValueError) as exc:
+            report.reject(line, exc, **context)
+            continue
+
+        if natural_key and getattr(instance, natural_key) in (None, ""):
+            report.reject(line, ValidationError({natural_key: [_("The upsert import requires a value.")]}), **context)
+            continue
+
+        valid.append(instance)
+
+    return valid
+
+
+def save_instances(obj: type[Model], instances: list[Model], report: ImportReport) -> None:
+    """Saves validated instances with a bounded bulk_create in one transaction."""
+    if not instances:
+        return
+
+    with transaction.atomic():
+        created: list[Model] = obj.objects.bulk_create(instances, batch_size=settings.IMPORT_BATCH_SIZE)
+
+    report.created += len(created)
+
+
+def check_natural_key(obj: type[Model], key: str) -> str:
+    """
+    Returns the name of the natural key field of an upsert import.
+
+    Raises:
+        ValueError: If the field does not exist or has no unique index.
+    """
+    try:
+        key_field: Field = obj._meta.get_field(key)
+    except FieldDoesNotExist as exc:
+        raise ValueError(_("%(model)s has no field %(key)r") % {"model": obj.__name__, "key": key}) from exc
+
+    if not key_field.unique and not any(c.fields == (key,) for c in obj._meta.total_unique_constraints):
+        raise ValueError(_("%(model)s.%(key)s has no unique index") % {"model": obj.__name__, "key": key})
+
+    return key_field.name
+
+
+def update_fields_of(obj: type[Model], columns: Iterable[str], key: str) -> list[str]:
+    """
+    Returns the names of the concrete fields filled by the imported columns, except the primary and natural keys.
+
+    Fields with auto_now, e.g. updated_at, are not compared by the upsert, they are
+    appended by upsert_instances to the updated fields.
+    """
+    columns = set(columns)
+    return [
+        f.name
+        for f in obj._meta.concrete_fields
+        if not f.primary_key
+        and f.name != key
+        and not getattr(f, "auto_now", False)
+        and (f.name in columns or f.attname in columns)
+    ]
+
+
+def content_digest(values: Iterable[Any]) -> bytes:
+    """
+    Returns a hash of the field values of a row.
+
+    Decimals are normalized, so Decimal("10") of a parsed row and Decimal("10.00")
+    read from the database have the same hash.
+    """
+    normalized: list[Any] = [value.normalize() if isinstance(value, Decimal) else value for value in values]
+    return hashlib.blake2b(repr(normalized).encode(), digest_size=16).digest()
+
+
+def upsert_instances(
+    obj: type[Model], instances: list[Model], report: ImportReport, key: str, fields: list[str]
+) -> None:
+    """
+    Creates or updates validated instances matched by the natural key `key`.
+
+    The content hashes of the existing rows are read with one query per lookup batch,
+    rows whose `fields` are unchanged are skipped without any write. The remaining rows
+    are written with bulk_create(update_conflicts=True) in one transaction. If a key
+    repeats in the chunk, the last row wins and the earlier ones count as unchanged.
+    """
+    if not instances:
+        return
+
+    latest: dict[Any, Model] = {getattr(instance, key): instance for instance in instances}
+    existing: dict[Any, bytes] = {}
+
+    for batch in iter_chunks(latest, settings.IMPORT_LOOKUP_BATCH_SIZE):
+        for key_value, *values in obj.objects.filter(**{f"{key}__in": batch}).values_list(key, *fields):
+            existing[key_value] = content_digest(values)
+
+    changed: list[Model] = [
+        instance
+        for key_value, instance in latest.items()
+        if existing.get(key_value) != content_digest(instance.serializable_value(name) for name in fields)
+    ]
+    created: int = sum(1 for instance in changed if getattr(instance, key) not in existing)
+    auto_now: list[str] = [f.name for f in obj._meta.concrete_fields if getattr(f, "auto_now", False)]
+
+    if changed:
+        with transaction.atomic():
+            if fields:
+                obj.objects.bulk_create(
+                    changed,
+                    batch_size=settings.IMPORT_BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=[key],
+                    update_fields=fields + auto_now,
+                )
+            else:
+                # only the key is imported, the changed rows are the new ones
+                obj.objects.bulk_create(changed, batch_size=settings.IMPORT_BATCH_SIZE, ignore_conflicts=True)
+
+    report.created += created
+    report.updated += len(changed) - created
+    report.unchanged += len(instances) - len(changed)
+
+
+def _save_orders_chunk(
+    chunk: list[tuple[int, dict[str, Any]]], report: ImportReport, products_key: str = "products"
+) -> None:
+    """
+    Saves a chunk of orders with set-based lookups of users and products.
+
+    All usernames and product names of the chunk are resolved with one query each,
+    orders and their Order.products.through rows are written with bulk_create.
+    Rows with unknown users or products are rejected with structured errors.
+    """
+    users: dict[str, list[int]] = lookup_map(
+        User.objects.all(), "username", (row.get("user") or "" for line, row in chunk)
+    )
+    products: dict[str, list[int]] = lookup_map(
+        Product.objects.all(), "name", (name for line, row in chunk for name in split_names(row.get(products_key)))
+    )
+    valid: list[tuple[Order, list[int]]] = []
+
+    for line, row in chunk:
+        username: str = row.get("user") or ""
+        names: list[str] = split_names(row.get(products_key))
+        errors: dict[str, list[str]] = {}
+
+        if username not in users:
+            errors["user"] = [_("Unknown user: %s") % username]
+
+        unknown_names: list[str] = [name for name in names if name not in products]
+        if unknown_names:
+            errors["products"] = [_("Unknown products: %s") % ", ".join(unknown_names)]
+
+        try:
+            data: dict[str, Any] = {key: val for key, val in row.items() if key not in ("user", products_key)}
+            order: Order = build_instance(Order, data)
+        except ValidationError as exc:
+            errors.update(exc.message_dict)
+        except (TypeError, ValueError) as exc:
+            report.reject(line, exc)
+            continue
+
+        if errors:
+            report.reject(line, ValidationError(errors))
+            continue
+
+        order.user_id = users[username][0]
+        product_pks: list[int] = list(dict.fromkeys(pk for name in names for pk in products[name]))
+        valid.append((order, product_pks))
+
+    if not valid:
+        return
+
+    through: type[Model] = Order.products.through
+
+    with transaction.atomic():
+        created: list[Order] = Order.objects.bulk_create(
+            [order for order, product_pks in valid], batch_size=settings.IMPORT_BATCH_SIZE
+        )
+        through.objects.bulk_create(
+            [
+                through(order_id=order.pk, product_id=product_pk)
+                for order, (instance, product_pks) in zip(created, valid)
+                for product_pk in product_pks
+            ],
+            batch_size=settings.IMPORT_BATCH_SIZE,
+        )
+        # bulk_create sends no signals, the exports of the owners are dropped here
+        user_ids: set[int] = {order.user_id for order in created}
+        invalidate([generation_key(Order), *(user_orders_export_key(user_id) for user_id in user_ids)])
+
+    report.created += len(created)
+
+
+def import_rows(
+    obj: type[Model],
+    rows: Iterable[dict[str, Any]],
+    exclude_key: str | None = None,
+    chunk_size: int | None = None,
+    on_progress: Callable[[ImportReport], None] | None = None,
+    upsert_key: str | None = None,
+) -> ImportReport:
+    """
+    Saves rows to the database in fixed-size chunks.
+
+    Rows are consumed lazily, so memory usage depends on the chunk size only.
+    Every chunk is validated and written with a bounded bulk_create inside its own
+    transaction, invalid rows are counted in the report instead of aborting the import.
+    For orders `exclude_key` is the column with product names. `on_progress` is called
+    with the report after every chunk.
+
+    With `upsert_key` the rows update the existing rows with the same value of this
+    unique field instead of creating duplicates, the fields of the columns present in
+    the chunk are updated. Upserts are not supported for orders.
+    """
+    if upsert_key:
+        if obj is Order:
+            raise ValueError(_("Orders cannot be imported in the upsert mode"))
+        upsert_key = check_natural_key(obj, upsert_key)
+
+    report: ImportReport = ImportReport()
+    start: float = default_timer()
+    numbered_rows: Iterator[tuple[int, dict[str, Any]]] = enumerate(rows, start=1)
+
+    for chunk in iter_chunks(numbered_rows, chunk_size or settings.IMPORT_CHUNK_SIZE):
+        if obj is Order:
+            _save_orders_chunk(chunk, report, exclude_key or "products")
+        elif upsert_key:
+            fields: list[str] = update_fields_of(obj, (col for line, row in chunk for col in row), upsert_key)
+            instances: list[Model] = validate_chunk(obj, chunk, report, exclude_key, natural_key=upsert_key)
+            upsert_instances(obj, instances, report, upsert_key, fields)
+        else:
+            save_instances(obj, validate_chunk(obj, chunk, report, exclude_key), report)
+
+        if on_progress is not None:
+            on_progress(report)
+
+    report.elapsed = default_timer() - start
+    logger.info(
+        "Imported %s: %d rows, %d created, %d updated, %d unchanged, %d rejected, %.1f rows/sec",
+        obj._meta.model_name,
+        report.rows,
+        report.created,
+        report.updated,
+        report.unchanged,
+        report.rejected,
+        report.rows_per_sec,
+    )
+    return report
 
 
 def save_csv_file(
-    obj: Product | Order, file, encoding: str, exclude_key=None
-) -> list[Product | Order]:
-    """Function for save .csv file with products or orders data."""
+    obj: type[Product | Order], file, encoding: str, exclude_key=None, **options: Any
+) -> ImportReport:
+    """Function for save .csv file with products or orders data, `options` are passed to import_rows."""
     csv_file: TextIOWrapper = TextIOWrapper(file, encoding=encoding)
     reader: Iterator[dict[str, str]] = DictReader(csv_file)
-    rows: list[dict[str, str]] = list(reader)
+    return import_rows(obj, reader, exclude_key=exclude_key, **options)
 
-    objects_list: list[Product | Order] = [obj(**filter_dict(row, exclude_key)) for row in rows]
-    obj.objects.bulk_create(objects_list)
 
-    if isinstance(obj, type(Order)):
-        for idx, row in enumerate(rows):
-            product_names: list[str] = [name.strip() for name in row["products"].split(",")]
+class JsonStreamReader:
+    """
+    Incremental tokenizer for the top-level JSON container of an uploaded file.
 
-            with transaction.atomic():
-                product_objs: list[Product] = Product.objects.filter(name__in=product_names).all()
+    The file is read by blocks of settings.IMPORT_JSON_READ_SIZE characters and only
+    the entry being decoded is kept in memory.
+    """
 
-            objects_list[idx].products.add(*product_objs)
+    whitespace: str = " \t\r\n"
 
-    return objects_list
+    def __init__(self, json_file: TextIO) -> None:
+        self.json_file: TextIO = json_file
+        self.decoder: json.JSONDecoder = json.JSONDecoder()
+        self.buffer: str = ""
+        self.pos: int = 0
+        self.eof: bool = False
 
+    def _fill(self) -> bool:
+        """Appends the next block of the file to the unread part of the buffer."""
+        block: str = self.json_file.read(settings.IMPORT_JSON_READ_SIZE)
+
+        if not block:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos :] + block
+        self.pos = 0
+
+        if len(self.buffer) > settings.IMPORT_JSON_MAX_ENTRY_SIZE:
+            raise ValueError(_("JSON entry is larger than %d characters") % settings.IMPORT_JSON_MAX_ENTRY_SIZE)
+        return True
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character, or an empty string at the end of the file."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consumes the next character, which must be one of `chars`."""
+        char: str = self.peek()
+
+        if not char or char not in chars:
+            raise ValueError(_("Expected one of %(chars)r, got %(char)r") % {"chars": chars, "char": char})
+
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """Decodes the next JSON value, reading more blocks while it is incomplete."""
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+
+            # a number at the end of the buffer may continue in the next block
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def __iter__(self) -> Iterator[Any]:
+        """Yields the values of the top-level object, or the items of the top-level array."""
+        closing: str = "}" if self.expect("{[") == "{" else "]"
+
+        if self.peek() == closing:
+            self.expect(closing)
+            return
+
+        while True:
+            if closing == "}":
+                self.value()
+                self.expect(":")
+
+            yield self.value()
+
+            if self.expect("," + closing) == closing:
+                return
+
+
+def iter_json_lines(json_file: TextIO) -> Iterator[Any]:
+    """Yields the values of a NDJSON file, one value per line."""
+    for line in json_file:
+        if line.strip():
+            yield json.loads(line)
 
-def save_json_file(obj: Product | Order, file: bytes, encoding: str, exclude_key=None) -> None:
-    """Function for save .json file with products or orders data."""
-    csv_file: TextIOWrapper = TextIOWrapper(file, encoding=encoding)
-    data: dict[str, dict[str, str]] = json.load(csv_file)
 
-    for val in data.values():
-        filtered_dict: dict[str, User | str] = filter_dict(val, exclude_key)
-        create_obj: Product | Order = obj.objects.create(**filtered_dict)
+def save_json_file(
+    obj: type[Product | Order], file, encoding: str, exclude_key=None, lines: bool = False, **options: Any
+) -> ImportReport:
+    """
+    Function for save .json file with products or orders data.
 
-        if isinstance(obj, type(Order)):
-            with transaction.atomic():
-                product_objs = Product.objects.filter(name__in=val[exclude_key])
-                create_obj.products.set(product_objs)
+    The entries of the top-level object are decoded one by one, with `lines=True`
+    the file is read as NDJSON. `options` are passed to import_rows.
+    """
+    json_file: TextIOWrapper = TextIOWrapper(file, encoding=encoding)
+    entries: Iterator[dict[str, Any]] = iter_json_lines(json_file) if lines else iter(JsonStreamReader(json_file))
+    return import_rows(obj, entries, exclude_key=exclude_key, **options)
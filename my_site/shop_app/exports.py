@@ -0,0 +1,327 @@
+"""
+Streaming exports of the shop application.
+
+Rows are read with QuerySet.iterator(), so no model instances are cached, and the
+encoded output is yielded by chunks of settings.EXPORT_CHUNK_SIZE rows, so the
+response starts right away and the memory usage does not depend on the table size.
+"""
+
+from collections import defaultdict
+from csv import writer
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Any, Callable, Iterable, Iterator
+
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_sequence
+
+from my_site import singleflight
+
+from .common import iter_chunks
+from .models import Order, Product
+
+re_accepts_gzip = _lazy_re_compile(r"\bgzip\b")
+CURSOR_SALT: str = "shop_app.exports.cursor"
+PRODUCT_FIELDS: tuple[str, ...] = ("pk", "name", "price", "archived")
+ORDER_FIELDS: tuple[str, ...] = ("pk", "user", "products", "promocode", "delivery_address")
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer, which returns the written line instead of storing it."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv(header: Iterable[str], rows: Iterable[Iterable[Any]]) -> Iterator[str]:
+    """Yields the header line and then the .csv lines of the rows joined by chunks."""
+    csv_writer = writer(Echo())
+    yield csv_writer.writerow(header)
+
+    for chunk in iter_chunks(rows, settings.EXPORT_CHUNK_SIZE):
+        yield "".join(csv_writer.writerow(row) for row in chunk)
+
+
+def iter_queryset_csv(queryset: QuerySet, fields: list[str]) -> Iterator[str]:
+    """Yields the `fields` of the queryset as .csv lines, the field names are the header."""
+    rows: Iterator[tuple[Any, ...]] = queryset.values_list(*fields).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    return iter_csv(fields, rows)
+
+
+def iter_json_list(key: str, rows: Iterable[Any]) -> Iterator[bytes]:
+    """
+    Yields the JSON object {key: [rows]} encoded by chunks of rows.
+
+    Values are encoded with DjangoJSONEncoder like in JsonResponse, e.g. decimals as strings.
+    """
+    encoder: DjangoJSONEncoder = DjangoJSONEncoder()
+    separator: str = ""
+    yield f"{{{encoder.encode(key)}: [".encode()
+
+    for chunk in iter_chunks(rows, settings.EXPORT_CHUNK_SIZE):
+        yield (separator + ", ".join(encoder.encode(row) for row in chunk)).encode()
+        separator = ", "
+
+    yield b"]}"
+
+
+def iter_ndjson(rows: Iterable[Any]) -> Iterator[bytes]:
+    """Yields the rows as NDJSON, one encoded row per line, by chunks of rows."""
+    encoder: DjangoJSONEncoder = DjangoJSONEncoder()
+
+    for chunk in iter_chunks(rows, settings.EXPORT_CHUNK_SIZE):
+        yield "".join(f"{encoder.encode(row)}\n" for row in chunk).encode()
+
+
+def iter_orders(orders: QuerySet) -> Iterator[dict[str, Any]]:
+    """
+    Yields the orders with the primary keys of their products, ordered by primary key.
+
+    The orders and the rows of Order.products.through are read with two ordered scans,
+    which are merge-joined by the order id, so the export takes two queries and keeps
+    one order in memory whatever the number of orders. The products of an order are
+    listed in the default ordering of products.
+    """
+    chunk_size: int = settings.EXPORT_CHUNK_SIZE
+    links: QuerySet = Order.products.through.objects.order_by(
+        "order_id", *(f"product__{name}" for name in Product._meta.ordering)
+    )
+    if orders.query.has_filters():
+        links = links.filter(order__in=orders.values("pk"))
+
+    order_rows: Iterator[tuple[Any, ...]] = (
+        orders.order_by("pk").values_list("pk", "user_id", "promocode", "delivery_address").iterator(chunk_size)
+    )
+    link_rows: Iterator[tuple[int, int]] = links.values_list("order_id", "product_id").iterator(chunk_size)
+    link: tuple[int, int] | None = next(link_rows, None)
+
+    for pk, user_id, promocode, delivery_address in order_rows:
+        products: list[int] = []
+
+        while link is not None and link[0] <= pk:
+            if link[0] == pk:
+                products.append(link[1])
+            link = next(link_rows, None)
+
+        yield {
+            "pk": pk,
+            "user": user_id,
+            "products": products,
+            "promocode": promocode,
+            "delivery_address": delivery_address,
+        }
+
+
+def iter_products() -> Iterator[dict[str, Any]]:
+    """Yields the exported fields of all products ordered by primary key."""
+    rows: Iterator[tuple[Any, ...]] = (
+        Product.objects.order_by("pk").values_list(*PRODUCT_FIELDS).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    )
+    return (dict(zip(PRODUCT_FIELDS, row)) for row in rows)
+
+
+def products_json() -> Iterator[bytes]:
+    """Yields the export of all products as a JSON object."""
+    return iter_json_list("products", iter_products())
+
+
+def products_csv() -> Iterator[bytes]:
+    """Yields the export of all products as a .csv file."""
+    rows: Iterator[tuple[Any, ...]] = (tuple(product.values()) for product in iter_products())
+    return (line.encode() for line in iter_csv(PRODUCT_FIELDS, rows))
+
+
+def orders_json() -> Iterator[bytes]:
+    """Yields the export of all orders as a JSON object."""
+    return iter_json_list("orders", iter_orders(Order.objects.all()))
+
+
+def orders_ndjson() -> Iterator[bytes]:
+    """Yields the export of all orders as NDJSON, one order per line."""
+    return iter_ndjson(iter_orders(Order.objects.all()))
+
+
+def orders_csv() -> Iterator[bytes]:
+    """Yields the export of all orders as a .csv file, the products column lists comma-separated primary keys."""
+    rows: Iterator[tuple[Any, ...]] = (
+        tuple(",".join(map(str, val)) if key == "products" else val for key, val in order.items())
+        for order in iter_orders(Order.objects.all())
+    )
+    return (line.encode() for line in iter_csv(ORDER_FIELDS, rows))
+
+
+# full exports by file name: content type and the function producing the content
+EXPORTS: dict[str, tuple[str, Callable[[], Iterator[bytes]]]] = {
+    "products.json": ("application/json", products_json),
+    "products.csv": ("text/csv", products_csv),
+    "orders.json": ("application/json", orders_json),
+    "orders.ndjson": ("application/x-ndjson", orders_ndjson),
+    "orders.csv": ("text/csv", orders_csv),
+}
+
+
+def accepts_gzip(request: HttpRequest) -> bool:
+    """Checks the Accept-Encoding header of the request."""
+    return bool(re_accepts_gzip.search(request.headers.get("Accept-Encoding", "")))
+
+
+def encode_cursor(updated_at: datetime, pk: int) -> str:
+    """Returns the signed keyset cursor pointing after the row with this modification time and primary key."""
+    return signing.dumps([updated_at.isoformat(), pk], salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Returns the modification time and the primary key of a keyset cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed or its signature is not valid.
+    """
+    try:
+        updated_at, pk = signing.loads(cursor, salt=CURSOR_SALT)
+        return datetime.fromisoformat(updated_at), int(pk)
+    except (signing.BadSignature, TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def delta_page(
+    queryset: QuerySet, fields: Iterable[str], since: str | None = None, limit: int | None = None
+) -> tuple[list[dict[str, Any]], str | None, bool]:
+    """
+    Returns the rows created or modified after the cursor `since`, ordered by (updated_at, pk).
+
+    The rows of the last settings.EXPORT_DELTA_LAG seconds are left for the next page,
+    so a transaction committed after a later one is not skipped by the cursor.
+
+    Returns:
+        tuple: The rows, the cursor of the next page and whether more rows are available.
+            Without new rows the next cursor is `since`.
+
+    Raises:
+        ValueError: If the cursor is not valid.
+    """
+    limit = limit or settings.EXPORT_DELTA_PAGE_SIZE
+    queryset = queryset.filter(updated_at__lte=timezone.now() - timedelta(seconds=settings.EXPORT_DELTA_LAG))
+
+    if since:
+        updated_at, pk = decode_cursor(since)
+        queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, pk__gt=pk))
+
+    queryset = queryset.order_by("updated_at", "pk").values("pk", *fields, "updated_at")
+    rows: list[dict[str, Any]] = list(queryset[: limit + 1])
+    has_more: bool = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor: str | None = encode_cursor(rows[-1]["updated_at"], rows[-1]["pk"]) if rows else since
+    return rows, next_cursor, has_more
+
+
+def add_order_products(rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Adds the primary keys of the products to a page of order rows with one query."""
+    products: dict[int, list[int]] = defaultdict(list)
+    links: QuerySet = Order.products.through.objects.filter(order_id__in=[row["pk"] for row in rows]).order_by(
+        "order_id", *(f"product__{name}" for name in Product._meta.ordering)
+    )
+
+    for order_id, product_id in links.values_list("order_id", "product_id"):
+        products[order_id].append(product_id)
+
+    for row in rows:
+        row["products"] = products[row["pk"]]
+    return rows
+
+
+def cache_stream(chunks: Iterable[bytes], cache_key: str, timeout: int) -> Iterator[bytes]:
+    """
+    Yields the chunks and caches their concatenation when the stream is complete.
+
+    The stream is produced by the request holding the lock of the key, which is
+    released when the response is closed, see LockedStreamingHttpResponse. Nothing is
+    cached if the stream is larger than settings.EXPORT_CACHE_MAX_SIZE or the client
+    disconnects before the end.
+    """
+    parts: list[bytes] | None = []
+    size: int = 0
+    start: float = monotonic()
+
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size <= settings.EXPORT_CACHE_MAX_SIZE:
+                parts.append(chunk)
+            else:
+                parts = None
+        yield chunk
+
+    if parts is not None:
+        singleflight.store(cache_key, b"".join(parts), timeout, monotonic() - start)
+
+
+class LockedStreamingHttpResponse(StreamingHttpResponse):
+    """
+    Streamed export releasing the singleflight lock of its cache key when it is closed.
+
+    The server closes every response, also the ones whose stream is never iterated,
+    e.g. HEAD requests or clients disconnecting before the body, whose generator
+    would never run a finally clause.
+    """
+
+    def __init__(self, *args: Any, cache_key: str, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.cache_key: str = cache_key
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            singleflight.release(self.cache_key)
+
+
+def cached_export_response(
+    request: HttpRequest,
+    chunks: Callable[[], Iterable[bytes]],
+    content_type: str,
+    cache_key: str,
+    timeout: int,
+) -> HttpResponse | StreamingHttpResponse:
+    """
+    Returns the export produced by `chunks` as a streamed response, or its cached bytes.
+
+    Clients accepting gzip get the compressed stream, the plain and the compressed
+    bytes are cached under separate keys, so a cache hit is sent without encoding.
+    A missing or expiring export is produced by one request at a time, see
+    my_site.singleflight: the others get the stale bytes or wait for the new ones,
+    and stream the export without caching it if the wait times out.
+    """
+    gzipped: bool = accepts_gzip(request)
+    if gzipped:
+        cache_key = f"{cache_key}.gz"
+
+    content, refresh = singleflight.read(cache_key)
+    locked: bool = refresh and singleflight.acquire(cache_key)
+    if refresh and not locked and content is singleflight.MISSING:
+        content = singleflight.wait(cache_key)
+
+    response: HttpResponse | StreamingHttpResponse
+
+    if content is not singleflight.MISSING and not locked:
+        response = HttpResponse(content, content_type=content_type)
+    else:
+        stream: Iterable[bytes] = compress_sequence(chunks()) if gzipped else chunks()
+        if locked:
+            response = LockedStreamingHttpResponse(
+                cache_stream(stream, cache_key, timeout), content_type=content_type, cache_key=cache_key
+            )
+        else:
+            response = StreamingHttpResponse(stream, content_type=content_type)
+
+    if gzipped:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -42,7 +42,7 @@ class MultipleFileField(forms.FileField):
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
-        fields = ["name", "price", "description", "discount", "preview"]
+        fields = ["name", "sku", "price", "description", "discount", "preview"]
         widgets = {
             "description": forms.Textarea(attrs={"cols": 30, "rows": 5}),
         }
@@ -95,3 +95,16 @@ class GroupForm(forms.ModelForm):
 
 class FileImportForm(forms.Form):
     uploaded_file = forms.FileField(label=_("file"))
+    workers = forms.IntegerField(
+        label=_("parallel workers"),
+        min_value=1,
+        max_value=64,
+        initial=1,
+        required=False,
+        help_text=_("Number of processes parsing a .csv file of products"),
+    )
+    upsert = forms.BooleanField(
+        label=_("update existing products"),
+        required=False,
+        help_text=_("Rows with the SKU of an existing product update it instead of creating a duplicate"),
+    )
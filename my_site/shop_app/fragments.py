@@ -0,0 +1,61 @@
+"""
+Versioned caching of the rendered rows of list pages.
+
+The HTML of a row is cached under a key made of the row template, the primary key
+of the object, the active language and a version stamp of the object, e.g. its
+updated_at. The rows of a page are read with one cache query, only the rows of
+the new or changed objects are rendered, and their relations are prefetched for
+these objects only, so the rendering time follows the number of changed rows.
+Fragments of old versions are never read again and expire after
+settings.FRAGMENT_CACHE_TIMEOUT seconds.
+"""
+
+import hashlib
+from typing import Any, Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Model, prefetch_related_objects
+from django.template.loader import get_template
+from django.utils.safestring import SafeString, mark_safe
+from django.utils.translation import get_language
+
+
+def fragment_key(template_name: str, obj: Model, version: Any) -> str:
+    """Returns the cache key of the row of an object rendered with the template."""
+    digest: str = hashlib.md5(repr(version).encode()).hexdigest()
+    return f"fragment.{template_name}.{obj.pk}.{get_language()}.{digest}"
+
+
+def render_rows(
+    template_name: str,
+    objects: Iterable[Model],
+    version: Callable[[Model], Any],
+    name: str = "object",
+    prefetch: Iterable[Any] = (),
+) -> list[tuple[Model, SafeString]]:
+    """
+    Returns the objects with the HTML of their rows, rendered or read from the cache.
+
+    Args:
+        template_name (str): Template of a row, rendered with the object as `name`.
+        version (Callable): Returns the version stamp of an object, it must change
+            whenever the rendered row would change.
+        prefetch (Iterable): Lookups prefetched for the objects whose rows are rendered.
+    """
+    keys: dict[str, Model] = {fragment_key(template_name, obj, version(obj)): obj for obj in objects}
+    cached: dict[str, str] = cache.get_many(keys)
+    missing: list[Model] = [obj for key, obj in keys.items() if key not in cached]
+
+    if missing:
+        if prefetch:
+            prefetch_related_objects(missing, *prefetch)
+
+        template = get_template(template_name)
+        rendered: dict[str, str] = {
+            key: template.render({name: obj}) for key, obj in keys.items() if key not in cached
+        }
+        cache.set_many(rendered, settings.FRAGMENT_CACHE_TIMEOUT)
+        cached.update(rendered)
+
+    return [(obj, mark_safe(cached[key])) for key, obj in keys.items()]
@@ -0,0 +1,157 @@
+"""
+Cache dependency registry of the shop application.
+
+Every cached value is registered with the models it is computed from and a function
+returning the cache keys affected by a change of an instance. The handlers of
+shop_app.signals delete the affected keys after the commit of the transaction
+saving or deleting the instance, so the exports are cached for hours and stay
+correct: a change of an order drops only the orders export of its owner.
+
+The affected keys hold versions, the exports are cached under the key with its
+version, see versioned_key(). Deleting the key starts a new, greater version, so an
+export computed from the data read before the change, and stored after the
+deletion, is never read again. The versions are integers, which the TieredCache of
+the server (my_site.cache) reads from its shared level at every get, so all the
+worker processes see a new version right after the commit, not after L1_TIMEOUT.
+
+Cached values depending on a whole table, e.g. the API responses, are keyed by the
+generation of the table in the same way, see generations().
+
+Bulk writes, e.g. QuerySet.update() and bulk_create(), send no signals, the code
+doing them calls invalidate() with the keys of the rows it wrote.
+"""
+
+import time
+from collections import defaultdict
+from typing import Any, Callable, Iterable
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Model, QuerySet
+from django.db.models.signals import pre_delete
+
+from .models import Order, Product
+
+# products exports of shop_app.exports.EXPORTS cached by ProductsDataExportView
+PRODUCTS_EXPORT_NAMES: tuple[str, ...] = ("products.json", "products.csv")
+
+KeysFunction = Callable[..., Iterable[str]]
+# functions returning the cache keys affected by an instance, by model
+registry: defaultdict[type[Model], list[KeysFunction]] = defaultdict(list)
+
+
+def products_export_key(name: str) -> str:
+    """Returns the version key of a products export, its plain and gzipped bytes share the version."""
+    return f"products_data_export.{name}"
+
+
+def products_export_keys() -> list[str]:
+    """Returns the version keys of all the products exports."""
+    return [products_export_key(name) for name in PRODUCTS_EXPORT_NAMES]
+
+
+def user_orders_export_key(user_id: int) -> str:
+    """Returns the version key of the orders export of a user."""
+    return f"user_orders_data_export{user_id}"
+
+
+def generation_key(model: type[Model]) -> str:
+    """Returns the cache key of the generation counter of a model."""
+    return f"generation.{model._meta.label_lower}"
+
+
+def versions(keys: list[str]) -> list[int]:
+    """
+    Returns the current versions held by the keys, read with one cache query.
+
+    A missing version starts at the current time in microseconds, which is
+    greater than any earlier version of the key, so the deletion of a version
+    key by invalidate() works as an increment.
+    """
+    found: dict[str, int] = cache.get_many(keys)
+
+    for key in keys:
+        if key not in found:
+            value: int = time.time_ns() // 1000
+            found[key] = value if cache.add(key, value, None) else cache.get(key, value)
+
+    return [found[key] for key in keys]
+
+
+def versioned_key(key: str) -> str:
+    """Returns the cache key of the current version of a value, read before the value is computed."""
+    return f"{key}.v{versions([key])[0]}"
+
+
+def generations(*models: type[Model]) -> list[int]:
+    """Returns the current generations of the models, read with one cache query."""
+    return versions([generation_key(model) for model in models])
+
+
+def depends_on(*models: type[Model]) -> Callable[[KeysFunction], KeysFunction]:
+    """
+    Registers a function returning the cache keys affected by a change of an instance of the models.
+
+    The function is called with the instance and the keyword arguments of the
+    post_save or pre_delete signal, e.g. `signal` and `created`.
+    """
+
+    def decorator(func: KeysFunction) -> KeysFunction:
+        for model in models:
+            registry[model].append(func)
+        return func
+
+    return decorator
+
+
+def affected_keys(instance: Model, **kwargs: Any) -> set[str]:
+    """Returns the cache keys affected by a change of the instance."""
+    return {key for func in registry[type(instance)] for key in func(instance, **kwargs)}
+
+
+def invalidate(keys: Iterable[str]) -> None:
+    """
+    Deletes the cache keys after the commit of the current transaction, right away outside a transaction.
+
+    The keys are not deleted if the transaction is rolled back, because the data did not change.
+    """
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def order_owners_keys(orders: QuerySet[Order]) -> set[str]:
+    """Returns the orders export keys of the owners of the orders, read with one query."""
+    return {user_orders_export_key(user_id) for user_id in orders.values_list("user_id", flat=True).distinct()}
+
+
+@depends_on(Product)
+def product_keys(product: Product, signal: Any = None, **kwargs: Any) -> set[str]:
+    """
+    The products exports list every product. Deleting a product also removes it from
+    its orders without m2m_changed signals, so the exports of their owners are dropped.
+    """
+    keys: set[str] = {*products_export_keys(), generation_key(Product)}
+    if signal is pre_delete:
+        keys |= order_owners_keys(Order.objects.filter(products=product))
+        keys.add(generation_key(Order))
+    return keys
+
+
+@depends_on(Order)
+def order_keys(order: Order, **kwargs: Any) -> set[str]:
+    """The orders export of the owner, and of the previous owner if the order was given to another user."""
+    user_ids: set[int | None] = {order.user_id, getattr(order, "loaded_user_id", None)}
+    return {generation_key(Order)} | {user_orders_export_key(user_id) for user_id in user_ids if user_id is not None}
+
+
+@depends_on(User)
+def user_keys(user: User, signal: Any = None, **kwargs: Any) -> set[str]:
+    """
+    The orders export of a user is named after the username, the other fields of the user,
+    e.g. last_login saved at every login, are not exported.
+    """
+    if signal is pre_delete or user.username != getattr(user, "loaded_username", None):
+        return {user_orders_export_key(user.pk)}
+    return set()
@@ -0,0 +1,60 @@
+"""
+This module contains a Django management command measuring the throughput of the parallel import.
+
+It generates a .csv file with products and imports it with 1 to N worker processes.
+By default the rows are parsed and validated only, so the benchmark shows the scaling
+of the parallel part and does not fill the database.
+"""
+
+import csv
+import os
+from random import randint
+from tempfile import NamedTemporaryFile
+from typing import Any
+
+from django.core.management import BaseCommand
+from django.core.management.base import CommandParser
+
+from ...common import ImportReport
+from ...models import Product
+from ...parallel_import import import_csv_parallel
+
+
+class Command(BaseCommand):
+    """Django management command to benchmark the parallel import of products."""
+
+    help: str = "Benchmark the parallel import of products"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add command line arguments for the command."""
+        parser.add_argument("--rows", type=int, default=2_000_000, help="Number of generated rows")
+        parser.add_argument(
+            "--workers",
+            default=",".join(str(2**power) for power in range(((os.cpu_count() or 1).bit_length()))),
+            help="Comma-separated numbers of worker processes",
+        )
+        parser.add_argument("--shard-size", type=int, help="Size of a shard in bytes")
+        parser.add_argument("--write", action="store_true", help="Save the rows to the database")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Generate the file and print the throughput for every number of workers."""
+        with NamedTemporaryFile("w", suffix=".csv", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["name", "description", "price", "discount"])
+
+            for idx in range(options["rows"]):
+                writer.writerow([f"Product {idx}", f"Benchmark product {idx}", randint(1, 9999), randint(0, 50)])
+
+            file.flush()
+            self.stdout.write(f"Generated {options['rows']} rows, {os.path.getsize(file.name)} bytes")
+            baseline: float | None = None
+
+            for workers in (int(value) for value in options["workers"].split(",")):
+                report: ImportReport = import_csv_parallel(
+                    Product, file.name, workers=workers, shard_size=options["shard_size"], dry_run=not options["write"]
+                )
+                baseline = baseline or report.rows_per_sec
+                self.stdout.write(
+                    f"workers={workers:<3} {report.elapsed:8.2f} s {report.rows_per_sec:12.0f} rows/sec "
+                    f"x{report.rows_per_sec / baseline:.2f}"
+                )
@@ -0,0 +1,61 @@
+"""
+This module contains a Django management command measuring the cost of the navigation context processors.
+
+It renders the base templates of the applications with a RequestContext, once with
+the memoized navigation links and once rebuilding them for every render, as the
+processors did before, and prints the mean render time of both.
+"""
+
+from time import perf_counter
+from typing import Any, Callable
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import BaseCommand
+from django.core.management.base import CommandParser
+from django.template.loader import get_template
+from django.test import RequestFactory
+from django.utils import translation
+
+from my_site.navigation import build_links
+
+TEMPLATES: tuple[str, ...] = ("shop_app/base.html", "myauth/base.html")
+
+
+class Command(BaseCommand):
+    """Django management command to benchmark the navigation context processors."""
+
+    help: str = "Benchmark the render time of the navigation links"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add command line arguments for the command."""
+        parser.add_argument("--renders", type=int, default=5000, help="Number of renders per template")
+        parser.add_argument("--language", default="en", help="Language of the rendered pages")
+
+    def measure(self, renders: int, before_render: Callable[[], None]) -> dict[str, float]:
+        """Returns the mean render time of every template in microseconds."""
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        results: dict[str, float] = {}
+
+        for template_name in TEMPLATES:
+            template = get_template(template_name)
+            template.render({}, request)
+            start: float = perf_counter()
+            for _ in range(renders):
+                before_render()
+                template.render({}, request)
+            results[template_name] = (perf_counter() - start) / renders * 1_000_000
+        return results
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Print the mean render time with rebuilt and with memoized navigation links."""
+        with translation.override(options["language"]):
+            rebuilt: dict[str, float] = self.measure(options["renders"], build_links.cache_clear)
+            memoized: dict[str, float] = self.measure(options["renders"], lambda: None)
+
+        for template_name in TEMPLATES:
+            self.stdout.write(
+                f"{template_name:<22} rebuilt {rebuilt[template_name]:8.1f} us "
+                f"memoized {memoized[template_name]:8.1f} us x{rebuilt[template_name] / memoized[template_name]:.2f}"
+            )
+        self.stdout.write(self.style.SUCCESS("Done"))
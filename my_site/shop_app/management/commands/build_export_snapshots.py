@@ -0,0 +1,35 @@
+"""
+This module contains a Django management command that writes the export snapshot files.
+
+Run it on a schedule, e.g. from cron, to refresh the snapshots served by nginx
+independently of the rebuilds triggered by changes.
+"""
+
+from typing import Any
+
+from django.core.management import BaseCommand, CommandError
+from django.core.management.base import CommandParser
+
+from ...exports import EXPORTS
+from ...snapshots import build_snapshots
+
+
+class Command(BaseCommand):
+    """Django management command to write the export snapshot files."""
+
+    help: str = "Write the export snapshot files"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add command line arguments for the command."""
+        parser.add_argument("names", nargs="*", help=f"Exports to write, all by default: {', '.join(EXPORTS)}")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Write the snapshots and print their sizes."""
+        unknown: list[str] = [name for name in options["names"] if name not in EXPORTS]
+        if unknown:
+            raise CommandError(f"Unknown exports: {', '.join(unknown)}")
+
+        for name, size in build_snapshots(options["names"]).items():
+            self.stdout.write(f"{name}: {size} bytes")
+
+        self.stdout.write(self.style.SUCCESS("Done"))
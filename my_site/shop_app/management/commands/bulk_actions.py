@@ -7,6 +7,7 @@ It demonstrates how to efficiently update multiple records in a database with a
 from typing import Any
 
 from django.core.management import BaseCommand
+from django.utils import timezone
 
 from ...models import Product
 
@@ -38,7 +39,9 @@ class Command(BaseCommand):
         # for product in products_created:
         #     print(product)
 
-        count_obj: int = Product.objects.filter(name__contains="Smartphone").update(discount=10)
+        count_obj: int = Product.objects.filter(name__contains="Smartphone").update(
+            discount=10, updated_at=timezone.now()
+        )
         print(count_obj)
 
         self.stdout.write("Done")
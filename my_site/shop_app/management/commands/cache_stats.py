@@ -0,0 +1,36 @@
+"""
+This module contains a Django management command that prints the statistics of the cache.
+
+The hits, misses and evictions are summed over the worker processes by key prefix,
+see my_site.cache.TieredCache.
+"""
+
+from typing import Any
+
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """Django management command to print the cache hit ratio by key prefix."""
+
+    help: str = "Print the hits, misses and evictions of the cache by key prefix"
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Print a line per key prefix, the most requested first."""
+        if not hasattr(cache, "stats"):
+            raise CommandError(f"The cache backend {type(cache).__name__} does not collect statistics")
+
+        counters: tuple[str, ...] = ("l1_hits", "l2_hits", "misses", "evictions")
+        stats: dict[str, dict[str, int]] = cache.stats()
+        self.stdout.write(f"{'prefix':<40}" + "".join(f"{name:>12}" for name in counters) + f"{'hit ratio':>12}")
+
+        for prefix, values in sorted(stats.items(), key=lambda item: -sum(item[1].values())):
+            hits: int = values.get("l1_hits", 0) + values.get("l2_hits", 0)
+            requests: int = hits + values.get("misses", 0)
+            ratio: str = f"{hits / requests:.1%}" if requests else "-"
+            self.stdout.write(
+                f"{prefix:<40}" + "".join(f"{values.get(name, 0):>12}" for name in counters) + f"{ratio:>12}"
+            )
+
+        self.stdout.write(self.style.SUCCESS("Done"))
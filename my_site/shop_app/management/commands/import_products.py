@@ -0,0 +1,60 @@
+"""
+This module contains a Django management command for importing products from a .csv file.
+
+With more than one worker the file is parsed and validated in parallel shards,
+with --upsert the rows update the products with the same natural key.
+"""
+
+import json
+from typing import Any
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.core.management.base import CommandParser
+
+from ...common import ImportReport, save_csv_file
+from ...invalidation import generation_key, invalidate, products_export_keys
+from ...models import Product
+from ...parallel_import import import_csv_parallel
+
+
+class Command(BaseCommand):
+    """Django management command to import products from a .csv file."""
+
+    help: str = "Import products from a .csv file"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        """Add command line arguments for the command."""
+        parser.add_argument("path", help="Path of the .csv file")
+        parser.add_argument("--encoding", default="utf-8", help="Encoding of the file")
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Number of processes parsing the file in parallel"
+        )
+        parser.add_argument("--shard-size", type=int, help="Size of a parallel shard in bytes")
+        parser.add_argument(
+            "--upsert",
+            nargs="?",
+            const=settings.PRODUCT_IMPORT_NATURAL_KEY,
+            metavar="FIELD",
+            help="Update the products with the same value of this unique field, the SKU by default",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        """Import the file and print the import report."""
+        if options["workers"] > 1:
+            report: ImportReport = import_csv_parallel(
+                Product,
+                options["path"],
+                encoding=options["encoding"],
+                workers=options["workers"],
+                shard_size=options["shard_size"],
+                upsert_key=options["upsert"],
+            )
+        else:
+            with open(options["path"], "rb") as file:
+                report = save_csv_file(
+                    obj=Product, file=file, encoding=options["encoding"], upsert_key=options["upsert"]
+                )
+
+        invalidate([*products_export_keys(), generation_key(Product)])
+        self.stdout.write(json.dumps(report.as_dict(), ensure_ascii=False, indent=2))
@@ -37,12 +37,21 @@ class Product(models.Model):
     name = models.CharField(
         max_length=100, verbose_name=pgettext_lazy("product name", "name"), db_index=True
     )
+    sku = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        verbose_name=_("SKU"),
+        help_text=_("Stock keeping unit, the natural key of the product imports"),
+    )
     description = models.TextField(
         null=False, blank=True, verbose_name=_("description"), db_index=True
     )
     price = models.DecimalField(default=0, max_digits=10, decimal_places=2, verbose_name=_("price"))
     discount = models.PositiveSmallIntegerField(default=0, verbose_name=_("discount"))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("created at"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("updated at"))
     archived = models.BooleanField(default=False, verbose_name=_("archived"))
     created_by = models.ForeignKey(
         User,
@@ -61,11 +70,13 @@ class Product(models.Model):
 
         Attributes:
             ordering (list): Default ordering for the Product model.
+            indexes (list): Keyset index of the incremental exports.
             verbose_name (str): Singular name for the Product model.
             verbose_name_plural (str): Plural name for the Product model.
         """
 
         ordering = ["name", "price"]
+        indexes = [models.Index(fields=["updated_at", "id"], name="shop_product_updated_idx")]
         verbose_name = _("product")  # перевод будет отражен в админ-панели
         verbose_name_plural = _("products")
 
@@ -159,6 +170,7 @@ class Order(models.Model):
         promocode (str): An optional promocode applied to the order.
         delivery_address (str): The address where the order will be delivered.
         created_at (datetime): The timestamp when the order was created.
+        updated_at (datetime): The timestamp of the last change of the order or its products.
         receipt (FileField): An optional receipt file associated with the order.
     """
 
@@ -172,6 +184,7 @@ class Order(models.Model):
     promocode = models.CharField(max_length=20, null=False, blank=True, verbose_name=_("promocode"))
     delivery_address = models.TextField(verbose_name=_("delivery address"))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("created at"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("updated at"))
     receipt = models.FileField(
         verbose_name=_("Receipt"),
         blank=True,
@@ -184,10 +197,12 @@ class Order(models.Model):
         Meta options for the Order model.
 
         Attributes:
+            indexes (list): Keyset index of the incremental exports.
             verbose_name (str): Singular name for the Order model.
             verbose_name_plural (str): Plural name for the Order model.
         """
 
+        indexes = [models.Index(fields=["updated_at", "id"], name="shop_order_updated_idx")]
         verbose_name = _("order")
         verbose_name_plural = _("orders")
 
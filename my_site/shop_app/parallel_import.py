@@ -0,0 +1,164 @@
+"""
+Parallel import of large .csv files.
+
+The file is split on row boundaries into byte-range shards, every shard is parsed
+and validated in a process of a ProcessPoolExecutor and the validated batches are
+funnelled back to the calling process, which is the only one writing to the
+database, so SQLite does not run into lock contention.
+
+Shards are split on line breaks, so the parallel mode requires files whose quoted
+values do not contain line breaks.
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from csv import DictReader, reader
+from io import StringIO
+from timeit import default_timer
+from typing import Any, Callable
+
+from django.conf import settings
+from django.db.models import Model
+from jobsapp.worker import init_worker
+
+from .common import ImportReport, check_natural_key, save_instances, update_fields_of, upsert_instances, validate_chunk
+
+logger = logging.getLogger(__name__)
+
+
+def find_shards(path: str, shard_size: int) -> tuple[int, list[tuple[int, int]]]:
+    """
+    Splits the file after the header row into byte ranges ending on line breaks.
+
+    Returns:
+        tuple: The size of the header row in bytes and the list of (start, end) byte offsets.
+    """
+    shards: list[tuple[int, int]] = []
+
+    with open(path, "rb") as file:
+        file_size: int = os.fstat(file.fileno()).st_size
+        file.readline()
+        header_size: int = file.tell()
+        start: int = header_size
+
+        while start < file_size:
+            file.seek(min(start + shard_size, file_size))
+            file.readline()
+            end: int = file.tell()
+            shards.append((start, end))
+            start = end
+
+    return header_size, shards
+
+
+def read_header(path: str, encoding: str, header_size: int) -> list[str]:
+    """Returns the column names from the header row of the file."""
+    with open(path, "rb") as file:
+        return next(reader([file.read(header_size).decode(encoding)]))
+
+
+def parse_shard(
+    obj: type[Model],
+    path: str,
+    encoding: str,
+    fieldnames: list[str],
+    start: int,
+    end: int,
+    natural_key: str | None = None,
+) -> tuple[list[Model], ImportReport]:
+    """
+    Parses and validates the rows of one shard in a worker process.
+
+    Rejected rows are numbered inside the shard, the errors contain the byte offset of the shard.
+    """
+    report: ImportReport = ImportReport()
+
+    with open(path, "rb") as file:
+        file.seek(start)
+        text: str = file.read(end - start).decode(encoding)
+
+    rows: DictReader = DictReader(StringIO(text, newline=""), fieldnames=fieldnames)
+    return validate_chunk(obj, enumerate(rows, start=1), report, natural_key=natural_key, offset=start), report
+
+
+def import_csv_parallel(
+    obj: type[Model],
+    path: str,
+    encoding: str | None = None,
+    workers: int | None = None,
+    shard_size: int | None = None,
+    dry_run: bool = False,
+    on_progress: Callable[[ImportReport], None] | None = None,
+    upsert_key: str | None = None,
+) -> ImportReport:
+    """
+    Imports a .csv file with the rows parsed and validated in parallel.
+
+    Args:
+        obj (Model): The model of the imported rows.
+        path (str): The path of the file in the local file system.
+        encoding (str): The file encoding.
+        workers (int): Number of worker processes, all CPU cores by default.
+        shard_size (int): Size of a shard in bytes, settings.IMPORT_SHARD_SIZE by default.
+        dry_run (bool): Validate the rows without writing them to the database.
+        on_progress (Callable): Called with the report after every written shard.
+        upsert_key (str): Unique field matching the rows with the existing ones, see import_rows.
+
+    Returns:
+        ImportReport: The result of the import.
+    """
+    encoding = encoding or "utf-8"
+    workers = max(workers or os.cpu_count() or 1, 1)
+    report: ImportReport = ImportReport()
+    start: float = default_timer()
+
+    header_size, shards = find_shards(path, shard_size or settings.IMPORT_SHARD_SIZE)
+    fieldnames: list[str] = read_header(path, encoding, header_size)
+    if upsert_key:
+        upsert_key = check_natural_key(obj, upsert_key)
+        fields: list[str] = update_fields_of(obj, fieldnames, upsert_key)
+    pending = iter(shards)
+    running: set[Future] = set()
+
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker
+    ) as pool:
+        while True:
+            # a bounded number of shards in flight keeps the memory of the writer flat
+            while len(running) < workers * 2 and (shard := next(pending, None)) is not None:
+                running.add(pool.submit(parse_shard, obj, path, encoding, fieldnames, *shard, upsert_key))
+
+            if not running:
+                break
+
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                instances, shard_report = future.result()
+                report.merge(shard_report)
+
+                if dry_run:
+                    report.created += len(instances)
+                elif upsert_key:
+                    upsert_instances(obj, instances, report, upsert_key, fields)
+                else:
+                    save_instances(obj, instances, report)
+
+                if on_progress is not None:
+                    on_progress(report)
+
+    report.elapsed = default_timer() - start
+    logger.info(
+        "Imported %s with %d workers: %d rows, %d created, %d updated, %d unchanged, %d rejected, %.1f rows/sec",
+        obj._meta.model_name,
+        workers,
+        report.rows,
+        report.created,
+        report.updated,
+        report.unchanged,
+        report.rejected,
+        report.rows_per_sec,
+    )
+    return report
@@ -0,0 +1,87 @@
+"""
+Signal handlers of the shop application.
+
+The products of an order are stored in Order.products.through, so changing them does
+not save the order. The handlers bump Order.updated_at, so the incremental exports
+see the change, and Product.updated_at when the images of a product change, so the
+validators of the conditional GET of the product pages see it.
+
+Changes of products and orders schedule a rebuild of the export snapshots and
+delete the cached values depending on them, see shop_app.invalidation.
+"""
+
+from typing import Any
+
+from django.contrib.auth.models import User
+from django.db.models import Model
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .invalidation import affected_keys, generation_key, invalidate, order_owners_keys, user_orders_export_key
+from .models import Order, Product, ProductImage
+from .tasks import rebuild_snapshots_on_commit
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def touch_orders_on_products_changed(
+    sender: type, instance: Any, action: str, reverse: bool, pk_set: set[int] | None, **kwargs: Any
+) -> None:
+    """Sets updated_at of the orders whose products were added, removed or cleared."""
+    if reverse and action == "pre_clear":
+        # the orders of a product are unknown after clear(), they are touched before it
+        Order.objects.filter(products=instance).update(updated_at=timezone.now())
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if not reverse:
+            Order.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+        elif pk_set:
+            Order.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product_on_images_changed(sender: type, instance: ProductImage, **kwargs: Any) -> None:
+    """Sets updated_at of the product whose image was saved or deleted."""
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Order)
+@receiver(m2m_changed, sender=Order.products.through)
+def rebuild_snapshots_on_change(sender: type, action: str = "", **kwargs: Any) -> None:
+    """Schedules a rebuild of the export snapshots, pre_* actions of m2m_changed are ignored."""
+    if not action.startswith("pre_"):
+        rebuild_snapshots_on_commit()
+
+
+@receiver(post_init, sender=Order)
+def remember_order_owner(sender: type, instance: Order, **kwargs: Any) -> None:
+    """Keeps the owner of a loaded order, so the export of the previous owner is dropped when it changes."""
+    instance.loaded_user_id = instance.__dict__.get("user_id")
+
+
+@receiver(post_init, sender=User)
+def remember_username(sender: type, instance: User, **kwargs: Any) -> None:
+    """Keeps the username of a loaded user, so only a change of the username drops the orders export."""
+    instance.loaded_username = instance.__dict__.get("username")
+
+
+@receiver([post_save, pre_delete], sender=Product)
+@receiver([post_save, pre_delete], sender=Order)
+@receiver([post_save, pre_delete], sender=User)
+def invalidate_cache_on_change(sender: type, instance: Model, **kwargs: Any) -> None:
+    """Deletes the cached values depending on the saved or deleted instance."""
+    invalidate(affected_keys(instance, **kwargs))
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def invalidate_cache_on_products_changed(
+    sender: type, instance: Any, action: str, reverse: bool, pk_set: set[int] | None, **kwargs: Any
+) -> None:
+    """Deletes the orders exports of the owners of the orders whose products were changed."""
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            invalidate([user_orders_export_key(instance.user_id), generation_key(Order)])
+    elif action == "pre_clear":
+        invalidate([*order_owners_keys(Order.objects.filter(products=instance)), generation_key(Order)])
+    elif action in ("post_add", "post_remove") and pk_set:
+        invalidate([*order_owners_keys(Order.objects.filter(pk__in=pk_set)), generation_key(Order)])
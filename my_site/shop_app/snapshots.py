@@ -0,0 +1,103 @@
+"""
+Pre-materialized export snapshots.
+
+The full exports of shop_app.exports.EXPORTS are written with a gzip copy to files
+under MEDIA_ROOT/settings.EXPORT_SNAPSHOT_DIR, by a background job when products
+or orders change and by the `build_export_snapshots` command on a schedule.
+
+With settings.EXPORT_ACCEL_REDIRECT the export views reply with an X-Accel-Redirect
+header to the internal location settings.EXPORT_ACCEL_LOCATION of nginx, which sends
+the file with sendfile and answers Range requests, so serving an export costs the
+Django workers a single stat().
+"""
+
+import gzip
+import logging
+import os
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Iterable
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .exports import EXPORTS, accepts_gzip
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_path(name: str) -> Path:
+    """Returns the path of the snapshot file of an export."""
+    return Path(settings.MEDIA_ROOT) / settings.EXPORT_SNAPSHOT_DIR / name
+
+
+def write_snapshot(name: str, chunks: Iterable[bytes]) -> int:
+    """
+    Writes the snapshot and its gzip copy, replacing the previous files atomically.
+
+    The files are written to temporary files in the same directory and renamed, so
+    nginx never sends a partly written file.
+
+    Returns:
+        int: The size of the snapshot in bytes.
+    """
+    path: Path = snapshot_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    plain = NamedTemporaryFile(dir=path.parent, prefix=f".{name}.", delete=False)
+    packed = NamedTemporaryFile(dir=path.parent, prefix=f".{name}.gz.", delete=False)
+
+    try:
+        with plain, packed, gzip.GzipFile(fileobj=packed, mode="wb", mtime=0) as compressed:
+            for chunk in chunks:
+                plain.write(chunk)
+                compressed.write(chunk)
+
+        for temporary, target in ((plain.name, path), (packed.name, f"{path}.gz")):
+            # temporary files are private, the files are read by nginx
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, target)
+    except BaseException:
+        for temporary in (plain.name, packed.name):
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+        raise
+
+    return path.stat().st_size
+
+
+def build_snapshots(names: Iterable[str] | None = None) -> dict[str, int]:
+    """
+    Writes the snapshots of the exports, all of them by default.
+
+    Returns:
+        dict: The size of every written snapshot by name.
+    """
+    sizes: dict[str, int] = {}
+
+    for name in names or EXPORTS:
+        content_type, chunks = EXPORTS[name]
+        sizes[name] = write_snapshot(name, chunks())
+        logger.info("Export snapshot %s written: %d bytes", name, sizes[name])
+
+    return sizes
+
+
+def snapshot_response(request: HttpRequest, name: str) -> HttpResponse | None:
+    """
+    Returns a response handing the snapshot over to nginx with X-Accel-Redirect.
+
+    Clients accepting gzip get the compressed copy, nginx adds its Content-Encoding.
+
+    Returns:
+        HttpResponse | None: None if X-Accel-Redirect is disabled or the snapshot is not built yet.
+    """
+    if not settings.EXPORT_ACCEL_REDIRECT or not snapshot_path(name).exists():
+        return None
+
+    content_type, chunks = EXPORTS[name]
+    suffix: str = ".gz" if accepts_gzip(request) else ""
+    response: HttpResponse = HttpResponse(content_type=content_type)
+    response["X-Accel-Redirect"] = f"{settings.EXPORT_ACCEL_LOCATION}{name}{suffix}"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -0,0 +1,114 @@
+"""
+Background tasks of the shop application.
+
+The tasks are executed by the `runworker` command of the jobsapp application,
+uploaded files are passed as names of files in the upload storage of jobsapp.queue.
+"""
+
+from typing import Any
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from jobsapp.models import Job
+from jobsapp.queue import enqueue_once, task, upload_storage
+
+from .common import ImportReport, iter_chunks, save_csv_file, save_json_file
+from .invalidation import generation_key, invalidate, products_export_keys
+from .models import Order, Product
+from .parallel_import import import_csv_parallel
+from .snapshots import build_snapshots
+
+
+def _progress(job: Job):
+    """Returns a callback saving the number of processed rows as the job progress."""
+    return lambda report: job.set_progress(report.rows)
+
+
+def rebuild_snapshots_on_commit() -> None:
+    """Schedules a rebuild of the export snapshots after the commit, if the snapshots are served."""
+    if settings.EXPORT_ACCEL_REDIRECT:
+        transaction.on_commit(lambda: enqueue_once(build_export_snapshots))
+
+
+@task
+def build_export_snapshots(job: Job, names: list[str] | None = None) -> dict[str, int]:
+    """Writes the export snapshot files, all of them by default, and returns their sizes."""
+    return build_snapshots(names)
+
+
+@task
+def import_products_file(
+    job: Job, path: str, encoding: str | None = None, workers: int = 1, upsert: bool = False
+) -> dict[str, Any]:
+    """
+    Imports products from a .csv file and deletes the file, with `workers` > 1 the file is parsed in parallel.
+
+    With `upsert` the rows update the products with the same settings.PRODUCT_IMPORT_NATURAL_KEY.
+    """
+    upsert_key: str | None = settings.PRODUCT_IMPORT_NATURAL_KEY if upsert else None
+    storage = upload_storage()
+
+    try:
+        if workers > 1:
+            report: ImportReport = import_csv_parallel(
+                Product,
+                storage.path(path),
+                encoding=encoding,
+                workers=workers,
+                on_progress=_progress(job),
+                upsert_key=upsert_key,
+            )
+        else:
+            with storage.open(path, "rb") as file:
+                report = save_csv_file(
+                    obj=Product, file=file, encoding=encoding, on_progress=_progress(job), upsert_key=upsert_key
+                )
+    finally:
+        storage.delete(path)
+
+    invalidate([*products_export_keys(), generation_key(Product)])
+    rebuild_snapshots_on_commit()
+    return report.as_dict()
+
+
+@task
+def import_orders_file(job: Job, path: str, encoding: str | None = None) -> dict[str, Any]:
+    """Imports orders from a .csv, .json or NDJSON (.ndjson, .jsonl) file and deletes the file."""
+    storage = upload_storage()
+
+    try:
+        with storage.open(path, "rb") as file:
+            if path.endswith(".csv"):
+                report: ImportReport = save_csv_file(
+                    obj=Order, file=file, encoding=encoding, exclude_key="products", on_progress=_progress(job)
+                )
+            else:
+                report = save_json_file(
+                    obj=Order,
+                    file=file,
+                    encoding=encoding,
+                    exclude_key="products",
+                    lines=not path.endswith(".json"),
+                    on_progress=_progress(job),
+                )
+    finally:
+        storage.delete(path)
+
+    rebuild_snapshots_on_commit()
+    return report.as_dict()
+
+
+@task
+def set_products_archived(job: Job, pks: list[int], archived: bool) -> dict[str, int]:
+    """Sets the archived flag of the products by chunks of primary keys."""
+    updated: int = 0
+    job.set_progress(0, total=len(pks))
+
+    for chunk in iter_chunks(pks, settings.IMPORT_LOOKUP_BATCH_SIZE):
+        updated += Product.objects.filter(pk__in=chunk).update(archived=archived, updated_at=timezone.now())
+        job.set_progress(job.progress + len(chunk))
+
+    invalidate([*products_export_keys(), generation_key(Product)])
+    rebuild_snapshots_on_commit()
+    return {"updated": updated}
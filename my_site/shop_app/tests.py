@@ -1,12 +1,35 @@
+import csv
+import gzip
+import json
+import os
+from io import BytesIO
+from pathlib import Path
 from random import choice, choices, randint
 from string import ascii_letters
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth.models import Permission, User
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-
-from .models import Order, Product
+from django.utils import timezone, translation
+from jobsapp.models import Job
+from jobsapp.queue import claim_next, run_job
+
+from my_site import singleflight
+
+from .admin import ProductAdmin
+from .common import save_csv_file, save_json_file
+from .exports import ORDER_FIELDS, cached_export_response, encode_cursor
+from .invalidation import products_export_keys, user_orders_export_key, versioned_key
+from .models import Order, Product, ProductImage
+from .parallel_import import find_shards, import_csv_parallel
+from .snapshots import build_snapshots, snapshot_path
 from .utils import add_two_numbers
 
 
@@ -120,7 +143,7 @@ class ProductsExportViewTestCase(TestCase):
 
     def test_get_products_view(self):
         response = self.client.get(reverse("shop_app:product_export"))
-        products_data = response.json()
+        products_data = json.loads(b"".join(response.streaming_content))
         products = Product.objects.order_by("pk").all()
         expected_data = [
             {
@@ -135,6 +158,362 @@ class ProductsExportViewTestCase(TestCase):
         self.assertEqual(products_data["products"], expected_data)
 
 
+class ProductsExportCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Cached export lamp", price="10.50")
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_export_is_gzipped_and_cached_as_bytes(self):
+        with translation.override("en"):
+            url = reverse("shop_app:product_export")
+
+        response = self.client.get(url, headers={"accept-encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        products = json.loads(gzip.decompress(b"".join(response.streaming_content)))["products"]
+        self.assertIn(
+            {"pk": self.product.pk, "name": "Cached export lamp", "price": "10.50", "archived": False}, products
+        )
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={"accept-encoding": "gzip"})
+        self.assertFalse(response.streaming)
+        self.assertEqual(json.loads(gzip.decompress(response.content))["products"], products)
+
+        response = self.client.get(url)
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(json.loads(b"".join(response.streaming_content))["products"], products)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_lock_is_released_when_unread_response_is_closed(self):
+        response = cached_export_response(
+            RequestFactory().get("/"), lambda: iter([b"[]"]), "application/json", "unread_export", 60
+        )
+        self.assertTrue(cache.has_key(singleflight.lock_key("unread_export")))
+
+        response.close()
+        self.assertFalse(cache.has_key(singleflight.lock_key("unread_export")))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CacheInvalidationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username="invalidation-alice", password="qwerty123")
+        cls.bob = User.objects.create_user(username="invalidation-bob", password="qwerty123")
+        cls.product = Product.objects.create(name="Invalidation lamp", price="10.50")
+        cls.order = Order.objects.create(user=cls.alice, delivery_address="Street 1")
+        cls.order.products.add(cls.product)
+
+    def setUp(self):
+        cache.clear()
+        self.alice_key = user_orders_export_key(self.alice.pk)
+        self.bob_key = user_orders_export_key(self.bob.pk)
+        self.keys = products_export_keys() + [self.alice_key, self.bob_key]
+        cache.set_many(dict.fromkeys(self.keys, b"cached"))
+
+    def cached_keys(self):
+        return set(cache.get_many(self.keys))
+
+    def test_product_change_drops_products_exports(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = "11.00"
+            self.product.save()
+
+        self.assertEqual(self.cached_keys(), {self.alice_key, self.bob_key})
+
+    def test_order_products_change_drops_owner_export_only(self):
+        other = Product.objects.create(name="Invalidation desk")
+        cache.set_many(dict.fromkeys(self.keys, b"cached"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.products.add(other)
+
+        self.assertNotIn(self.alice_key, self.cached_keys())
+        self.assertIn(self.bob_key, self.cached_keys())
+        self.assertTrue(set(products_export_keys()) <= self.cached_keys())
+
+    def test_reassigned_order_drops_both_owners(self):
+        order = Order.objects.get(pk=self.order.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.user = self.bob
+            order.save()
+
+        self.assertEqual(self.cached_keys(), set(products_export_keys()))
+
+    def test_product_delete_drops_exports_of_its_orders(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+
+        self.assertEqual(self.cached_keys(), {self.bob_key})
+
+    def test_rolled_back_change_keeps_cache(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.order.products.clear()
+                    raise DatabaseError
+            except DatabaseError:
+                pass
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.cached_keys(), set(self.keys))
+
+    def test_login_keeps_user_export(self):
+        user = User.objects.get(pk=self.alice.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(user)
+
+        self.assertEqual(self.cached_keys(), set(self.keys))
+        with self.captureOnCommitCallbacks(execute=True):
+            user.username = "invalidation-alice2"
+            user.save()
+
+        self.assertNotIn(self.alice_key, self.cached_keys())
+
+    def test_export_computed_before_a_change_is_not_served(self):
+        cache.clear()
+        stale_key = versioned_key(self.alice_key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.promocode = "SALE"
+            self.order.save()
+        cache.set(stale_key, b"stale")
+
+        self.assertNotEqual(versioned_key(self.alice_key), stale_key)
+
+    def test_user_orders_export_is_refreshed(self):
+        cache.clear()
+        with translation.override("en"):
+            url = reverse("shop_app:user_orders_export", kwargs={"user_id": self.alice.pk})
+
+        orders = self.client.get(url).json()["invalidation-alice_orders"]
+        self.assertEqual(orders[0]["promocode"], "")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.promocode = "SALE"
+            self.order.save()
+
+        orders = self.client.get(url).json()["invalidation-alice_orders"]
+        self.assertEqual(orders[0]["promocode"], "SALE")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class GenerationCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="generation-user", password="qwerty123")
+        cls.product = Product.objects.create(name="Generation lamp", price="10.50")
+        cls.order = Order.objects.create(user=cls.user, delivery_address="Street 1")
+
+    def setUp(self):
+        cache.clear()
+        with translation.override("en"):
+            self.products_url = reverse("shop_app:product_set-list")
+            self.product_url = reverse("shop_app:product_set-detail", kwargs={"pk": self.product.pk})
+            self.order_url = reverse("shop_app:order_set-detail", kwargs={"pk": self.order.pk})
+
+    def get(self, url, **params):
+        return self.client.get(url, params, headers={"accept": "application/json"})
+
+    def test_list_is_cached_until_products_change(self):
+        search = {"search": "Generation", "ordering": "price"}
+        self.assertEqual(self.get(self.products_url, **search).json()["count"], 1)
+
+        with self.assertNumQueries(0):
+            response = self.get(self.products_url, ordering="price", search="Generation")
+        self.assertEqual(response.json()["count"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Generation desk", price="20.00")
+
+        self.assertEqual(self.get(self.products_url, **search).json()["count"], 2)
+
+    def test_detail_is_cached_until_product_changes(self):
+        self.assertEqual(self.get(self.product_url).json()["price"], "10.50")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(self.product_url).json()["price"], "10.50")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = "12.00"
+            self.product.save()
+
+        self.assertEqual(self.get(self.product_url).json()["price"], "12.00")
+
+    def test_unchanged_table_is_not_modified(self):
+        etag = self.get(self.products_url)["ETag"]
+        headers = {"accept": "application/json", "if-none-match": etag}
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.products_url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Generation chair")
+
+        response = self.client.get(self.products_url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_products_change_starts_new_generation(self):
+        self.assertEqual(self.get(self.order_url).json()["products"], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.products.add(self.product)
+
+        self.assertEqual(self.get(self.order_url).json()["products"], [self.product.pk])
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Conditional lamp", price="10.50")
+
+    def setUp(self):
+        with translation.override("en"):
+            self.urls = {
+                "details": reverse("shop_app:product_details", kwargs={"pk": self.product.pk}),
+                "list": reverse("shop_app:product_list"),
+                "feed": reverse("shop_app:product_feed"),
+            }
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers={"accept": "application/json", **headers})
+
+    def test_unchanged_resources_are_not_rendered(self):
+        for name, url in self.urls.items():
+            with self.subTest(name):
+                etag = self.get(url)["ETag"]
+
+                with self.assertNumQueries(1):
+                    response = self.get(url, if_none_match=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b"")
+
+    def test_changed_product_is_rendered(self):
+        etags = {name: self.get(url)["ETag"] for name, url in self.urls.items()}
+        ProductImage.objects.create(product=self.product, image="products/conditional.jpg")
+
+        for name, url in self.urls.items():
+            with self.subTest(name):
+                self.assertEqual(self.get(url, if_none_match=etags[name]).status_code, 200)
+
+    def test_feed_is_not_modified_since(self):
+        last_modified = self.get(self.urls["feed"])["Last-Modified"]
+
+        self.assertEqual(self.get(self.urls["feed"], if_modified_since=last_modified).status_code, 304)
+
+    def test_pages_depend_on_user(self):
+        etag = self.get(self.urls["details"])["ETag"]
+        self.client.force_login(User.objects.create_user(username="conditional-user", password="qwerty123"))
+
+        response = self.get(self.urls["details"], if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("private", response["Cache-Control"])
+        self.assertNotIn("Last-Modified", response)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class FragmentCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="fragment-user", password="qwerty123")
+        cls.product = Product.objects.create(name="Fragment lamp", price="10.50")
+        cls.orders = [Order.objects.create(user=cls.user, delivery_address=f"Street {idx}") for idx in range(3)]
+        for order in cls.orders:
+            order.products.add(cls.product)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        with translation.override("en"):
+            self.orders_url = reverse("shop_app:order_list")
+            self.products_url = reverse("shop_app:product_list")
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        products_queries = [query for query in queries if "shop_app_order_products" in query["sql"]]
+        return response, products_queries
+
+    def test_cached_order_rows_are_not_rendered(self):
+        response, products_queries = self.get(self.orders_url)
+        self.assertContains(response, "Fragment lamp", count=3)
+        self.assertEqual(len(products_queries), 2)  # orders with their products versions, products prefetch
+
+        response, products_queries = self.get(self.orders_url)
+        self.assertContains(response, "Fragment lamp", count=3)
+        self.assertEqual(len(products_queries), 1)
+
+    def test_changed_rows_are_rendered_again(self):
+        self.get(self.orders_url)
+        self.get(self.products_url)
+        self.product.name = "Fragment desk"
+        self.product.save()
+        self.orders[0].products.remove(self.product)
+
+        response, products_queries = self.get(self.orders_url)
+        self.assertContains(response, "Fragment desk", count=2)
+        self.assertNotContains(response, "Fragment lamp")
+        self.assertContains(self.get(self.products_url)[0], "Fragment desk")
+
+    def test_rows_depend_on_language(self):
+        self.get(self.products_url)
+
+        with translation.override("ru"):
+            response = self.client.get(reverse("shop_app:product_list"))
+        self.assertContains(response, "/ru/shop/products/")
+
+
+@override_settings(EXPORT_DELTA_LAG=0, EXPORT_DELTA_PAGE_SIZE=2)
+class DeltaExportViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username="delta-staff", password="qwerty123", is_staff=True)
+
+    def setUp(self):
+        with translation.override("en"):
+            self.products_url = reverse("shop_app:product_export_delta")
+            self.orders_url = reverse("shop_app:order_export_delta")
+        self.cursor = encode_cursor(timezone.now(), 0)
+
+    def get(self, url, since):
+        return self.client.get(url, {"since": since}).json()
+
+    def test_products_delta_pages(self):
+        products = [Product.objects.create(name=f"Delta {idx}") for idx in range(3)]
+
+        page = self.get(self.products_url, self.cursor)
+        self.assertEqual([row["pk"] for row in page["products"]], [p.pk for p in products[:2]])
+        self.assertTrue(page["has_more"])
+
+        page = self.get(self.products_url, page["next"])
+        self.assertEqual([row["pk"] for row in page["products"]], [products[2].pk])
+        self.assertFalse(page["has_more"])
+
+        products[0].price = 5
+        products[0].save()
+        page = self.get(self.products_url, page["next"])
+        self.assertEqual([(row["pk"], row["price"]) for row in page["products"]], [(products[0].pk, "5.00")])
+
+        empty = self.get(self.products_url, page["next"])
+        self.assertEqual((empty["products"], empty["next"]), ([], page["next"]))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.products_url, {"since": "forged"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_orders_delta_includes_changed_products(self):
+        order = Order.objects.create(user=self.staff, delivery_address="Delta street")
+        product = Product.objects.create(name="Delta order product")
+        self.client.force_login(self.staff)
+
+        page = self.get(self.orders_url, self.cursor)
+        self.assertEqual([(row["pk"], row["products"]) for row in page["orders"]], [(order.pk, [])])
+
+        order.products.add(product)
+        page = self.get(self.orders_url, page["next"])
+        self.assertEqual([(row["pk"], row["products"]) for row in page["orders"]], [(order.pk, [product.pk])])
+
+
 class OrdersListViewTestCase(TestCase):
 
     @classmethod
@@ -246,4 +625,292 @@ class OrdersExportViewTestCase(TestCase):
             ]
         }
         self.assertEqual(response.status_code, 200)
-        self.assertJSONEqual(response.content, expected_data)
+        self.assertJSONEqual(b"".join(response.streaming_content), expected_data)
+
+    def test_get_orders_ndjson_with_constant_queries(self):
+        with translation.override("en"):
+            url = reverse("shop_app:order_export")
+
+        # the session, the user and the two scans of orders and their products
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {"format": "ndjson"})
+            lines = b"".join(response.streaming_content).splitlines()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line)["pk"] for line in lines],
+            list(Order.objects.order_by("pk").values_list("pk", flat=True)),
+        )
+
+
+class SaveCsvFileTestCase(TestCase):
+    def test_save_csv_file_by_chunks(self):
+        file = BytesIO(
+            b"name,description,price,discount\n"
+            b"Lamp,Desk lamp,10.50,0\n"
+            b"Chair,Office chair,not-a-price,5\n"
+            b"Table,Wooden table,99,10\n"
+        )
+        report = save_csv_file(obj=Product, file=file, encoding="utf-8", chunk_size=2)
+
+        self.assertEqual(report.created, 2)
+        self.assertEqual(report.rejected, 1)
+        self.assertEqual(report.errors[0]["line"], 2)
+        self.assertIn("price", report.errors[0]["error"])
+        self.assertQuerySetEqual(
+            Product.objects.filter(name__in=["Lamp", "Chair", "Table"])
+            .order_by("name")
+            .values_list("name", flat=True),
+            ["Lamp", "Table"],
+        )
+
+
+class UpsertCsvFileTestCase(TestCase):
+    csv_data = (
+        b"sku,name,description,price,discount\n"
+        b"UP-1,Upsert lamp,Desk lamp,10.50,0\n"
+        b"UP-2,Upsert chair,Office chair,25,5\n"
+    )
+
+    def test_upsert_creates_updates_and_skips_unchanged_rows(self):
+        report = save_csv_file(obj=Product, file=BytesIO(self.csv_data), encoding="utf-8", upsert_key="sku")
+        self.assertEqual((report.created, report.updated, report.unchanged), (2, 0, 0))
+        lamp = Product.objects.get(sku="UP-1")
+
+        file = BytesIO(
+            b"sku,name,description,price,discount\n"
+            b"UP-1,Upsert lamp,Desk lamp,10.5,0\n"
+            b"UP-2,Upsert chair,Office chair,30,5\n"
+            b",Upsert sofa,No SKU,50,0\n"
+        )
+        # one query for the existing hashes, the savepoint pair and one upsert of the changed row
+        with self.assertNumQueries(4):
+            report = save_csv_file(obj=Product, file=file, encoding="utf-8", upsert_key="sku")
+
+        self.assertEqual((report.created, report.updated, report.unchanged, report.rejected), (0, 1, 1, 1))
+        self.assertIn("sku", report.errors[0]["error"])
+        self.assertEqual(Product.objects.filter(sku__startswith="UP-").count(), 2)
+        self.assertEqual(Product.objects.get(sku="UP-2").price, 30)
+        self.assertEqual(Product.objects.get(sku="UP-1").pk, lamp.pk)
+
+    def test_upsert_skips_unchanged_rows_with_foreign_key(self):
+        user = User.objects.create_user(username="upsert-user", password="qwerty123")
+        csv_data = (
+            b"sku,name,price,created_by_id\n"
+            + f"UP-3,Upsert desk,70,{user.pk}\nUP-4,Upsert shelf,15,{user.pk}\n".encode()
+        )
+        save_csv_file(obj=Product, file=BytesIO(csv_data), encoding="utf-8", upsert_key="sku")
+
+        # one query for the existing hashes, nothing is written
+        with self.assertNumQueries(1):
+            report = save_csv_file(obj=Product, file=BytesIO(csv_data), encoding="utf-8", upsert_key="sku")
+
+        self.assertEqual((report.created, report.updated, report.unchanged), (0, 0, 2))
+
+    def test_upsert_requires_unique_field(self):
+        with self.assertRaises(ValueError):
+            save_csv_file(obj=Product, file=BytesIO(self.csv_data), encoding="utf-8", upsert_key="name")
+
+
+class SaveOrdersFileTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="importer", password="qwerty123")
+        cls.lamp = Product.objects.create(name="Import lamp")
+        cls.table = Product.objects.create(name="Import table")
+
+    def test_save_orders_csv_file(self):
+        file = BytesIO(
+            b"user,products,promocode,delivery_address\n"
+            b'importer,"Import lamp, Import table",SALE,Moscow\n'
+            b"ghost,Import lamp,,Moscow\n"
+            b"importer,Import sofa,,Moscow\n"
+        )
+        with self.assertNumQueries(6):
+            report = save_csv_file(obj=Order, file=file, encoding="utf-8", exclude_key="products")
+
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.rejected, 2)
+        self.assertEqual(report.errors[0], {"line": 2, "error": {"user": ["Unknown user: ghost"]}})
+        self.assertEqual(report.errors[1], {"line": 3, "error": {"products": ["Unknown products: Import sofa"]}})
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.promocode, "SALE")
+        self.assertEqual(set(order.products.all()), {self.lamp, self.table})
+
+    def test_save_orders_json_file(self):
+        file = BytesIO(
+            b'{"order1": {"user": "importer", "products": ["Import table"], "promocode": "",'
+            b' "delivery_address": "Smolensk"}}'
+        )
+        report = save_json_file(obj=Order, file=file, encoding="utf-8", exclude_key="products")
+
+        self.assertEqual(report.created, 1)
+        self.assertEqual(list(Order.objects.get(user=self.user).products.all()), [self.table])
+
+    @override_settings(IMPORT_JSON_READ_SIZE=7)
+    def test_save_orders_json_file_by_small_blocks(self):
+        file = BytesIO(
+            ",".join(
+                f'"order{idx}": {{"user": "importer", "products": ["Import lamp"], "promocode": "{idx}",'
+                f' "delivery_address": "Брянск, ул. Ленина {idx}"}}'
+                for idx in range(25)
+            )
+            .join(["{\n", "\n}\n"])
+            .encode()
+        )
+        report = save_json_file(obj=Order, file=file, encoding="utf-8", exclude_key="products", chunk_size=10)
+
+        self.assertEqual(report.created, 25)
+        self.assertEqual(
+            list(Order.objects.filter(user=self.user).order_by("pk").values_list("promocode", flat=True)),
+            [str(idx) for idx in range(25)],
+        )
+
+    def test_save_orders_ndjson_file(self):
+        file = BytesIO(
+            b'{"user": "importer", "products": ["Import lamp"], "delivery_address": "Tula"}\n'
+            b"\n"
+            b'{"user": "importer", "products": ["Import table"], "delivery_address": "Orel"}\n'
+        )
+        report = save_json_file(obj=Order, file=file, encoding="utf-8", exclude_key="products", lines=True)
+
+        self.assertEqual(report.created, 2)
+
+
+class ProductUploadCsvTestCase(TestCase):
+    def setUp(self):
+        self.upload_root = TemporaryDirectory()
+        self.addCleanup(self.upload_root.cleanup)
+
+    def test_upload_csv_runs_as_job(self):
+        file = SimpleUploadedFile("products.csv", b"name,price\nUpload lamp,10\nUpload table,x\n")
+
+        with self.settings(JOB_UPLOAD_ROOT=self.upload_root.name):
+            response = self.client.post(reverse("shop_app:product_set-upload-csv"), {"file": file})
+            self.assertEqual(response.status_code, 202)
+            self.assertFalse(Product.objects.filter(name="Upload lamp").exists())
+
+            run_job(claim_next())
+
+        job = Job.objects.get(pk=response.json()["job"])
+        self.assertEqual(job.status, Job.Status.SUCCEEDED)
+        self.assertEqual((job.result["created"], job.result["rejected"]), (1, 1))
+        self.assertEqual(job.progress, 2)
+        self.assertTrue(Product.objects.filter(name="Upload lamp").exists())
+
+
+class ProductDownloadCsvTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(name="Export lamp", description="Desk, lamp", price="10.50")
+        Product.objects.create(name="Export chair", price="25.00", discount=5)
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_download_csv_is_streamed(self):
+        with translation.override("en"):
+            url = reverse("shop_app:product_set-download-csv")
+
+        response = self.client.get(url, {"search": "Export", "ordering": "name"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            b"".join(response.streaming_content).decode(),
+            "name,description,price,discount\r\n"
+            "Export chair,,25.00,5\r\n"
+            'Export lamp,"Desk, lamp",10.50,0\r\n',
+        )
+
+
+class ProductAdminExportCsvTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="admin-exporter", password="qwerty123")
+        cls.products = [
+            Product.objects.create(name=f"Admin export {idx}", price="1.00", created_by=cls.user) for idx in range(3)
+        ]
+
+    def test_export_csv_streams_fk_ids_and_related_columns(self):
+        model_admin = ProductAdmin(Product, admin.site)
+        queryset = Product.objects.filter(created_by=self.user).order_by("pk")
+
+        with self.assertNumQueries(1):
+            response = model_admin.export_csv(RequestFactory().get("/"), queryset)
+            rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+
+        self.assertIn("created_by_id", rows[0])
+        self.assertEqual(rows[0][-1], "created_by__username")
+        self.assertEqual([row[0] for row in rows[1:]], [str(product.pk) for product in self.products])
+        self.assertEqual({row[-1] for row in rows[1:]}, {"admin-exporter"})
+        self.assertEqual({row[rows[0].index("created_by_id")] for row in rows[1:]}, {str(self.user.pk)})
+
+
+class ExportSnapshotTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Snapshot lamp", price="3.00")
+
+    def setUp(self):
+        self.media_root = TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        with translation.override("en"):
+            self.url = reverse("shop_app:product_export")
+
+    def test_build_snapshots_writes_plain_and_gzip_files(self):
+        with self.settings(MEDIA_ROOT=self.media_root.name):
+            sizes = build_snapshots(["products.json", "orders.csv"])
+            path = snapshot_path("products.json")
+
+            self.assertEqual(sizes["products.json"], path.stat().st_size)
+            self.assertEqual(gzip.decompress(Path(f"{path}.gz").read_bytes()), path.read_bytes())
+            products = json.loads(path.read_bytes())["products"]
+            self.assertIn(
+                {"pk": self.product.pk, "name": "Snapshot lamp", "price": "3.00", "archived": False}, products
+            )
+            self.assertEqual(snapshot_path("orders.csv").read_text().splitlines()[0], ",".join(ORDER_FIELDS))
+
+    @override_settings(EXPORT_ACCEL_REDIRECT=True)
+    def test_export_view_redirects_to_snapshot(self):
+        with self.settings(MEDIA_ROOT=self.media_root.name):
+            response = self.client.get(self.url)
+            self.assertTrue(response.streaming)
+
+            build_snapshots(["products.json"])
+            response = self.client.get(self.url, headers={"accept-encoding": "gzip"})
+
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-exports/products.json.gz")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, b"")
+
+    @override_settings(EXPORT_ACCEL_REDIRECT=True)
+    def test_changes_enqueue_one_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Snapshot chair")
+            self.product.save()
+
+        self.assertEqual(Job.objects.filter(task="shop_app.tasks.build_export_snapshots").count(), 1)
+
+
+class ParallelImportTestCase(TestCase):
+    def setUp(self):
+        self.file = NamedTemporaryFile("w", suffix=".csv", encoding="utf-8")
+        self.addCleanup(self.file.close)
+        self.file.write("name,price\n")
+        self.file.writelines(f"Parallel {idx},{idx if idx != 7 else 'x'}\n" for idx in range(20))
+        self.file.flush()
+
+    def test_find_shards(self):
+        header_size, shards = find_shards(self.file.name, shard_size=50)
+
+        self.assertEqual(header_size, len("name,price\n"))
+        self.assertGreater(len(shards), 1)
+        self.assertEqual(shards[0][0], header_size)
+        self.assertEqual(shards[-1][1], os.path.getsize(self.file.name))
+        self.assertTrue(all(end == start for (_, end), (start, _) in zip(shards, shards[1:])))
+
+    def test_import_csv_parallel(self):
+        report = import_csv_parallel(Product, self.file.name, workers=2, shard_size=50)
+
+        self.assertEqual((report.created, report.rejected), (19, 1))
+        self.assertIn("price", report.errors[0]["error"])
+        self.assertEqual(Product.objects.filter(name__startswith="Parallel ").count(), 19)
@@ -15,6 +15,7 @@ from .views import (
     OrderCreateView,
     OrderDeleteView,
     OrdersDataExportView,
+    OrdersDeltaExportView,
     OrdersDetailView,
     OrdersListView,
     OrderUpdateView,
@@ -23,6 +24,7 @@ from .views import (
     ProductDeleteView,
     ProductDetailsView,
     ProductsDataExportView,
+    ProductsDeltaExportView,
     ProductsListView,
     ProductUpdateView,
     ProductViewSet,
@@ -44,6 +46,7 @@ urlpatterns = [
     path("api/", include(routers.urls)),
     path("products/", ProductsListView.as_view(), name="product_list"),
     path("products/export/", ProductsDataExportView.as_view(), name="product_export"),
+    path("products/export/delta/", ProductsDeltaExportView.as_view(), name="product_export_delta"),
     path("products/create/", ProductCreateView.as_view(), name="product_create"),
     path("products/<int:pk>/", ProductDetailsView.as_view(), name="product_details"),
     path("products/<int:pk>/update/", ProductUpdateView.as_view(), name="product_update"),
@@ -51,6 +54,7 @@ urlpatterns = [
     path("products/latest/feed/", LatestProductsFeed(), name="product_feed"),
     path("orders/", OrdersListView.as_view(), name="order_list"),
     path("orders/export/", OrdersDataExportView.as_view(), name="order_export"),
+    path("orders/export/delta/", OrdersDeltaExportView.as_view(), name="order_export_delta"),
     path("orders/create/", OrderCreateView.as_view(), name="order_create"),
     path("orders/<int:pk>/", OrdersDetailView.as_view(), name="order_details"),
     path("orders/<int:pk>/update/", OrderUpdateView.as_view(), name="order_update"),
@@ -5,10 +5,11 @@ related to products and orders, including listing, creating, updating, and delet
 """
 
 import logging
-from csv import DictWriter
+from http import HTTPStatus
 from timeit import default_timer
 from typing import Any
 
+from django.conf import settings
 from django.contrib.auth.mixins import (
     LoginRequiredMixin,
     PermissionRequiredMixin,
@@ -16,8 +17,7 @@ from django.contrib.auth.mixins import (
 )
 from django.contrib.auth.models import Group, User
 from django.contrib.syndication.views import Feed
-from django.core.cache import cache
-from django.db.models import Prefetch
+from django.db.models import Count, Max, Prefetch
 from django.db.models.query import QuerySet
 from django.forms import Form
 from django.http import (
@@ -26,13 +26,13 @@ from django.http import (
     HttpResponse,
     HttpResponseRedirect,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
 from django.views import View
-from django.views.decorators.cache import cache_page
 from django.views.generic import (
     CreateView,
     DeleteView,
@@ -43,6 +43,8 @@ from django.views.generic import (
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import OpenApiResponse, extend_schema
 from faker import Faker
+from jobsapp.models import Job
+from jobsapp.queue import enqueue, store_upload
 from rest_framework.decorators import action
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.parsers import MultiPartParser
@@ -50,10 +52,18 @@ from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
-from .common import save_csv_file
+from my_site import singleflight
+from my_site.conditional import State, conditional_view, table_state
+
+from .api_mixins import GenerationCacheMixin
+from .exports import EXPORTS, add_order_products, cached_export_response, delta_page, iter_queryset_csv
 from .forms import GroupForm, OrderForm, ProductForm
+from .fragments import render_rows
+from .invalidation import products_export_key, user_orders_export_key, versioned_key
 from .models import Order, Product, ProductImage
 from .serializers import OrderSerializer, ProductSerializer
+from .snapshots import snapshot_response
+from .tasks import import_products_file
 
 logger = logging.getLogger(__name__)
 fake: Faker = Faker("ru_RU")
@@ -149,8 +159,19 @@ class GroupsListView(View):
 #     return render(request, "shop_app/groups-list.html", context=context)
 
 
+def product_state(request: HttpRequest, *args: Any, pk: int, **kwargs: Any) -> State | None:
+    """Returns the validators of the pages of a product, None if it does not exist."""
+    updated_at = Product.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+    return None if updated_at is None else (updated_at, updated_at)
+
+
+def products_state(request: HttpRequest, *args: Any, **kwargs: Any) -> State:
+    """Returns the validators of the pages listing products."""
+    return table_state(Product.objects.all())
+
+
 @extend_schema(description="Product view CRUD")
-class ProductViewSet(ModelViewSet):  # type: ignore
+class ProductViewSet(GenerationCacheMixin, ModelViewSet):  # type: ignore
     """
     API viewset for managing products.
 
@@ -159,8 +180,11 @@ class ProductViewSet(ModelViewSet):  # type: ignore
     - serializer_class: The serializer used for product representation.
 
     Filtering and searching capabilities are enabled through Django filters.
+    The list and detail responses are cached until a product changes, conditional
+    requests are answered with 304 meanwhile.
     """
 
+    cache_models = [Product]
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     filter_backends = [
@@ -178,12 +202,6 @@ class ProductViewSet(ModelViewSet):  # type: ignore
     ]  # фильтр по полям
     ordering_fields = ["name", "price", "discount"]  # сортировка по полям
 
-    @method_decorator(cache_page(60 * 2))
-    def list(self, *args, **kwargs):
-        """Override parent class ModelViewSet list all products."""
-        # print("Hello products list")
-        return super().list(*args, **kwargs)
-
     @extend_schema(
         summary="Get product one by ID",
         description="Retrieves product, returns 404 if not found",
@@ -206,20 +224,20 @@ class ProductViewSet(ModelViewSet):  # type: ignore
         return super().retrieve(*args, **kwargs)
 
     @action(methods=["get"], detail=False)
-    def download_csv(self, request: Request) -> HttpResponse:
-        """Function download products in .csv file using rest framework django"""
-        response: HttpResponse = HttpResponse(content_type="text/csv")
-        filename: str = "products-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
+    def download_csv(self, request: Request) -> StreamingHttpResponse:
+        """
+        Function download products in .csv file using rest framework django.
+
+        The search, filter and ordering parameters of the list are applied, the file is
+        streamed by chunks of rows, so the export of any number of products uses constant memory.
+        """
         queryset = self.filter_queryset(self.get_queryset())
         fields: list[str] = ["name", "description", "price", "discount"]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for product in queryset:
-            writer.writerow({field: getattr(product, field) for field in fields})
-
+        response: StreamingHttpResponse = StreamingHttpResponse(
+            iter_queryset_csv(queryset, fields), content_type="text/csv"
+        )
+        filename: str = "products-export.csv"
+        response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
 
     @action(methods=["post"], detail=False, parser_classes=[MultiPartParser])
@@ -228,14 +246,31 @@ class ProductViewSet(ModelViewSet):  # type: ignore
         Function upload products from .csv file using rest framework django, to run,
         you need a command in the terminal
         'curl -X POST -F 'file=@devices.csv' http://127.0.0.1:8000/ru/shop/api/products/upload_csv/'
+
+        The import runs as a background job, the response contains the URL for polling its status.
+        The optional 'workers' field sets the number of processes parsing the file in parallel,
+        with 'mode=upsert' the rows update the products with the same SKU.
         """
-        products: list[Product] = save_csv_file(
-            obj=Product, file=request.FILES["file"].file, encoding=request.encoding
+        try:
+            workers: int = min(max(int(request.data.get("workers") or 1), 1), 64)
+        except ValueError:
+            return Response({"workers": "A valid integer is required."}, status=HTTPStatus.BAD_REQUEST)
+
+        job: Job = enqueue(
+            import_products_file,
+            user=request.user,
+            path=store_upload(request.FILES["file"]),
+            encoding=request.encoding,
+            workers=workers,
+            upsert=request.data.get("mode") == "upsert",
+        )
+        return Response(
+            {"job": job.pk, "status": job.status, "url": request.build_absolute_uri(job.get_absolute_url())},
+            status=HTTPStatus.ACCEPTED,
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
 
 
+@method_decorator(conditional_view(product_state, per_user=True), name="dispatch")
 class ProductDetailsView(DetailView):  # type: ignore
     """
     View to display detailed information about a specific product.
@@ -243,6 +278,8 @@ class ProductDetailsView(DetailView):  # type: ignore
     Attributes:
     - template_name: The template used to render product details.
     - queryset: The set of products to retrieve details from.
+
+    Conditional requests are answered with 304 while the product and its images are unchanged.
     """
 
     template_name = "shop_app/products-details.html"
@@ -258,6 +295,7 @@ class ProductDetailsView(DetailView):  # type: ignore
 #         return render(request, "shop_app/products-details.html", context=context)
 
 
+@method_decorator(conditional_view(products_state, per_user=True), name="dispatch")
 class ProductsListView(ListView):  # type: ignore
     """
     View to list all available products.
@@ -266,6 +304,8 @@ class ProductsListView(ListView):  # type: ignore
     - template_name: The template used to render the list of products.
 
     Only non-archived products are displayed in this view.
+    Conditional requests are answered with 304 while the products are unchanged,
+    the rendered rows are cached by product version, see shop_app.fragments.
     """
 
     template_name = "shop_app/products-list.html"
@@ -273,6 +313,14 @@ class ProductsListView(ListView):  # type: ignore
     context_object_name = "products"
     queryset = Product.objects.filter(archived=False)
 
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        """Adds the rows of the products, rendered again only for the products changed since they were cached."""
+        context: dict[str, Any] = super().get_context_data(**kwargs)
+        context["product_rows"] = render_rows(
+            "shop_app/product_row.html", context["products"], lambda product: product.updated_at, name="product"
+        )
+        return context
+
 
 # class ProductsListView(TemplateView):
 #     template_name = "shop_app/products-list.html"
@@ -460,39 +508,61 @@ class ProductsDataExportView(View):
     - get: Handles GET requests and returns a JSON response containing all product data.
     """
 
-    def get(self, request: HttpRequest) -> JsonResponse:
+    def get(self, request: HttpRequest) -> HttpResponse | StreamingHttpResponse:
         """
-        Handle GET requests to export product data in JSON format.
+        Handle GET requests to export product data in JSON format, or .csv with '?format=csv'.
+
+        A built snapshot is sent by nginx with X-Accel-Redirect if it is enabled. Otherwise
+        the rows are read with values_list and encoded incrementally, the response is
+        gzipped for clients accepting it. The encoded bytes are cached until a product
+        changes, see shop_app.invalidation.
 
         Args:
             request (HttpRequest): The HTTP request object.
 
         Returns:
-            JsonResponse: A JSON response containing all product data, including
-            product primary key, name, price, and archived status.
-        """
-        cache_key = "products_data_export"
-        products_data = cache.get(cache_key)
-
-        if products_data is None:
-            products = Product.objects.order_by("pk").all()
-            products_data = {
-                "products": [
-                    {
-                        "pk": product.pk,
-                        "name": product.name,
-                        "price": product.price,
-                        "archived": product.archived,
-                    }
-                    for product in products
-                ]
-            }
-            elem = products_data["products"][0]
-            product_name = elem["name"]
-            print(product_name)
-            cache.set(cache_key, products_data, 300)
-
-        return JsonResponse(products_data, safe=False)
+            HttpResponse | StreamingHttpResponse: A JSON response containing all product data,
+            including product primary key, name, price, and archived status.
+        """
+        name: str = "products.csv" if request.GET.get("format") == "csv" else "products.json"
+        response: HttpResponse | StreamingHttpResponse | None = snapshot_response(request, name)
+
+        if response is None:
+            content_type, chunks = EXPORTS[name]
+            response = cached_export_response(
+                request,
+                chunks,
+                content_type=content_type,
+                cache_key=versioned_key(products_export_key(name)),
+                timeout=settings.EXPORT_CACHE_TIMEOUT,
+            )
+        return response
+
+
+class ProductsDeltaExportView(View):
+    """
+    Incremental export of the products created or modified after a keyset cursor.
+
+    Methods:
+    - get: Returns a page of changed products and the cursor of the next page.
+    """
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        """
+        Handle GET requests with the optional 'since' cursor of the previous page.
+
+        Returns:
+            JsonResponse: The changed products ordered by modification time, the 'next'
+            cursor and 'has_more', or a 400 response for an invalid cursor.
+        """
+        try:
+            rows, next_cursor, has_more = delta_page(
+                Product.objects.all(), ("sku", "name", "price", "archived"), since=request.GET.get("since")
+            )
+        except ValueError:
+            return JsonResponse({"since": [_("Invalid cursor.")]}, status=HTTPStatus.BAD_REQUEST)
+
+        return JsonResponse({"products": rows, "next": next_cursor, "has_more": has_more})
 
 
 class LatestProductsFeed(Feed):
@@ -504,6 +574,11 @@ class LatestProductsFeed(Feed):
     link: str = reverse_lazy("shop_app:product_list")
     description: str = _("Current products sold in the store.")
 
+    @method_decorator(conditional_view(products_state))
+    def __call__(self, request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        """Returns the feed, or 304 while the products are unchanged."""
+        return super().__call__(request, *args, **kwargs)
+
     def items(self) -> QuerySet[Product]:
         """Returns a QuerySet of objects Product."""
         return (
@@ -524,7 +599,7 @@ class LatestProductsFeed(Feed):
         return short_description
 
 
-class OrderViewSet(ModelViewSet):  # type: ignore
+class OrderViewSet(GenerationCacheMixin, ModelViewSet):  # type: ignore
     """
     API viewset for managing orders.
 
@@ -533,8 +608,11 @@ class OrderViewSet(ModelViewSet):  # type: ignore
     - serializer_class: The serializer used for order representation.
 
     Filtering and searching capabilities are enabled through Django filters.
+    The list and detail responses are cached until an order or its products change,
+    conditional requests are answered with 304 meanwhile.
     """
 
+    cache_models = [Order]
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     filter_backends = [
@@ -564,11 +642,34 @@ class OrdersListView(LoginRequiredMixin, ListView):  # type: ignore
     - queryset: The set of orders associated with users that are logged in.
 
     This view ensures that only authenticated users can access their order history.
+    The rendered rows are cached by order version, see shop_app.fragments: the version
+    includes the latest change and the number of the products of the order, read with
+    the orders, and the products are prefetched only for the rows rendered again.
     """
 
-    queryset = Order.objects.select_related("user").prefetch_related("products")
+    queryset = Order.objects.select_related("user").annotate(
+        products_updated_at=Max("products__updated_at"), products_count=Count("products")
+    )
     # context_object_name = "orders"
 
+    def get_context_data(self, **kwargs: Any) -> dict[str, Any]:
+        """Adds the rows of the orders, rendered again only for the orders changed since they were cached."""
+        context: dict[str, Any] = super().get_context_data(**kwargs)
+        context["order_rows"] = render_rows(
+            "shop_app/order_row.html",
+            context["object_list"],
+            lambda order: (
+                order.updated_at,
+                order.products_updated_at,
+                order.products_count,
+                order.user.username,
+                order.user.first_name,
+            ),
+            name="order",
+            prefetch=["products"],
+        )
+        return context
+
 
 # def order_list(request: HttpRequest) -> HttpResponse:
 #     context = {"orders": Order.objects.select_related("user").prefetch_related("products").all()}
@@ -687,32 +788,61 @@ class OrdersDataExportView(UserPassesTestMixin, View):
         """
         return True if self.request.user.is_staff else False
 
-    def get(self, request: HttpRequest) -> JsonResponse:
+    def get(self, request: HttpRequest) -> HttpResponse | StreamingHttpResponse:
         """
         Export order data in JSON format for GET requests.
 
+        With '?format=ndjson' one order is sent per line, '?format=csv' sends a .csv file.
+        A built snapshot is sent by nginx with X-Accel-Redirect if it is enabled, otherwise
+        the orders are streamed with a constant number of queries.
+
         Args:
             request (HttpRequest): The HTTP request object.
 
         Returns:
-            JsonResponse: A JSON response containing all order data, including
+            HttpResponse | StreamingHttpResponse: A JSON response containing all order data, including
             order primary key, user primary key, product primary keys,
             promocode, and delivery address.
         """
-        orders = Order.objects.order_by("pk").all()
-        orders_data = {
-            "orders": [
-                {
-                    "pk": order.pk,
-                    "user": order.user.pk,
-                    "products": [product.pk for product in order.products.all()],
-                    "promocode": order.promocode,
-                    "delivery_address": order.delivery_address,
-                }
-                for order in orders
-            ]
-        }
-        return JsonResponse(orders_data, safe=False)
+        name: str = f"orders.{request.GET.get('format')}"
+        if name not in EXPORTS:
+            name = "orders.json"
+
+        response: HttpResponse | None = snapshot_response(request, name)
+        if response is not None:
+            return response
+
+        content_type, chunks = EXPORTS[name]
+        return StreamingHttpResponse(chunks(), content_type=content_type)
+
+
+class OrdersDeltaExportView(UserPassesTestMixin, View):
+    """
+    Incremental export of the orders created or modified after a keyset cursor, for staff only.
+
+    Changing the products of an order updates its modification time too.
+    """
+
+    def test_func(self) -> bool:
+        """Checks if the user is staff."""
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        """
+        Handle GET requests with the optional 'since' cursor of the previous page.
+
+        Returns:
+            JsonResponse: The changed orders with the primary keys of their products, the 'next'
+            cursor and 'has_more', or a 400 response for an invalid cursor.
+        """
+        try:
+            rows, next_cursor, has_more = delta_page(
+                Order.objects.all(), ("user", "promocode", "delivery_address"), since=request.GET.get("since")
+            )
+        except ValueError:
+            return JsonResponse({"since": [_("Invalid cursor.")]}, status=HTTPStatus.BAD_REQUEST)
+
+        return JsonResponse({"orders": add_order_products(rows), "next": next_cursor, "has_more": has_more})
 
 
 class UserOrdersListView(LoginRequiredMixin, ListView):
@@ -767,34 +897,40 @@ class UserOrdersExportView(View):
             raise Http404(_("User ID is missing."))
         return get_object_or_404(User, pk=user_id)
 
+    def get_orders_data(self, user_id: int) -> dict[str, list[dict[str, Any]]]:
+        """Returns the orders of the user with their products, keyed by the username."""
+        user: User = self._get_user(user_id)
+        user_orders: QuerySet[Order] = (
+            Order.objects.filter(user=user)
+            .select_related("user")
+            .prefetch_related(Prefetch("products", queryset=Product.objects.only("pk").order_by("pk")))
+            .order_by("pk")
+        )
+        key_user_orders: str = user.username + "_orders"
+        return {
+            key_user_orders: [
+                {
+                    "pk": order.pk,
+                    "created_at": order.created_at,
+                    "promocode": order.promocode,
+                    "delivery_address": order.delivery_address,
+                    "products": ([product.pk for product in order.products.all()]),
+                    "receipt": order.receipt.path if order.receipt else None,
+                }
+                for order in user_orders
+            ]
+        }
+
     def get(self, request: HttpRequest, user_id: int) -> JsonResponse:
-        """Returns a JSON response with the list of orders for the specified user by ID."""
-        cache_key: str = "user_orders_data_export" + str(user_id)
-        user_orders_data: dict[str, dict[str, int | str | list[int]]] | None = cache.get(cache_key)
-
-        if user_orders_data is None:
-            user: User = self._get_user(user_id)
-            user_orders: Order = (
-                Order.objects.filter(user=user)
-                .select_related("user")
-                .prefetch_related(
-                    Prefetch("products", queryset=Product.objects.only("pk").order_by("pk"))
-                )
-                .order_by("pk")
-            )
-            key_user_orders: str = user.username + "_orders"
-            user_orders_data: dict[str, dict[str, int | str | list[int]]] = {
-                key_user_orders: [
-                    {
-                        "pk": order.pk,
-                        "created_at": order.created_at,
-                        "promocode": order.promocode,
-                        "delivery_address": order.delivery_address,
-                        "products": ([product.pk for product in order.products.all()]),
-                        "receipt": order.receipt.path if order.receipt else None,
-                    }
-                    for order in user_orders
-                ]
-            }
-            cache.set(cache_key, user_orders_data, 300)
+        """
+        Returns a JSON response with the list of orders for the specified user by ID.
+
+        The data is cached until an order of the user changes, see shop_app.invalidation,
+        and computed by one request at a time, see my_site.singleflight.
+        """
+        user_orders_data: dict[str, list[dict[str, Any]]] = singleflight.get_or_compute(
+            versioned_key(user_orders_export_key(user_id)),
+            lambda: self.get_orders_data(user_id),
+            settings.EXPORT_CACHE_TIMEOUT,
+        )
         return JsonResponse(data=user_orders_data, safe=False)